@@ -10,8 +10,117 @@ class Config(object):
     RESPONSE_TIMEOUT = 600
     MAX_QUEUE_SIZE = 10
 
+    # DB worker pool grows with queue depth and shrinks back after
+    # WORKER_IDLE_TIMEOUT seconds without work
+    WORKER_POOL_MIN = 1
+    WORKER_POOL_MAX = 8
+    WORKER_IDLE_TIMEOUT = 30
+    # On shutdown, jobs already accepted get up to WORKER_DRAIN_TIMEOUT
+    # seconds to finish before the workers are cancelled
+    WORKER_DRAIN_TIMEOUT = 30
+    # Jobs for the same user hash to one of these partitions and run in order
+    WORKER_PARTITIONS = 16
+
+    # 'memory' keeps jobs in a per-process WorkerPool, 'redis' shares a
+    # durable Redis stream between every worker process and host
+    QUEUE_BACKEND = os.environ.get("QUEUE_BACKEND", 'memory')
+    QUEUE_STREAM = 'hermes:jobs'
+    QUEUE_CONSUMERS = 2
+    QUEUE_VISIBILITY_TIMEOUT = 60
+    QUEUE_MAX_DELIVERIES = 5
+    # Jobs enqueued but not yet acknowledged, across every process, past
+    # which new jobs are turned away
+    QUEUE_MAX_BACKLOG = 1000
+    # Job rows are staged in Redis lists this many rows per entry, and
+    # expire if no worker picks the job up in time
+    QUEUE_STAGING_CHUNK_SIZE = 5000
+    QUEUE_STAGING_TTL = 86400
+
+    # Write-behind task log: flush when this many events are buffered,
+    # or after this many seconds, whichever comes first
+    TASK_LOG_BATCH_SIZE = 500
+    TASK_LOG_FLUSH_INTERVAL = 0.5
+
+    # Process pool for CPU-heavy work (large request bodies). Calls with
+    # payloads under CPU_OFFLOAD_THRESHOLD bytes stay inline, and a pool
+    # size of 0 disables offloading. benchmarks/offload.py put the point
+    # where a pool call costs the worker less than parsing inline at about
+    # 256KB, so JWTs never leave the event loop
+    CPU_POOL_SIZE = 2
+    CPU_OFFLOAD_THRESHOLD = 262144
+
+    # Two-tier user cache: an in-process LRU (which bounds staleness
+    # across workers) in front of a shared Redis tier
+    USER_CACHE_SIZE = 10000
+    USER_CACHE_TTL = 30
+    USER_CACHE_REDIS_TTL = 300
+
+    # Verified JWT claims are cached until the token's exp, and for at
+    # most JWT_CACHE_MAX_TTL seconds
+    JWT_CACHE_SIZE = 10000
+    JWT_CACHE_MAX_TTL = 300
+
+    # Fraction of withOauth(fast=True) calls recorded as logins
+    LOGIN_TRACK_SAMPLE_RATE = 0.1
+
+    # Seconds between flushes of Redis login counters into tasks and
+    # users.last_fetch
+    LOGIN_FLUSH_INTERVAL = 60
+
+    # A login window claimed by a flusher that hasn't released it after
+    # LOGIN_CLAIM_LEASE seconds is taken to be abandoned and merged back.
+    # Keep it well above the time a flush takes
+    LOGIN_CLAIM_LEASE = 600
+
+    # Live task state in Redis expires TASK_STATUS_TTL seconds after its
+    # last update. Ids found in neither Redis nor Postgres are remembered
+    # as unknown for TASK_STATUS_MISS_TTL seconds
+    TASK_STATUS_TTL = 86400
+    TASK_STATUS_MISS_TTL = 5
+
+    # tasks is partitioned by month. Partitions are created
+    # TASK_PARTITIONS_AHEAD months early, and those more than
+    # TASK_RETENTION_MONTHS months old are rolled up into task_rollups and
+    # dropped. Checked every TASK_RETENTION_INTERVAL seconds
+    TASK_RETENTION_MONTHS = 12
+    TASK_PARTITIONS_AHEAD = 2
+    TASK_RETENTION_INTERVAL = 3600
+
+    # Max number of independent tables a DB_INSERT job loads at once
+    INGEST_CONCURRENCY = 4
+
     NEXT_URL = "http://localhost:3000"
 
+    # OAuth code-for-token exchange in /oauth2callback. 'aiohttp' posts
+    # over a pooled session, 'thread' runs the blocking oauthlib call on a
+    # thread pool. OAUTH_TOKEN_URI overrides the client secrets' token_uri,
+    # eg to point at a local stand-in
+    TOKEN_EXCHANGE_BACKEND = os.environ.get("TOKEN_EXCHANGE_BACKEND", 'aiohttp')
+    TOKEN_EXCHANGE_TIMEOUT = 10
+    TOKEN_EXCHANGE_CONCURRENCY = 20
+    OAUTH_TOKEN_URI = os.environ.get("OAUTH_TOKEN_URI", None)
+
+    # Google access tokens are refreshed CREDENTIAL_REFRESH_LEAD seconds
+    # before they expire, checked every CREDENTIAL_REFRESH_INTERVAL seconds
+    # in batches of CREDENTIAL_REFRESH_BATCH users. A failed refresh is
+    # retried after CREDENTIAL_REFRESH_LEASE seconds
+    CREDENTIAL_REFRESH_INTERVAL = 30
+    CREDENTIAL_REFRESH_LEAD = 300
+    CREDENTIAL_REFRESH_BATCH = 50
+    CREDENTIAL_REFRESH_CONCURRENCY = 5
+    CREDENTIAL_REFRESH_LEASE = 120
+
+    # Google Credentials objects built by @authorized are reused per session
+    # for up to CREDENTIAL_CACHE_TTL seconds, capped at CREDENTIAL_REFRESH_LEAD
+    # so other processes see refreshed tokens before the old ones expire
+    CREDENTIAL_CACHE_SIZE = 10000
+    CREDENTIAL_CACHE_TTL = 300
+
+    # What start_db does to the schema: 'none', 'check', 'migrate' or
+    # 'create'. See app/db/schema.py
+    SCHEMA_MODE = os.environ.get("SCHEMA_MODE", 'none')
+    ALEMBIC_CONFIG = os.environ.get("ALEMBIC_CONFIG", 'alembic.ini')
+
     DATABASE_URL = os.environ.get("DATABASE_URL", 'postgresql://<name>:<password>@localhost/<db-name>')
     REDIS_URL = os.environ.get("REDIS_URL", "redis://<name>:<password>@localhost:6379/0")
     CLIENT_SECRETS_FILE = os.environ.get("CLIENT_SECRETS_FILE", None)
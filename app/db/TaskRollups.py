@@ -0,0 +1,17 @@
+from sqlalchemy import Table, Column, Enum, Date, BigInteger, Float
+
+from . import TaskTypes
+from . import metadata
+
+# Per-day, per-type summary of tasks, written when old tasks partitions
+# are retired so reporting keeps the history after the rows are dropped
+task_rollups = Table(
+    "task_rollups", metadata,
+    Column("day", Date, primary_key=True, nullable=False),
+    Column("task_type", Enum(TaskTypes), primary_key=True, nullable=False),
+    Column("total", BigInteger, nullable=False),
+    Column("succeeded", BigInteger, nullable=False),
+    Column("failed", BigInteger, nullable=False),
+    # Summed run time of finished tasks, in seconds
+    Column("total_seconds", Float, nullable=False)
+)
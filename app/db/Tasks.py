@@ -1,4 +1,4 @@
-from sqlalchemy import Table, Column, Enum, DateTime, Boolean, Text, ForeignKey
+from sqlalchemy import Table, Column, Enum, DateTime, Boolean, Text, ForeignKey, Index, DDL, event
 
 from sqlalchemy.dialects.postgresql import UUID
 
@@ -7,13 +7,29 @@ from . import metadata
 
 # Tasks are stored in DB upon creation of a task object through the
 # Mediator, task status is updated upon completion of said task.
+# The table is range partitioned by month on time_start, see
+# app/workers/retention.py for how partitions are created and retired
 tasks = Table(
     "tasks", metadata,
     Column("id", UUID(as_uuid=True), primary_key=True, nullable=False),
     Column("owner", UUID(as_uuid=True), ForeignKey('users.id', ondelete="CASCADE"), nullable=False),
     Column("task_type", Enum(TaskTypes)),
-    Column("time_start", DateTime),
+    # The partition key has to be part of the primary key
+    Column("time_start", DateTime, primary_key=True, nullable=False),
     Column("time_finished", DateTime),
     Column("error", Text()),
-    Column("success", Boolean)
+    Column("success", Boolean),
+    # Serves keyset pagination of a user's task history, newest first,
+    # and any other lookup by owner
+    Index("ix_tasks_owner_time_start_id", "owner", "time_start", "id"),
+    Index("ix_tasks_task_type", "task_type"),
+    postgresql_partition_by="RANGE (time_start)"
+)
+
+# Catches rows outside every monthly partition, so inserts never fail for
+# want of a partition
+event.listen(
+    tasks,
+    "after_create",
+    DDL("CREATE TABLE IF NOT EXISTS tasks_default PARTITION OF tasks DEFAULT")
 )
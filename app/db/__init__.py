@@ -1,17 +1,16 @@
 import os
 from databases import Database
-from sqlalchemy import MetaData, create_engine
+from sqlalchemy import MetaData
 from .EnumTypes import PermissionLevel, TaskTypes
 
+# Nothing here touches Postgres. start_db opens the pool, and the schema
+# is owned by alembic, see app/db/schema.py
 database = Database(
     os.getenv('DATABASE_URL', 'postgresql://<user>:<password>@localhost/<db-name>')
 )
 
-engine = create_engine(str(database.url))
-metadata = MetaData(bind=engine)
+metadata = MetaData()
 
-# These need to be imported after the engine has been created
 from .Users import users
 from .Tasks import tasks
-
-metadata.create_all(engine)
+from .TaskRollups import task_rollups
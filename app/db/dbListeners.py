@@ -2,21 +2,41 @@ import aioredis
 import os
 from sanic_session import Session, AIORedisSessionInterface
 
-from databases import Database
+from functools import partial
+
+from app.db import database
+from app.db.schema import prepare_schema
+
+from app.workers.taskLog import task_log
+from app.workers.taskEvents import task_notifier
+from app.workers.taskStatus import task_status
+from app.workers.loginActivity import login_activity
+from app.workers.retention import retention
+from app.workers.credentialRefresh import credential_refresh
+from app.helpers.offload import offloader
+from app.helpers.userCache import user_cache
+from app.helpers.tokens import token_cache
+from app.helpers.tokenExchange import token_exchange
+from app.helpers.credentialCache import credential_cache
 
 session = Session()
 
 async def start_db(app, loop):
     ''' before server starts '''
 
-    try:
-        app.database = Database(
-            os.getenv(
-                'DATABASE_URL',
-                'postgresql://<user>:<password>@localhost/<db-name>'
-            )
+    # Schema work is blocking and opt-in, and happens before the pool opens
+    await loop.run_in_executor(
+        None,
+        partial(
+            prepare_schema,
+            app.config.SCHEMA_MODE,
+            str(database.url),
+            app.config.ALEMBIC_CONFIG
         )
+    )
 
+    try:
+        app.database = database
         await app.database.connect()
     except Exception as e:
         print('Something went wrong connecting to DB: {}', e)
@@ -29,7 +49,26 @@ async def start_db(app, loop):
     )
     # init extensions fabrics
     session.init_app(app, interface=AIORedisSessionInterface(app.redis))
+    task_log.init_app(app)
+    task_notifier.init_app(app)
+    task_status.init_app(app)
+    login_activity.init_app(app)
+    retention.init_app(app)
+    offloader.init_app(app)
+    user_cache.init_app(app)
+    token_cache.init_app(app)
+    token_exchange.init_app(app)
+    credential_cache.init_app(app)
+    credential_refresh.init_app(app)
 
 async def stop_db(app, loop):
     ''' after server stops '''
+    # Drain buffered task events while the connection is still open
+    await credential_refresh.close()
+    await login_activity.close()
+    await retention.close()
+    await task_log.close()
+    await task_notifier.close()
+    offloader.close()
+    await token_exchange.close()
     await app.database.disconnect()
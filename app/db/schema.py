@@ -0,0 +1,86 @@
+from . import metadata
+
+# none: leave the schema alone (the default)
+# check: refuse to start unless the database is at the latest revision
+# migrate: run alembic upgrade head
+# create: create any missing tables from the models and stamp them as
+#         head, for throwaway dev and test databases
+SCHEMA_MODES = ('none', 'check', 'migrate', 'create')
+
+# Arbitrary key for pg_advisory_lock, so that only one worker process
+# touches the schema at a time
+SCHEMA_LOCK_KEY = 7310411
+
+
+def prepare_schema(mode: str, database_url: str, alembic_ini: str = 'alembic.ini') -> None:
+    '''
+    Brings the schema in line with SCHEMA_MODE. Blocking, so start_db runs
+    it in an executor. Every worker calls it, and they take turns behind an
+    advisory lock, so a migration runs once and the other workers find the
+    schema already at head.
+
+    Raises ValueError for an unknown mode and RuntimeError when the
+    database isn't at head in check mode, or when alembic_ini's
+    script_location holds no revisions.
+    '''
+    if mode not in SCHEMA_MODES:
+        raise ValueError(f'SCHEMA_MODE must be one of {SCHEMA_MODES}, not {mode!r}')
+
+    if mode == 'none':
+        return
+
+    # Only paid for when the schema is actually managed at startup
+    from alembic import command
+    from alembic.config import Config as AlembicConfig
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.pool import NullPool
+
+    config = AlembicConfig(alembic_ini)
+    config.set_main_option('sqlalchemy.url', database_url)
+    script = ScriptDirectory.from_config(config)
+    heads = set(script.get_heads())
+
+    # Otherwise check would pass on an empty database and migrate would
+    # quietly do nothing
+    if not heads:
+        raise RuntimeError(f'no revisions in {script.dir}, check script_location in {alembic_ini}')
+
+    engine = create_engine(database_url, poolclass=NullPool)
+    # Advisory locks are Postgres only, other backends are single-process
+    # dev and test databases
+    locking = engine.dialect.name == 'postgresql'
+
+    try:
+        with engine.connect() as connection:
+            if locking:
+                connection.execute(text('SELECT pg_advisory_lock(:key)'), key=SCHEMA_LOCK_KEY)
+
+            try:
+                current = set(MigrationContext.configure(connection).get_current_heads())
+
+                if mode == 'check' and current != heads:
+                    raise RuntimeError(
+                        f'database is at revision {sorted(current)}, expected {sorted(heads)}. '
+                        'Run `alembic upgrade head`'
+                    )
+
+                # migrations/env.py runs on this connection instead of
+                # opening its own, so the lock covers the migration
+                config.attributes['connection'] = connection
+
+                if mode == 'migrate' and current != heads:
+                    command.upgrade(config, 'head')
+
+                if mode == 'create':
+                    metadata.create_all(connection)
+                    if not current:
+                        command.stamp(config, 'head')
+
+            finally:
+                if locking:
+                    connection.execute(text('SELECT pg_advisory_unlock(:key)'), key=SCHEMA_LOCK_KEY)
+
+    finally:
+        engine.dispose()
@@ -0,0 +1,199 @@
+import re
+
+from enum import Enum
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects import postgresql
+
+from . import users, tasks
+
+_dialect = postgresql.dialect(paramstyle='numeric')
+_numeric_param = re.compile(r':(\d+)')
+
+
+class Statement:
+    '''
+    A mediator query shape compiled to SQL once per process.
+
+    Calls only bind parameters: they skip building the SQLAlchemy clause and
+    compiling it again in the `databases` layer, and go straight to asyncpg.
+    Because every call sends the same SQL text, asyncpg's per-connection
+    statement cache keeps a server-side prepared statement for it, so
+    Postgres parses and plans each shape once per connection.
+
+    Attributes:
+    -----------
+        name: str
+            Name the statement is registered under
+        sql: str
+            Compiled SQL with asyncpg's $n placeholders
+
+    Methods:
+    --------
+        args(self, **params) -> List[any]:
+            Orders and converts params into positional arguments
+        execute(self, database, **params) -> str:
+            Runs the statement and returns its status
+        fetch_one(self, database, **params) -> Record:
+            Runs the statement and returns the first row
+        fetch_all(self, database, **params) -> List[Record]:
+            Runs the statement and returns every row
+    '''
+
+    __slots__ = ['name', '_build', '_column_keys', 'sql', '_names', '_processors']
+
+    def __init__(self,
+                 name: str,
+                 build: Callable[[], 'ClauseElement'],
+                 column_keys: Optional[Sequence[str]] = None
+                 ) -> None:
+
+        self.name = name
+        self._build = build
+        self._column_keys = list(column_keys) if column_keys else None
+        self.sql = None
+        self._names = None
+        self._processors = None
+
+    def _compile(self) -> None:
+        compiled = self._build().compile(dialect=_dialect, column_keys=self._column_keys)
+
+        self._names = list(compiled.positiontup)
+        self._processors = [
+            compiled.binds[name].type.dialect_impl(_dialect).bind_processor(_dialect)
+            for name in self._names
+        ]
+        self.sql = _numeric_param.sub(r'$\1', str(compiled))
+
+    def args(self, **params) -> List[any]:
+        if self.sql is None:
+            self._compile()
+
+        args = []
+        for name, processor in zip(self._names, self._processors):
+            value = params.get(name)
+            if isinstance(value, Enum):
+                value = value.name
+            args.append(processor(value) if processor and value is not None else value)
+
+        return args
+
+    async def execute(self, database: 'Postgres', **params) -> str:
+        args = self.args(**params)
+        async with database.connection() as connection:
+            return await connection.raw_connection.execute(self.sql, *args)
+
+    async def fetch_one(self, database: 'Postgres', **params) -> Optional['Record']:
+        args = self.args(**params)
+        async with database.connection() as connection:
+            return await connection.raw_connection.fetchrow(self.sql, *args)
+
+    async def fetch_all(self, database: 'Postgres', **params) -> List['Record']:
+        args = self.args(**params)
+        async with database.connection() as connection:
+            return await connection.raw_connection.fetch(self.sql, *args)
+
+
+class StatementRegistry:
+    '''
+    Process-wide registry of compiled mediator statements.
+
+    Methods:
+    --------
+        register(self, name: str, build: Callable, column_keys: Sequence[str]) -> Statement:
+            Registers a named statement, compiled on first use
+        insert(self, table: Table, columns: Sequence[str]) -> Statement:
+            Returns the INSERT for a table and set of columns, registering it
+            the first time that shape is seen
+    '''
+
+    def __init__(self) -> None:
+        self._statements: Dict[str, Statement] = {}
+        self._inserts: Dict[Tuple[str, Tuple[str, ...]], Statement] = {}
+
+    def __getitem__(self, name: str) -> Statement:
+        return self._statements[name]
+
+    def register(self,
+                 name: str,
+                 build: Callable[[], 'ClauseElement'],
+                 column_keys: Optional[Sequence[str]] = None
+                 ) -> Statement:
+
+        statement = Statement(name, build, column_keys)
+        self._statements[name] = statement
+        return statement
+
+    def insert(self, table: 'Table', columns: Sequence[str]) -> Statement:
+        key = (table.name, tuple(sorted(columns)))
+        statement = self._inserts.get(key)
+
+        if statement is None:
+            statement = Statement(f'insert_{table.name}', table.insert, key[1])
+            self._inserts[key] = statement
+
+        return statement
+
+
+statements = StatementRegistry()
+
+select_user_by_email = statements.register(
+    'select_user_by_email',
+    lambda: text('SELECT * FROM users WHERE users.email = :email')
+)
+
+insert_new_user = statements.register(
+    'insert_new_user',
+    lambda: text('''
+    INSERT INTO users
+    VALUES(:id, :email, :name, :permission, :verified, :phone, :last_fetch)
+    ON CONFLICT (email) DO NOTHING
+    RETURNING *
+    ''')
+)
+
+update_credentials = statements.register(
+    'update_credentials',
+    lambda: users.update().
+        where(users.c.id == bindparam('user_id')).
+        returning(users.c.email),
+    column_keys=['token', 'refresh_token', 'token_uri',
+                 'client_id', 'client_secret', 'scopes']
+)
+
+finalize_task = statements.register(
+    'finalize_task',
+    lambda: tasks.update().where(tasks.c.id == bindparam('task_id')),
+    column_keys=['time_finished', 'error', 'success']
+)
+
+select_task_status = statements.register(
+    'select_task_status',
+    lambda: text('SELECT time_finished, success FROM tasks WHERE tasks.id = :task_id')
+)
+
+select_task_summary = statements.register(
+    'select_task_summary',
+    lambda: text('''
+    SELECT owner, task_type, time_finished, error, success
+    FROM tasks WHERE tasks.id = :task_id
+    ''')
+)
+
+select_refreshable_users = statements.register(
+    'select_refreshable_users',
+    lambda: text('''
+    SELECT id FROM users
+    WHERE refresh_token IS NOT NULL AND id > :after
+    ORDER BY id LIMIT :limit
+    ''')
+)
+
+select_user_credentials = statements.register(
+    'select_user_credentials',
+    lambda: text('''
+    SELECT token, refresh_token, token_uri, client_id, client_secret, scopes
+    FROM users WHERE users.id = :user_id
+    ''')
+)
@@ -1,4 +1,5 @@
 from .authorized import authorized, withOauth
 from .clock import coClock, clock, noArgClock
 
-from .utility import credentials_to_dict, print_index_table, random_string, get_flow, user_to_json, handle_datestring, record_to_object
+from .utility import credentials_to_dict, random_string, get_flow, user_to_json, user_to_dict, handle_datestring, record_to_object
+from .codec import json_response
@@ -1,19 +1,113 @@
+import asyncio
 import os
-import jwt
-import json
+import random
 
+from json import loads
 from functools import wraps
-from sanic.response import redirect
-
-import google.oauth2.credentials
+from typing import Optional, Set
+from sanic.response import redirect, json
 
 from app.db import users, TaskTypes
+from app.db.statements import select_user_by_email
 from app.workers.mediators import AuthMediator
 
+from .credentialCache import credential_cache
+from .offload import offloader
+from .tokens import token_cache
+from .userCache import user_cache
+
+# Login tracking started in the background. Held here so the tasks aren't
+# garbage collected before they finish
+_background: Set[asyncio.Future] = set()
+
+
+def _background_done(task: asyncio.Future) -> None:
+    _background.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f'error tracking login in the background: {task.exception()}')
+
+
+class LazyUser:
+    '''
+    Awaitable that looks the user up on first await and hands every later
+    await the same result
+    '''
+
+    __slots__ = ['_loader', '_task']
+
+    def __init__(self, loader) -> None:
+        self._loader = loader
+        self._task = None
+
+    def __await__(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._loader())
+        return self._task.__await__()
+
+
+class TokenAuth:
+    '''
+    Lightweight auth object handed to handlers by withOauth(fast=True).
+
+    The JWT is verified locally and nothing touches Postgres up front. The
+    user row is only looked up, through the user cache, if the handler
+    awaits `auth_obj.hermes_user`.
+
+    Attributes:
+    -----------
+        database: Postgres
+            Ref to a Postgres connection
+        claims: Dict[str, any]
+            Verified JWT claims
+        hermes_user: LazyUser
+            Awaitable resolving to the user row, or {} if there is none
+    '''
+
+    __slots__ = ['database', 'claims', 'hermes_user']
+
+    successful = True
+
+    def __init__(self, database: 'Postgres', claims: dict) -> None:
+        self.database = database
+        self.claims = claims
+        self.hermes_user = LazyUser(self._load_user)
+
+    async def _load_user(self) -> dict:
+        email = self.claims.get('email')
+        user = await user_cache.get_or_load(
+            email,
+            lambda: select_user_by_email.fetch_one(self.database, email=email)
+        )
+        return user or {}
+
+    async def track_login(self) -> None:
+        try:
+            user = await self.hermes_user
+        except Exception as e:
+            print(f'error resolving user for login tracking: {e}')
+            return
+
+        if not user:
+            return
+
+        tracker = AuthMediator(self.database, str(user['id']), TaskTypes['AUTHENTICATE'])
+        await tracker._track_login()
+
+
+def _bearer_token(request) -> Optional[str]:
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        return header[len('Bearer '):].strip()
+
+    return None
+
 
 def authorized():
     '''
     Decorator that redirects to /authorize endpoint if there are no credentials in the session. Otherwise it proceeds as usual.
+
+    The Credentials object is reused across calls from the same session for
+    as long as the session's credentials don't change, see credentialCache.
     '''
     def decorator(f):
         @wraps(f)
@@ -29,7 +123,16 @@ def authorized():
 
             if is_authorized:
                 try:
-                    credentials = google.oauth2.credentials.Credentials(**creds)
+                    session = request['session']
+                    credentials = await credential_cache.get(
+                        getattr(session, 'sid', None),
+                        creds,
+                        session.get('user_id')
+                    )
+
+                    # Keep the session on a token the refresher replaced
+                    if credentials.token != creds.get('token'):
+                        session['credentials'] = {**creds, 'token': credentials.token}
 
                     # the user is authorized.
                     # run the handler method and return the response
@@ -47,17 +150,58 @@ def authorized():
         return decorated_function
     return decorator
 
-def withOauth():
+def withOauth(fast: bool = False):
     '''
     Decorator that redirects to NEXT app if there isn't a JWT token present
+
+    With fast=True the token is read from the Authorization header (falling
+    back to the body), verified locally, and the handler gets a TokenAuth
+    whose user is only looked up if the handler awaits it. Only a
+    LOGIN_TRACK_SAMPLE_RATE fraction of calls are tracked as logins, in the
+    background, instead of one tasks row per call.
     '''
     def decorator(f):
+        @wraps(f)
+        async def fast_function(request, *args, **kwargs):
+            token = _bearer_token(request)
+            if not token and request.body:
+                try:
+                    msg_body = await offloader.run(loads, request.body, size=len(request.body))
+                except ValueError:
+                    return json({'status': 'Bad Request', 'message': 'body is not valid JSON'}, 400)
+
+                if not isinstance(msg_body, dict):
+                    return json({'status': 'Bad Request', 'message': 'body must be a JSON object'}, 400)
+
+                token = msg_body.get('token', None)
+
+            if not token:
+                return json({'status': 'Not Authorized'}, 401)
+
+            # Loads PyJWT with the first token rather than at startup. Every
+            # later call finds it in sys.modules
+            import jwt
+
+            try:
+                claims = await token_cache.decode(token)
+            except jwt.InvalidTokenError as e:
+                return json({'status': 'Not Authorized', 'message': str(e)}, 401)
+
+            auth_obj = TokenAuth(request.app.database, claims)
+
+            if random.random() < request.app.config.LOGIN_TRACK_SAMPLE_RATE:
+                tracking = asyncio.ensure_future(auth_obj.track_login())
+                _background.add(tracking)
+                tracking.add_done_callback(_background_done)
+
+            return await f(request, auth_obj, *args, **kwargs)
+
         @wraps(f)
         async def decorated_function(request, *args, **kwargs):
             # run some method that checks the request
             # for the client's authorization status
             is_authorized = False
-            msg_body = json.loads(request.body)
+            msg_body = await offloader.run(loads, request.body, size=len(request.body))
             if not msg_body.get('token', None):
                 return json({'status': 'Not Authorized'}, 401)
 
@@ -87,5 +231,6 @@ def withOauth():
                 return response
             else:
                 return json({'status': 'not_authorized'}, 403)
-        return decorated_function
+
+        return fast_function if fast else decorated_function
     return decorator
@@ -0,0 +1,178 @@
+import base64
+import json
+
+from datetime import datetime, date
+from decimal import Decimal
+from enum import Enum
+from uuid import UUID
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sanic.response import HTTPResponse
+from sqlalchemy import ARRAY, Date, DateTime, Enum as EnumType, LargeBinary
+from sqlalchemy.dialects.postgresql import UUID as UUIDType
+
+# Backends for plain JSON types that are installed, all producing bytes
+BACKENDS: Dict[str, Callable[[any], bytes]] = {
+    'json': lambda obj: json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8'),
+}
+
+try:
+    import ujson
+    BACKENDS['ujson'] = lambda obj: ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+except ImportError:
+    pass
+
+try:
+    import orjson
+    BACKENDS['orjson'] = orjson.dumps
+except ImportError:
+    pass
+
+# The fastest one installed
+BACKEND = next(name for name in ('orjson', 'ujson', 'json') if name in BACKENDS)
+dumps = BACKENDS[BACKEND]
+
+
+def _tag(obj: any) -> Dict[str, str]:
+    if isinstance(obj, datetime):
+        return {'__datetime__': obj.isoformat()}
+    if isinstance(obj, date):
+        return {'__date__': obj.isoformat()}
+    if isinstance(obj, UUID):
+        return {'__uuid__': str(obj)}
+    if isinstance(obj, Decimal):
+        return {'__decimal__': str(obj)}
+    if isinstance(obj, bytes):
+        return {'__bytes__': base64.b64encode(obj).decode('ascii')}
+    if isinstance(obj, Enum):
+        return obj.name
+
+    raise TypeError(f'{type(obj).__name__} is not serializable')
+
+
+_UNTAG = {
+    '__datetime__': datetime.fromisoformat,
+    '__date__': date.fromisoformat,
+    '__uuid__': UUID,
+    '__decimal__': Decimal,
+    '__bytes__': base64.b64decode,
+}
+
+
+def _untag(obj: Dict[str, any]) -> any:
+    if len(obj) == 1:
+        key, value = next(iter(obj.items()))
+        if key in _UNTAG:
+            return _UNTAG[key](value)
+
+    return obj
+
+
+def dumps_tagged(obj: any) -> str:
+    '''
+    Serializes obj to JSON, tagging datetimes, dates, UUIDs, Decimals and
+    bytes so that loads_tagged can restore them. Enums are stored by name, which is
+    what Postgres expects for Enum columns.
+    '''
+    return json.dumps(obj, default=_tag, separators=(',', ':'))
+
+
+def loads_tagged(data: any) -> any:
+    ''' Inverse of dumps_tagged '''
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+
+    return json.loads(data, object_hook=_untag)
+
+
+def json_response(body: any,
+                  status: int = 200,
+                  headers: Optional[Dict[str, str]] = None
+                  ) -> HTTPResponse:
+    '''
+    Encodes body once, straight to bytes, with the codec backend. body may only
+    hold plain JSON types, eg rows already run through a RowEncoder.
+    '''
+    return HTTPResponse(
+        body_bytes=dumps(body),
+        status=status,
+        headers=headers,
+        content_type='application/json'
+    )
+
+
+_MISSING = object()
+
+
+def _enum_name(value: any) -> any:
+    return value.name if isinstance(value, Enum) else value
+
+
+def _base64(value: bytes) -> str:
+    return base64.b64encode(value).decode('ascii')
+
+
+def _strftime(value: datetime) -> str:
+    return value.strftime("%m/%d/%Y, %H:%M:%S")
+
+
+def _converter(column_type: 'TypeEngine') -> Optional[Callable[[any], any]]:
+    ''' Picks how a column's values become plain JSON types, None for as-is '''
+    if isinstance(column_type, UUIDType):
+        return str
+    if isinstance(column_type, DateTime):
+        return _strftime
+    if isinstance(column_type, Date):
+        return date.isoformat
+    if isinstance(column_type, EnumType):
+        return _enum_name
+    if isinstance(column_type, ARRAY):
+        return list
+    if isinstance(column_type, LargeBinary):
+        return _base64
+
+    return None
+
+
+class RowEncoder:
+    '''
+    Turns rows of one Table into dicts of plain JSON types, with a converter
+    per column picked once from the column's SQLAlchemy type. Works on
+    Records and dicts, and skips columns missing from the row.
+
+    Methods:
+    --------
+        encode(self, row: Record) -> Dict[str, any]:
+            Converts a row
+    '''
+
+    __slots__ = ['fields']
+
+    def __init__(self, table: 'Table') -> None:
+        self.fields: List[Tuple[str, Optional[Callable[[any], any]]]] = [
+            (str(column.name), _converter(column.type)) for column in table.columns
+        ]
+
+    def encode(self, row: 'Record') -> Dict[str, any]:
+        get = row.get
+        output = {}
+
+        for name, convert in self.fields:
+            value = get(name, _MISSING)
+            if value is _MISSING:
+                continue
+            output[name] = convert(value) if convert and value is not None else value
+
+        return output
+
+
+_encoders: Dict[str, RowEncoder] = {}
+
+
+def encoder_for(table: 'Table') -> RowEncoder:
+    ''' Returns the table's RowEncoder, building it on first use '''
+    encoder = _encoders.get(table.name)
+    if encoder is None:
+        encoder = _encoders[table.name] = RowEncoder(table)
+    return encoder
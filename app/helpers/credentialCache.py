@@ -0,0 +1,137 @@
+import hashlib
+
+from typing import Dict, Optional, Tuple
+
+from cachetools import TTLCache
+
+from app.db.statements import select_user_credentials
+
+
+def fingerprint(creds: Dict[str, any]) -> bytes:
+    ''' Digest of every field a Credentials object is built from '''
+    fields = (
+        creds.get('token') or '',
+        creds.get('refresh_token') or '',
+        creds.get('token_uri') or '',
+        creds.get('client_id') or '',
+        creds.get('client_secret') or '',
+        ','.join(creds.get('scopes') or ()),
+    )
+    return hashlib.sha256('\0'.join(fields).encode('utf-8')).digest()
+
+
+def same_grant(session_creds: Dict[str, any], stored: Dict[str, any]) -> bool:
+    '''
+    Whether stored credentials came from the same OAuth grant as the
+    session's, so only their access token can differ
+    '''
+    return bool(session_creds.get('refresh_token')) \
+        and stored['refresh_token'] == session_creds.get('refresh_token') \
+        and stored['client_id'] == session_creds.get('client_id')
+
+
+class CredentialCache:
+    '''
+    Per-process cache of google Credentials objects, one per session.
+
+    An entry is keyed by session id and remembers the fingerprint of the
+    session credentials it was built from. A hit only fingerprints the
+    session's creds, with no Postgres read. When a session's credentials
+    change, eg after a new login, the fingerprint no longer matches and the
+    object is rebuilt.
+
+    Entries are only ever built from the session's own credentials. The
+    credential refresher writes new access tokens to Postgres, so on a miss
+    the session's token is swapped for the stored one, but only when both
+    come from the same grant, ie share the refresh token and client id. The
+    caller writes the swapped token back to the session. init_app caps
+    `ttl` at the refresher's lead time, so an entry built just before a
+    refresh expires before the token it holds does. Entries past `maxsize`
+    are evicted least recently used first.
+
+    Attributes:
+    -----------
+        database: Postgres
+            Ref to a Postgres connection, set by init_app
+        local: TTLCache
+            Maps session ids to (fingerprint, Credentials)
+        hits: int
+            Lookups served from the cache
+        misses: int
+            Lookups that built a new Credentials object
+
+    Methods:
+    --------
+        init_app(self, app) -> None:
+            Binds Postgres and sizes the cache from Config
+        get(self, sid: str, creds: Dict[str, any], user_id: str) -> Credentials:
+            Returns the session's Credentials, building them on a miss
+        invalidate(self, sid: str) -> None:
+            Drops a session's cached Credentials
+    '''
+
+    def __init__(self, maxsize: int = 10000, ttl: int = 300) -> None:
+        self.database = None
+        self.local: 'TTLCache[str, Tuple[bytes, Credentials]]' = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app) -> None:
+        self.database = app.database
+        self.local = TTLCache(
+            maxsize=app.config.CREDENTIAL_CACHE_SIZE,
+            ttl=min(app.config.CREDENTIAL_CACHE_TTL, app.config.CREDENTIAL_REFRESH_LEAD)
+        )
+
+    async def get(self,
+                  sid: Optional[str],
+                  creds: Dict[str, any],
+                  user_id: Optional[str] = None
+                  ) -> 'Credentials':
+
+        digest = fingerprint(creds)
+
+        if sid is not None:
+            entry = self.local.get(sid)
+            if entry is not None and entry[0] == digest:
+                self.hits += 1
+                return entry[1]
+
+        self.misses += 1
+        creds = await self._refreshed(creds, user_id)
+
+        # The google auth stack loads on first use, not at startup
+        import google.oauth2.credentials
+
+        credentials = google.oauth2.credentials.Credentials(**creds)
+        if sid is not None:
+            # Keyed on what the session holds once the caller has written
+            # any refreshed token back
+            self.local[sid] = (fingerprint(creds), credentials)
+
+        return credentials
+
+    async def _refreshed(self, creds: Dict[str, any], user_id: Optional[str]) -> Dict[str, any]:
+        ''' The session's creds, with the stored access token if it's newer '''
+        if user_id is None or self.database is None:
+            return creds
+
+        try:
+            stored = await select_user_credentials.fetch_one(self.database, user_id=user_id)
+        except Exception as e:
+            print(f'error reading stored credentials: {e}')
+            return creds
+
+        # The session's user id alone proves nothing, /authorize sets it
+        # from the URL, so stored tokens are only used for the same grant
+        if not stored or not stored['token'] or not same_grant(creds, stored):
+            return creds
+
+        return {**creds, 'token': stored['token']}
+
+    def invalidate(self, sid: Optional[str]) -> None:
+        if sid is not None:
+            self.local.pop(sid, None)
+
+
+credential_cache = CredentialCache()
@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+
+def _timed_call(func: Callable, args: Tuple, kwargs: Dict[str, any]) -> Tuple[any, float, float]:
+    ''' Runs in the pool process, reporting when the call started and finished '''
+    started = time.monotonic()
+    result = func(*args, **kwargs)
+    return result, started, time.monotonic()
+
+
+class Offloader:
+    '''
+    Routes CPU-heavy calls to a process pool so they don't stall the event loop.
+
+    Calls whose payload is smaller than `threshold` bytes run inline, since
+    pickling them over to another process would cost more than the call.
+    benchmarks/offload.py measures where that crossover is. JWTs are far
+    below it, so jwt.decode always runs inline. Functions and arguments sent
+    to the pool have to be picklable.
+
+    Attributes:
+    -----------
+        executor: ProcessPoolExecutor
+            Pool the calls run on, or None when offloading is disabled
+        threshold: int
+            Payload size in bytes above which calls are offloaded
+        stats: Dict[str, Dict[str, Dict[str, float]]]
+            Per-function, per-path ('inline' or 'offloaded') call counts and
+            total / max queue-wait and run times
+
+    Methods:
+    --------
+        init_app(self, app) -> None:
+            Creates the pool from CPU_POOL_SIZE and CPU_OFFLOAD_THRESHOLD
+        run(self, func: Callable, *args, size: int, **kwargs) -> any:
+            Calls func on the pool when size is over the threshold
+        close(self) -> None:
+            Shuts the pool down
+    '''
+
+    def __init__(self, threshold: int = 262144) -> None:
+        self.executor = None
+        self.threshold = threshold
+        self.stats = {}
+
+    def init_app(self, app) -> None:
+        self.threshold = app.config.CPU_OFFLOAD_THRESHOLD
+
+        # Each Sanic worker process gets its own pool
+        if app.config.CPU_POOL_SIZE > 0:
+            self.executor = ProcessPoolExecutor(max_workers=app.config.CPU_POOL_SIZE)
+
+    async def run(self,
+                  func: Callable,
+                  *args,
+                  size: Optional[int] = None,
+                  **kwargs
+                  ) -> any:
+
+        if self.executor is None or size is None or size < self.threshold:
+            started = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._record(func, 'inline', 0.0, time.monotonic() - started)
+
+        submitted = time.monotonic()
+        result, started, finished = await asyncio.get_event_loop().run_in_executor(
+            self.executor, _timed_call, func, args, kwargs
+        )
+        self._record(func, 'offloaded', started - submitted, finished - started)
+
+        return result
+
+    def _record(self, func: Callable, path: str, waited: float, ran: float) -> None:
+        name = f'{func.__module__}.{func.__qualname__}'
+        stats = self.stats.setdefault(name, {}).setdefault(path, {
+            'calls': 0,
+            'wait_total': 0.0, 'wait_max': 0.0,
+            'run_total': 0.0, 'run_max': 0.0,
+        })
+
+        stats['calls'] += 1
+        stats['wait_total'] += waited
+        stats['wait_max'] = max(stats['wait_max'], waited)
+        stats['run_total'] += ran
+        stats['run_max'] = max(stats['run_max'], ran)
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+
+offloader = Offloader()
@@ -0,0 +1,48 @@
+import asyncio
+
+from typing import Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    '''
+    Coalesces concurrent calls that share a key onto one in-flight future.
+
+    The first caller for a key starts the work; callers that arrive while it
+    is running await the same future instead of repeating it. Once the work
+    finishes the key is forgotten, so later calls start fresh.
+
+    Attributes:
+    -----------
+        shared: int
+            Number of calls that were served by another caller's work
+
+    Methods:
+    --------
+        do(self, key: Hashable, fn: Callable[[], Awaitable]) -> Tuple[any, bool]:
+            Returns fn's result and whether it came from another caller
+    '''
+
+    def __init__(self) -> None:
+        self.shared = 0
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self,
+                 key: Hashable,
+                 fn: Callable[[], Awaitable[any]]
+                 ) -> Tuple[any, bool]:
+
+        call = self._calls.get(key)
+        if call is not None:
+            self.shared += 1
+            # Shielded so one caller giving up doesn't cancel the others
+            return await asyncio.shield(call), True
+
+        call = asyncio.ensure_future(fn())
+        self._calls[key] = call
+        call.add_done_callback(lambda _: self._forget(key, call))
+
+        return await asyncio.shield(call), False
+
+    def _forget(self, key: Hashable, call: asyncio.Future) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -0,0 +1,278 @@
+import asyncio
+import calendar
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, Optional
+from urllib.parse import urlsplit, parse_qs
+
+
+class TokenExchangeError(Exception):
+    '''
+    The authorization response was refused or the token endpoint failed.
+    error holds the OAuth error code, eg invalid_grant, when there was one
+    '''
+
+    def __init__(self, message: str, error: Optional[str] = None) -> None:
+        super().__init__(message)
+        self.message = message
+        self.error = error
+
+
+class TokenExchange:
+    '''
+    Trades OAuth authorization codes for tokens without blocking the event
+    loop.
+
+    The default 'aiohttp' backend posts to the token endpoint over a pooled,
+    keep-alive session. Every exchange has a timeout, and a semaphore caps
+    how many run at once, so a slow upstream during a login storm only holds
+    up logins. The 'thread' backend runs oauthlib's synchronous
+    fetch_token on a bounded thread pool instead.
+
+    Either way the token ends up on the Flow's session, so `flow.credentials`
+    works as it does after `flow.fetch_token`. Refresh-token grants go
+    through the same session, limits and backends.
+
+    Attributes:
+    -----------
+        backend: str
+            'aiohttp' or 'thread'
+        timeout: float
+            Seconds an exchange may take, including the wait for a slot
+        max_concurrency: int
+            Max exchanges in flight at once
+        token_uri: str
+            Overrides the client config's token endpoint, eg to point at a
+            local stand-in
+
+    Methods:
+    --------
+        init_app(self, app) -> None:
+            Reads the backend, limits and token endpoint from Config
+        fetch_token(self, flow: Flow, authorization_response: str, state: str) -> Dict[str, any]:
+            Exchanges the code in the authorization response and returns the token
+        refresh(self, creds: Dict[str, any]) -> Dict[str, any]:
+            Trades stored credentials' refresh token for a new access token
+        close(self) -> None:
+            Closes the HTTP session and the thread pool
+    '''
+
+    def __init__(self,
+                 backend: str = 'aiohttp',
+                 timeout: float = 10.0,
+                 max_concurrency: int = 20,
+                 token_uri: Optional[str] = None
+                 ) -> None:
+
+        self.backend = backend
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.token_uri = token_uri
+
+        self._session = None
+        self._executor = None
+        self._semaphore = None
+
+    def init_app(self, app) -> None:
+        self.backend = app.config.TOKEN_EXCHANGE_BACKEND
+        self.timeout = app.config.TOKEN_EXCHANGE_TIMEOUT
+        self.max_concurrency = app.config.TOKEN_EXCHANGE_CONCURRENCY
+        self.token_uri = app.config.OAUTH_TOKEN_URI
+
+    def _slots(self) -> asyncio.Semaphore:
+        # Created on first use so it binds to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _client(self) -> 'ClientSession':
+        if self._session is None:
+            import aiohttp
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_concurrency,
+                    keepalive_timeout=60,
+                    ttl_dns_cache=300
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={'Accept': 'application/json'}
+            )
+        return self._session
+
+    async def fetch_token(self,
+                          flow: 'Flow',
+                          authorization_response: str,
+                          state: Optional[str] = None
+                          ) -> Dict[str, any]:
+
+        try:
+            return await asyncio.wait_for(
+                self._fetch(flow, authorization_response, state),
+                self.timeout
+            )
+        except asyncio.TimeoutError:
+            raise TokenExchangeError(f'token exchange timed out after {self.timeout}s')
+
+    async def _fetch(self,
+                     flow: 'Flow',
+                     authorization_response: str,
+                     state: Optional[str]
+                     ) -> Dict[str, any]:
+
+        async with self._slots():
+            if self.backend == 'thread':
+                return await self._fetch_in_thread(flow, authorization_response)
+
+            client_config = flow.client_config
+            data = {
+                'grant_type': 'authorization_code',
+                'code': _authorization_code(authorization_response, state),
+                'redirect_uri': flow.redirect_uri,
+                'client_id': client_config['client_id'],
+                'client_secret': client_config['client_secret'],
+            }
+            if flow.code_verifier:
+                data['code_verifier'] = flow.code_verifier
+
+            token = await self._post(self.token_uri or client_config['token_uri'], data)
+
+        # What OAuth2Session.fetch_token would have stored, so
+        # flow.credentials reads it the same way
+        if 'expires_in' in token:
+            token['expires_at'] = time.time() + int(token['expires_in'])
+        flow.oauth2session.token = token
+
+        return token
+
+    async def _fetch_in_thread(self, flow: 'Flow', authorization_response: str) -> Dict[str, any]:
+        # What flow.fetch_token does, minus writing the token endpoint into
+        # the client config, which the flow factory shares between flows
+        fetch = partial(
+            flow.oauth2session.fetch_token,
+            self.token_uri or flow.client_config['token_uri'],
+            client_secret=flow.client_config['client_secret'],
+            code_verifier=flow.code_verifier,
+            authorization_response=authorization_response
+        )
+
+        try:
+            return await asyncio.get_event_loop().run_in_executor(self._thread_pool(), fetch)
+        except Exception as e:
+            raise TokenExchangeError(f'token exchange failed: {e}')
+
+    async def refresh(self, creds: Dict[str, any]) -> Dict[str, any]:
+        '''
+        Returns the token endpoint's response, with expires_at added. It only
+        holds a refresh_token when the provider rotated it
+        '''
+        try:
+            return await asyncio.wait_for(self._refresh(creds), self.timeout)
+        except asyncio.TimeoutError:
+            raise TokenExchangeError(f'token refresh timed out after {self.timeout}s')
+
+    async def _refresh(self, creds: Dict[str, any]) -> Dict[str, any]:
+        async with self._slots():
+            if self.backend == 'thread':
+                return await self._refresh_in_thread(creds)
+
+            token = await self._post(self.token_uri or creds['token_uri'], {
+                'grant_type': 'refresh_token',
+                'refresh_token': creds['refresh_token'],
+                'client_id': creds['client_id'],
+                'client_secret': creds['client_secret'],
+            })
+
+        if 'expires_in' in token:
+            token['expires_at'] = time.time() + int(token['expires_in'])
+
+        return token
+
+    async def _refresh_in_thread(self, creds: Dict[str, any]) -> Dict[str, any]:
+        import google.auth.exceptions
+        import google.auth.transport.requests
+        import google.oauth2.credentials
+
+        credentials = google.oauth2.credentials.Credentials(**{
+            **creds,
+            'token_uri': self.token_uri or creds['token_uri'],
+        })
+        request = google.auth.transport.requests.Request()
+
+        try:
+            await asyncio.get_event_loop().run_in_executor(
+                self._thread_pool(), credentials.refresh, request
+            )
+        except google.auth.exceptions.RefreshError as e:
+            error = 'invalid_grant' if 'invalid_grant' in str(e) else None
+            raise TokenExchangeError(f'token refresh failed: {e}', error)
+        except Exception as e:
+            raise TokenExchangeError(f'token refresh failed: {e}')
+
+        token = {'access_token': credentials.token, 'refresh_token': credentials.refresh_token}
+        if credentials.expiry is not None:
+            # google-auth keeps expiry as a naive UTC datetime
+            token['expires_at'] = calendar.timegm(credentials.expiry.utctimetuple())
+
+        return token
+
+    def _thread_pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency,
+                thread_name_prefix='token-exchange'
+            )
+        return self._executor
+
+    async def _post(self, token_uri: str, data: Dict[str, str]) -> Dict[str, any]:
+        try:
+            async with self._client().post(token_uri, data=data) as response:
+                body = await response.json(content_type=None)
+        except asyncio.TimeoutError:
+            raise
+        except Exception as e:
+            raise TokenExchangeError(f'token request failed: {e}')
+
+        if not isinstance(body, dict):
+            raise TokenExchangeError(f'token endpoint returned {response.status}: {body}')
+
+        if response.status != 200 or 'access_token' not in body:
+            raise TokenExchangeError(
+                'token endpoint returned {}: {}'.format(
+                    response.status,
+                    body.get('error_description') or body.get('error') or body
+                ),
+                body.get('error')
+            )
+
+        return body
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def _authorization_code(authorization_response: str, state: Optional[str]) -> str:
+    ''' Pulls the code out of the callback URL, checking the state first '''
+    params = parse_qs(urlsplit(authorization_response).query)
+
+    if 'error' in params:
+        raise TokenExchangeError(f'authorization refused: {params["error"][0]}')
+
+    if state is not None and params.get('state', [None])[0] != state:
+        raise TokenExchangeError('state in the authorization response does not match the session')
+
+    if 'code' not in params:
+        raise TokenExchangeError('authorization response has no code')
+
+    return params['code'][0]
+
+
+token_exchange = TokenExchange()
@@ -0,0 +1,132 @@
+import hashlib
+import os
+import time
+
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from .offload import offloader
+
+
+class TokenCache:
+    '''
+    Bounded LRU cache of verified JWT claims keyed by a digest of the token.
+
+    A token is verified once and its claims are served from the cache until
+    the token's `exp` (or `max_ttl` seconds for tokens without one), after
+    which it is evicted and the next call verifies it again, raising if it
+    has expired. Revocation hooks purge entries by token or by email.
+
+    Attributes:
+    -----------
+        maxsize: int
+            Max number of cached tokens
+        max_ttl: int
+            Upper bound in seconds on how long claims are cached
+        hits: int
+            Lookups served from the cache
+        misses: int
+            Lookups that had to verify the token
+
+    Methods:
+    --------
+        init_app(self, app) -> None:
+            Sizes the cache and reads the signing secret from Config
+        decode(self, token: str) -> Dict[str, any]:
+            Returns the token's verified claims
+        revoke(self, token: str) -> None:
+            Purges a single token
+        revoke_subject(self, email: str) -> None:
+            Purges every cached token issued to an email
+    '''
+
+    def __init__(self, maxsize: int = 10000, max_ttl: int = 300) -> None:
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self.secret = None
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: 'OrderedDict[bytes, Tuple[Dict[str, any], float]]' = OrderedDict()
+        self._subjects: Dict[str, Set[bytes]] = {}
+
+    def init_app(self, app) -> None:
+        self.maxsize = app.config.JWT_CACHE_SIZE
+        self.max_ttl = app.config.JWT_CACHE_MAX_TTL
+        self.secret = app.config.JWT_SECRET
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    async def decode(self, token: str) -> Dict[str, any]:
+        digest = self._digest(token)
+        entry = self._entries.get(digest)
+
+        if entry is not None:
+            claims, expires_at = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return claims
+
+            self._evict(digest)
+
+        self.misses += 1
+
+        # PyJWT and its crypto backends load on the first verification
+        # instead of at startup
+        import jwt
+
+        claims = await offloader.run(
+            jwt.decode,
+            token,
+            self.secret or os.getenv('JWT_SECRET', None),
+            size=len(token)
+        )
+        self._store(digest, claims)
+
+        return claims
+
+    def _store(self, digest: bytes, claims: Dict[str, any]) -> None:
+        expires_at = time.time() + self.max_ttl
+        if claims.get('exp') is not None:
+            expires_at = min(expires_at, float(claims['exp']))
+
+        self._entries[digest] = (claims, expires_at)
+        self._entries.move_to_end(digest)
+
+        email = claims.get('email')
+        if email:
+            self._subjects.setdefault(email, set()).add(digest)
+
+        while len(self._entries) > self.maxsize:
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, digest: bytes) -> Optional[Dict[str, any]]:
+        entry = self._entries.pop(digest, None)
+        if entry is None:
+            return None
+
+        email = entry[0].get('email')
+        digests = self._subjects.get(email)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._subjects[email]
+
+        return entry[0]
+
+    def revoke(self, token: str) -> None:
+        self._evict(self._digest(token))
+
+    def revoke_subject(self, email: str) -> None:
+        for digest in list(self._subjects.get(email, ())):
+            self._evict(digest)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._subjects.clear()
+
+
+token_cache = TokenCache()
@@ -0,0 +1,136 @@
+from typing import Awaitable, Callable, Dict, Optional
+
+from cachetools import TTLCache
+
+from .codec import dumps_tagged, loads_tagged
+
+
+class UserCache:
+    '''
+    Read-through cache of user rows keyed by email, with two tiers: a
+    per-process LRU with a short TTL in front of a shared Redis tier.
+
+    Only the profile columns in `columns` are cached, never the OAuth
+    tokens or client secret, so a read of the shared tier doesn't expose
+    them. Invalidation clears the local tier of the calling process and the
+    Redis tier. Other processes can serve their local copy until it
+    expires, so the local TTL bounds how stale a read can be.
+
+    Attributes:
+    -----------
+        local: TTLCache
+            In-process tier
+        redis: Redis
+            Ref to the app's aioredis pool, set by init_app
+        redis_ttl: int
+            Seconds a user stays in the Redis tier
+        hits: Dict[str, int]
+            Hit counters for the 'local' and 'redis' tiers
+        misses: int
+            Lookups that fell through to Postgres
+
+    Methods:
+    --------
+        init_app(self, app) -> None:
+            Sizes the tiers from Config and binds the Redis pool
+        get_or_load(self, email: str, loader: Callable) -> Optional[Dict]:
+            Returns the cached user or loads, caches and returns it
+        invalidate(self, *emails: str) -> None:
+            Drops users from both tiers
+    '''
+
+    prefix = 'hermes:user:'
+    columns = ('id', 'email', 'name', 'permission_level', 'verified', 'phone_number', 'last_fetch')
+
+    def __init__(self,
+                 maxsize: int = 10000,
+                 ttl: int = 30,
+                 redis_ttl: int = 300
+                 ) -> None:
+
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.redis = None
+        self.redis_ttl = redis_ttl
+        self.hits = {'local': 0, 'redis': 0}
+        self.misses = 0
+
+    def init_app(self, app) -> None:
+        self.local = TTLCache(
+            maxsize=app.config.USER_CACHE_SIZE,
+            ttl=app.config.USER_CACHE_TTL
+        )
+        self.redis_ttl = app.config.USER_CACHE_REDIS_TTL
+        self.redis = app.redis
+
+    def _key(self, email: str) -> str:
+        return f'{self.prefix}{email}'
+
+    async def get(self, email: str) -> Optional[Dict[str, any]]:
+        user = self.local.get(email)
+        if user is not None:
+            self.hits['local'] += 1
+            return user
+
+        if self.redis is None:
+            return None
+
+        try:
+            cached = await self.redis.get(self._key(email))
+        except Exception as e:
+            print(f'error reading user cache: {e}')
+            return None
+
+        if cached is None:
+            return None
+
+        user = loads_tagged(cached)
+        self.local[email] = user
+        self.hits['redis'] += 1
+
+        return user
+
+    async def set(self, email: str, user: Dict[str, any]) -> None:
+        self.local[email] = user
+
+        if self.redis is None:
+            return
+
+        try:
+            await self.redis.set(self._key(email), dumps_tagged(user), expire=self.redis_ttl)
+        except Exception as e:
+            print(f'error writing user cache: {e}')
+
+    async def get_or_load(self,
+                          email: str,
+                          loader: Callable[[], Awaitable[Optional['Record']]]
+                          ) -> Optional[Dict[str, any]]:
+
+        user = await self.get(email)
+        if user is not None:
+            return user
+
+        self.misses += 1
+        record = await loader()
+        if record is None:
+            return None
+
+        row = dict(record)
+        user = {name: row[name] for name in self.columns if name in row}
+        await self.set(email, user)
+
+        return user
+
+    async def invalidate(self, *emails: str) -> None:
+        for email in emails:
+            self.local.pop(email, None)
+
+        if self.redis is None or not emails:
+            return
+
+        try:
+            await self.redis.delete(*(self._key(email) for email in emails))
+        except Exception as e:
+            print(f'error invalidating user cache: {e}')
+
+
+user_cache = UserCache()
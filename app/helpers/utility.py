@@ -3,13 +3,15 @@ import os
 import string
 import random
 
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
 
 from datetime import datetime, date
 
 import json
 
-from google_auth_oauthlib.flow import Flow
+from app.db import users
+
+from .codec import dumps, encoder_for
 
 async def credentials_to_dict(credentials):
     return {'token': credentials.token,
@@ -25,6 +27,69 @@ def random_string(length=10):
     password_characters = string.ascii_letters + string.digits + string.punctuation
     return ''.join(random.choice(password_characters) for i in range(length))
 
+class FlowFactory:
+    '''
+    Builds OAuth Flows from client configs cached per process.
+
+    A client secrets file is read and parsed the first time it's used, and
+    again only when its mtime changes, so rotated secrets are picked up
+    without a restart. The SCOPES env var is split once per distinct value.
+
+    Methods:
+    --------
+        client_config(self, path: str) -> Dict[str, any]:
+            Returns the parsed client secrets file
+        scopes(self) -> List[str]:
+            Returns the scopes listed in the SCOPES env var
+        build(self, redirect_uri: str, path: str, verifier: str, state: str) -> Flow:
+            Returns a new Flow for one OAuth conversation
+    '''
+
+    def __init__(self) -> None:
+        self._configs: Dict[str, Tuple[float, Dict[str, any]]] = {}
+        self._scopes: Tuple[Optional[str], List[str]] = (None, [])
+
+    def client_config(self, path: str) -> Dict[str, any]:
+        mtime = os.stat(path).st_mtime
+        cached = self._configs.get(path)
+
+        if cached is None or cached[0] != mtime:
+            with open(path, 'r') as secrets:
+                cached = self._configs[path] = (mtime, json.load(secrets))
+
+        return cached[1]
+
+    def scopes(self) -> List[str]:
+        raw = os.environ.get('SCOPES')
+        if raw != self._scopes[0]:
+            self._scopes = (raw, raw.split(',') if raw else [])
+
+        return self._scopes[1]
+
+    def build(self,
+              redirect_uri: str,
+              path: str,
+              verifier: str,
+              state: Optional[str] = None
+              ) -> 'Flow':
+
+        # google_auth_oauthlib and requests load on the first OAuth request,
+        # not at startup
+        from google_auth_oauthlib.flow import Flow
+
+        flow = Flow.from_client_config(
+            self.client_config(path),
+            scopes=self.scopes(),
+            state=state,
+        )
+
+        flow.redirect_uri = redirect_uri
+        flow.code_verifier = verifier
+        return flow
+
+
+flow_factory = FlowFactory()
+
 def get_flow(redirect_uri: str,
              path_to_secrets: str,
              verification_string: str,
@@ -43,26 +108,17 @@ def get_flow(redirect_uri: str,
             Random string to serve as an auth check on the callback
 
     '''
+    return flow_factory.build(redirect_uri, path_to_secrets, verification_string, state)
 
-    flow = Flow.from_client_secrets_file(
-        path_to_secrets,
-        scopes=os.environ.get('SCOPES').split(','),
-        state=state,
-    )
-
-    flow.redirect_uri = redirect_uri
-    flow.code_verifier = verification_string
-    return flow
-
-def user_to_json(row: 'Record') -> json:
-    output = {}
-    for col in row:
-        if type(row[col]) == datetime:
-            output[col] = row[col].strftime("%m/%d/%Y, %H:%M:%S")
-        else:
-            output[col] = str(row[col])
+def user_to_dict(row: 'Record') -> Dict[str, any]:
+    '''
+    Converts a users row into plain JSON types, ready to be encoded once
+    as part of a response with codec.json_response
+    '''
+    return encoder_for(users).encode(row)
 
-    return json.dumps(output)
+def user_to_json(row: 'Record') -> str:
+    return dumps(user_to_dict(row)).decode('utf-8')
 
 def handle_datestring(date_string: str) -> datetime:
     output = datetime.strptime(date_string, '%Y-%m-%dT%H:%M:%S.%fZ')
@@ -1,15 +1,14 @@
 import os
-import uvicorn
 
 from sanic import Sanic
-from sanic_session import Session
-from sanic_cors import CORS, cross_origin
+from sanic_cors import CORS
 
 from functools import partial
 
 from .routes import app_routes
 
 from .db.dbListeners import start_db, stop_db
+from .workers.listeners import create_task_queue, stop_task_queue
 
 from .helpers import random_string
 from .config import configSwitch
@@ -26,6 +25,10 @@ app.config.from_object(app_config)
 app.config.OAUTH_VERIFIER = random_string(40)
 
 app.register_listener(start_db, 'after_server_start')
+app.register_listener(create_task_queue, 'after_server_start')
+# Sanic runs before_server_stop listeners in reverse, so the queue finishes
+# its jobs before stop_db closes what they write to
 app.register_listener(stop_db, 'before_server_stop')
+app.register_listener(stop_task_queue, 'before_server_stop')
 
 app.blueprint(app_routes)
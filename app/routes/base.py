@@ -1,24 +1,70 @@
+import base64
+import binascii
+import calendar
+
+from datetime import datetime
+from uuid import UUID
+
 from sanic import Blueprint
-from sanic.response import json, text, redirect, html
+from sanic.response import json, text, redirect, html, stream
 
 from json import loads
 
-import google.oauth2.credentials
-from google_auth_oauthlib.flow import Flow
+from sqlalchemy import select, tuple_, and_
 
 from app.db import tasks, TaskTypes
-from app.helpers import credentials_to_dict, get_flow, user_to_json
+from app.helpers import credentials_to_dict, get_flow, user_to_dict, json_response, withOauth
+from app.helpers.codec import dumps, encoder_for
+from app.helpers.offload import offloader
+from app.helpers.tokenExchange import token_exchange, TokenExchangeError
+from app.helpers.credentialCache import credential_cache
 from app.workers.mediators import AuthMediator
+from app.workers.taskStatus import task_status
+from app.workers.credentialRefresh import credential_refresh
 
 base_bp = Blueprint('base')
 
+TASK_PAGE_SIZE = 100
+TASK_PAGE_MAX = 1000
+
+
+def _encode_cursor(row: 'Record') -> str:
+    raw = f"{row['time_start'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    ''' Inverse of _encode_cursor, raising ValueError on a malformed cursor '''
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        time_start, task_id = raw.split('|')
+        return datetime.fromisoformat(time_start), UUID(task_id)
+    except (binascii.Error, UnicodeError) as e:
+        raise ValueError(f'malformed cursor: {e}')
+
+
+def _task_page_query(owner: str, after: tuple, limit: int) -> 'Select':
+    '''
+    One page of a user's tasks, newest first. Seeks past the cursor on the
+    (owner, time_start, id) index instead of using OFFSET, so every page
+    costs the same no matter how deep into the history it is.
+    '''
+    condition = and_(tasks.c.owner == owner, tasks.c.time_start.isnot(None))
+    if after:
+        condition = and_(condition, tuple_(tasks.c.time_start, tasks.c.id) < tuple_(*after))
+
+    return select([tasks]).\
+        where(condition).\
+        order_by(tasks.c.time_start.desc(), tasks.c.id.desc()).\
+        limit(limit)
+
 @base_bp.route('/')
 async def root(request):
     return text('yup, this is a page')
 
 @base_bp.route('/hermes/auth', methods=["POST"])
 async def create_user(request):
-    token = loads(request.body)
+    token = await offloader.run(loads, request.body, size=len(request.body))
 
     authenticator = AuthMediator(
         request.app.database,
@@ -31,9 +77,87 @@ async def create_user(request):
     except Exception as e:
         return json({'status': 'Error', 'message': f'Error authenticating user: {e}'}, 500)
 
-    user = user_to_json(auth_obj.hermes_user)
+    # Lookup and creation failures are recorded on the mediator, not raised
+    if not auth_obj.successful:
+        return json({
+            'status': 'Error',
+            'message': f'Error authenticating user: {", ".join(auth_obj.errors)}'
+        }, 500)
+
+    user = user_to_dict(auth_obj.hermes_user)
+
+    return json_response({'status': 'Success', 'user': user}, 200)
+
+# host/tasks?after=<cursor>&limit=<n>&format=<ndjson|json>
+@base_bp.route('/tasks', methods=["GET", "POST"])
+@withOauth(fast=True)
+async def task_history(request, auth_obj):
+    '''
+    Streams a page of the user's task history as rows are read from a
+    server-side cursor, so memory stays flat however large the page is.
+
+    NDJSON (the default) writes one task per line and ends with a
+    {"next": cursor} line. format=json writes {"tasks": [...], "next": cursor}.
+    next is null on the last page.
+    '''
+    user = await auth_obj.hermes_user
+    if not user:
+        return json({'status': 'Not Found'}, 404)
 
-    return json({'status': 'Success', 'user': user}, 200)
+    try:
+        limit = min(max(int(request.args.get('limit', TASK_PAGE_SIZE)), 1), TASK_PAGE_MAX)
+        cursor = request.args.get('after')
+        after = _decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return json({'status': 'Error', 'message': str(e)}, 400)
+
+    as_array = request.args.get('format') == 'json'
+    query = _task_page_query(str(user['id']), after, limit)
+    encoder = encoder_for(tasks)
+    database = request.app.database
+
+    async def write_tasks(response):
+        count = 0
+        last = None
+
+        if as_array:
+            await response.write(b'{"tasks":[')
+
+        async for row in database.iterate(query):
+            body = dumps(encoder.encode(row))
+            if as_array:
+                await response.write(body if count == 0 else b',' + body)
+            else:
+                await response.write(body + b'\n')
+
+            count += 1
+            last = row
+
+        next_cursor = _encode_cursor(last) if count == limit else None
+
+        if as_array:
+            await response.write(b'],"next":' + dumps(next_cursor) + b'}')
+        else:
+            await response.write(dumps({'next': next_cursor}) + b'\n')
+
+    content_type = 'application/json' if as_array else 'application/x-ndjson'
+    return stream(write_tasks, content_type=content_type)
+
+# host/tasks/<task_id>/status
+@base_bp.route('/tasks/<task_id:uuid>/status', methods=["GET", "POST"])
+@withOauth(fast=True)
+async def task_status_check(request, auth_obj, task_id):
+    '''
+    Live state of one of the user's tasks. Served from Redis, and only goes
+    to Postgres for tasks the status board has never seen or has expired.
+    '''
+    user = await auth_obj.hermes_user
+    status = await task_status.fetch(request.app.database, task_id) if user else None
+
+    if not status or status['owner'] != str(user['id']):
+        return json({'status': 'Not Found'}, 404)
+
+    return json_response({'status': 'Success', 'task': status}, 200)
 
 # host/authorize
 @base_bp.route('/authorize/<user_id:uuid>')
@@ -86,9 +210,14 @@ async def oauth2callback(request):
         state=state,
     )
 
-    # Use the authorization server's response to fetch the OAuth 2.0 tokens.
+    # Use the authorization server's response to fetch the OAuth 2.0 tokens,
+    # without blocking the worker for the round-trip
     authorization_response = request.url
-    flow.fetch_token(authorization_response=authorization_response)
+    try:
+        await token_exchange.fetch_token(flow, authorization_response, state)
+    except TokenExchangeError as e:
+        print(f'error exchanging authorization code: {e}')
+        return redirect('{}?success={}'.format(request.app.config.NEXT_URL, False))
 
     # Store creds in postgres on user by id
     credentials = flow.credentials
@@ -103,6 +232,21 @@ async def oauth2callback(request):
     initialized = await authenticator._async_init()
     finished = await initialized.updateCredentials(cred_dict)
 
+    # Hand the new credentials to @authorized handlers on this session, and
+    # drop the Credentials object cached for the old ones
+    request['session']['credentials'] = cred_dict
+    credential_cache.invalidate(getattr(request['session'], 'sid', None))
+
+    # Have the token refreshed in the background before it expires
+    if finished.successful and credentials.refresh_token and credentials.expiry:
+        try:
+            await credential_refresh.track(
+                request['session']['user_id'],
+                calendar.timegm(credentials.expiry.utctimetuple())
+            )
+        except Exception as e:
+            print(f'error scheduling credential refresh: {e}')
+
     target_url = '{}?success={}'.format(request.app.config.NEXT_URL, finished.successful)
 
     return redirect(target_url)
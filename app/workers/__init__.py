@@ -1 +1 @@
-from ..db import users, tasks, TaskTypes
+from ..db import users, tasks, task_rollups, TaskTypes
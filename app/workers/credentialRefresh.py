@@ -0,0 +1,265 @@
+import asyncio
+import contextvars
+import time
+
+from typing import List
+
+from app.db.statements import select_refreshable_users, select_user_credentials
+from app.helpers.tokenExchange import token_exchange, TokenExchangeError
+
+from . import TaskTypes
+from .mediators import AuthMediator
+
+# Atomically takes up to ARGV[2] users due before ARGV[1] and pushes their
+# scores out to ARGV[3], past ARGV[1], so no process claims them again while
+# they refresh
+_CLAIM = '''
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, user_id in ipairs(due) do
+    redis.call('ZADD', KEYS[1], ARGV[3], user_id)
+end
+return due
+'''
+
+
+class CredentialRefresher:
+    '''
+    Refreshes users' Google access tokens shortly before they expire, so
+    handlers never find an expired token.
+
+    Expiry times live in a Redis sorted set that every worker process
+    shares. Every `interval` seconds the refresher claims up to `batch_size`
+    users whose tokens expire within `lead` seconds. Claiming pushes their
+    scores `lease` seconds ahead, so other processes skip them, and a
+    refresh that fails or dies with its process is retried once the lease
+    runs out. The batch is refreshed with at most `max_concurrency` in
+    flight. New tokens are written back through
+    AuthMediator.updateCredentials, where @authorized picks them up once a
+    session's cached Credentials expire, and their expiry is tracked again.
+    Users whose refresh token was revoked are dropped from the schedule.
+
+    Users are scheduled when they authorize. On startup every user with a
+    refresh token who isn't scheduled yet, eg because they authorized
+    before the scheduler existed, is added as due now. A marker key in
+    Redis lets one process do this per `backfill_every` seconds.
+
+    Attributes:
+    -----------
+        redis: Redis
+            Ref to the app's aioredis pool, set by init_app
+        database: Postgres
+            Ref to a Postgres connection, set by init_app
+        interval: float
+            Seconds between checks for due tokens
+        lead: float
+            Seconds before expiry a token is refreshed
+        batch_size: int
+            Max users claimed per check
+        max_concurrency: int
+            Max refreshes in flight at once
+        lease: float
+            Seconds a claimed user is held before another attempt
+
+    Methods:
+    --------
+        init_app(self, app) -> None:
+            Binds Redis and Postgres and starts the scheduler
+        track(self, user_id: str, expires_at: float) -> None:
+            Schedules a user's token to be refreshed before expires_at
+        untrack(self, user_id: str) -> None:
+            Stops refreshing a user's token
+        refresh_due(self) -> int:
+            Refreshes one batch of due tokens, returning how many succeeded
+        backfill(self) -> int:
+            Schedules stored users that aren't scheduled yet, returning how
+            many were added
+        close(self) -> None:
+            Stops the scheduler
+    '''
+
+    key = 'hermes:credentials:expiry'
+    backfill_key = 'hermes:credentials:backfilled'
+    backfill_every = 3600
+    backfill_page = 1000
+
+    def __init__(self,
+                 interval: float = 30.0,
+                 lead: float = 300.0,
+                 batch_size: int = 50,
+                 max_concurrency: int = 5,
+                 lease: float = 120.0
+                 ) -> None:
+
+        self.redis = None
+        self.database = None
+        self.interval = interval
+        self.lead = lead
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.lease = lease
+        self._runner = None
+
+    @property
+    def running(self) -> bool:
+        return self._runner is not None and not self._runner.done()
+
+    def init_app(self, app) -> None:
+        self.redis = app.redis
+        self.database = app.database
+        self.interval = app.config.CREDENTIAL_REFRESH_INTERVAL
+        self.lead = app.config.CREDENTIAL_REFRESH_LEAD
+        self.batch_size = app.config.CREDENTIAL_REFRESH_BATCH
+        self.max_concurrency = app.config.CREDENTIAL_REFRESH_CONCURRENCY
+        self.lease = app.config.CREDENTIAL_REFRESH_LEASE
+        # Run in an empty context so the backfill gets its own pool
+        # connection rather than sharing whichever one the caller's holds
+        self._runner = contextvars.Context().run(asyncio.ensure_future, self._run())
+
+    async def track(self, user_id: str, expires_at: float) -> None:
+        await self.redis.zadd(self.key, expires_at, str(user_id))
+
+    async def untrack(self, user_id: str) -> None:
+        await self.redis.zrem(self.key, str(user_id))
+
+    async def backfill(self) -> int:
+        if not await self.redis.set(
+            self.backfill_key, 1, expire=self.backfill_every, exist=self.redis.SET_IF_NOT_EXIST
+        ):
+            return 0
+
+        added = 0
+        after = '00000000-0000-0000-0000-000000000000'
+        now = time.time()
+
+        while True:
+            rows = await select_refreshable_users.fetch_all(
+                self.database, after=after, limit=self.backfill_page
+            )
+            if not rows:
+                return added
+
+            pairs = []
+            for row in rows:
+                pairs.extend((now, str(row['id'])))
+
+            # NX keeps the expiry of users scheduled by a login meanwhile
+            added += await self.redis.zadd(self.key, *pairs, exist=self.redis.ZSET_IF_NOT_EXIST)
+            after = str(rows[-1]['id'])
+
+    async def _run(self) -> None:
+        try:
+            added = await self.backfill()
+            if added:
+                print(f'scheduled credential refresh for {added} users')
+        except Exception as e:
+            print(f'error scheduling stored credentials for refresh: {e}')
+
+        while True:
+            try:
+                claimed = await self.refresh_due()
+            except Exception as e:
+                print(f'error refreshing credentials: {e}')
+                claimed = 0
+
+            # A full batch likely means more are due, so go again right away
+            if claimed < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+    async def _claim(self) -> List[str]:
+        now = time.time()
+        due = await self.redis.eval(
+            _CLAIM,
+            keys=[self.key],
+            # A score inside the lead window would be due again at once, so
+            # the lease runs from the end of it
+            args=[now + self.lead, self.batch_size, now + self.lead + self.lease]
+        )
+        return [user_id.decode('utf-8') for user_id in due]
+
+    async def refresh_due(self) -> int:
+        due = await self._claim()
+        if not due:
+            return 0
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def bounded_refresh(user_id):
+            async with semaphore:
+                return await self._refresh_user(user_id)
+
+        # `databases` keys connections on a context variable, which new
+        # tasks inherit. Starting each refresh in an empty context gives it
+        # its own connection from the pool
+        refreshes = [
+            contextvars.Context().run(asyncio.ensure_future, bounded_refresh(user_id))
+            for user_id in due
+        ]
+        results = await asyncio.gather(*refreshes, return_exceptions=True)
+
+        for user_id, result in zip(due, results):
+            if isinstance(result, Exception):
+                print(f'error refreshing credentials for user {user_id}: {result}')
+
+        # Claimed users are counted, refreshed or not, so a batch of
+        # failures still keeps the scheduler moving through the backlog
+        return len(due)
+
+    async def _refresh_user(self, user_id: str) -> bool:
+        row = await select_user_credentials.fetch_one(self.database, user_id=user_id)
+        if not row or not row['refresh_token']:
+            await self.untrack(user_id)
+            return False
+
+        stored = dict(row)
+
+        try:
+            token = await token_exchange.refresh(stored)
+        except TokenExchangeError as e:
+            if e.error == 'invalid_grant':
+                # Revoked or expired refresh token, only the user can fix it
+                print(f'refresh token for user {user_id} is no longer valid')
+                await self.untrack(user_id)
+            else:
+                print(f'error refreshing credentials for user {user_id}: {e}')
+            return False
+
+        creds = {
+            'token': token['access_token'],
+            # Only present when the provider rotated it
+            'refresh_token': token.get('refresh_token') or stored['refresh_token'],
+            'token_uri': stored['token_uri'],
+            'client_id': stored['client_id'],
+            'client_secret': stored['client_secret'],
+            'scopes': stored['scopes'],
+        }
+
+        mediator = AuthMediator(self.database, user_id, TaskTypes['DB_UPDATE'])
+        init_mediator = await mediator._async_init()
+        if init_mediator is None:
+            return False
+
+        finished = await init_mediator.updateCredentials(creds)
+        if finished.successful:
+            # Without an expiry there's nothing to schedule, and leaving the
+            # claim in place would refresh the user every `lease` seconds
+            if 'expires_at' in token:
+                await self.track(user_id, token['expires_at'])
+            else:
+                await self.untrack(user_id)
+
+        return finished.successful
+
+    async def close(self) -> None:
+        if self._runner is None:
+            return
+
+        self._runner.cancel()
+        try:
+            await self._runner
+        except asyncio.CancelledError:
+            pass
+
+        self._runner = None
+
+
+credential_refresh = CredentialRefresher()
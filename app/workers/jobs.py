@@ -0,0 +1,140 @@
+from datetime import datetime
+from itertools import islice
+from typing import AsyncGenerator, Awaitable, Callable, Dict, List, Tuple, Generator
+
+from app.db.statements import select_task_status
+from app.helpers.codec import dumps_tagged, loads_tagged
+
+from .mediators import DBMediator
+from .taskLog import task_log
+
+from . import TaskTypes
+
+# Redis lists holding staged rows are keyed under this prefix
+STAGING_PREFIX = 'hermes:jobs:rows'
+
+# Maps job names to the coroutines that run them. Handlers are called
+# with the app and the job descriptor
+job_handlers: Dict[str, Callable[['Sanic', Dict[str, any]], Awaitable[None]]] = {}
+
+
+def job_handler(name: str):
+    '''
+    Decorator that registers a coroutine as the handler for a job name so that
+    any worker process can run descriptors it pulls off the shared queue.
+    '''
+    def decorator(f):
+        job_handlers[name] = f
+        return f
+    return decorator
+
+
+def make_descriptor(job: str,
+                    task_uuid: str,
+                    user_uuid: str,
+                    task_type: TaskTypes,
+                    payload: Dict[str, any]
+                    ) -> Dict[str, any]:
+    '''
+    Builds a serializable description of a job. Everything a worker needs to
+    run the job has to live in the payload, since the worker may be in
+    another process or on another host.
+    '''
+    return {
+        'job': job,
+        'task_uuid': task_uuid,
+        'user_uuid': user_uuid,
+        'task_type': task_type.name,
+        'enqueued_at': datetime.now(),
+        'payload': payload,
+    }
+
+
+async def stage_db_insert_payload(redis: 'Redis',
+                                  task_uuid: str,
+                                  row_generators: List[Tuple[str, Generator[Dict[str, any], None, None]]],
+                                  chunk_size: int = 5000,
+                                  ttl: int = 86400,
+                                  **options
+                                  ) -> Dict[str, any]:
+    '''
+    Rows have to cross the wire, but a whole ingest is too big for one stream
+    entry. Each generator is streamed into its own Redis list, `chunk_size`
+    rows per entry, and the payload only carries the list keys. Staged rows
+    expire after `ttl` seconds if no worker gets to them.
+    '''
+    tables = []
+
+    for index, (table_name, rows) in enumerate(row_generators):
+        key = f'{STAGING_PREFIX}:{task_uuid}:{index}'
+        rows = iter(rows)
+
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+
+            pipe = redis.pipeline()
+            pipe.rpush(key, dumps_tagged(chunk))
+            pipe.expire(key, ttl)
+            await pipe.execute()
+
+        tables.append([table_name, key])
+
+    return {
+        'tables': tables,
+        'options': options,
+    }
+
+
+async def staged_rows(redis: 'Redis', key: str) -> AsyncGenerator[List[Dict[str, any]], None]:
+    '''
+    Yields the chunks staged under key one at a time. They're read rather
+    than popped, so a retried job finds them all again
+    '''
+    index = 0
+    while True:
+        entry = await redis.lrange(key, index, index)
+        if not entry:
+            return
+
+        yield loads_tagged(entry[0])
+        index += 1
+
+
+async def _task_finished(database: 'Postgres', task_uuid: str) -> bool:
+    buffered = task_log.peek(task_uuid)
+    if buffered and buffered.get('time_finished') is not None:
+        return True
+
+    row = await select_task_status.fetch_one(database, task_id=task_uuid)
+    return row is not None and row['time_finished'] is not None
+
+
+@job_handler('db_insert')
+async def run_db_insert(app, descriptor: Dict[str, any]) -> None:
+    task_uuid = descriptor['task_uuid']
+    payload = descriptor['payload']
+    keys = [key for _, key in payload['tables']]
+
+    # A job is delivered again when its worker dies before acknowledging it.
+    # If the task got as far as finishing, its rows are already in and
+    # inserting them twice would duplicate them
+    if await _task_finished(app.database, task_uuid):
+        print(f'task {task_uuid} already finished, skipping redelivered job')
+    else:
+        mediator = DBMediator(
+            app.database,
+            descriptor['user_uuid'],
+            TaskTypes[descriptor['task_type']]
+        )
+        # The task row was logged when the job was queued
+        mediator.task_uuid = task_uuid
+
+        await mediator.handleDbInserts(
+            [(table_name, staged_rows(app.redis, key)) for table_name, key in payload['tables']],
+            **payload['options']
+        )
+
+    if keys:
+        await app.redis.delete(*keys)
@@ -3,12 +3,35 @@ from typing import List, Tuple, Generator, Dict, Optional
 
 from functools import partial
 
-from .mediators import DBMediator, GraphMediator
+from .mediators import DBMediator
 
 from . import users, tasks, TaskTypes
+from .pool import WorkerPool
+from .redisQueue import RedisJobQueue
+from .jobs import make_descriptor, stage_db_insert_payload
+from .taskStatus import QUEUED
 
 async def create_task_queue(app, loop):
-    app.queue = asyncio.Queue(loop=loop, maxsize=app.config.MAX_QUEUE_SIZE)
+    if app.config.QUEUE_BACKEND == 'redis':
+        app.queue = RedisJobQueue(
+            stream=app.config.QUEUE_STREAM,
+            consumers=app.config.QUEUE_CONSUMERS,
+            visibility_timeout=app.config.QUEUE_VISIBILITY_TIMEOUT,
+            max_deliveries=app.config.QUEUE_MAX_DELIVERIES,
+            max_backlog=app.config.QUEUE_MAX_BACKLOG
+        )
+        await app.queue.start(app)
+    else:
+        app.queue = WorkerPool(
+            name='DB-Worker',
+            min_workers=app.config.WORKER_POOL_MIN,
+            max_workers=app.config.WORKER_POOL_MAX,
+            maxsize=app.config.MAX_QUEUE_SIZE,
+            idle_timeout=app.config.WORKER_IDLE_TIMEOUT,
+            partitions=app.config.WORKER_PARTITIONS,
+            drain_timeout=app.config.WORKER_DRAIN_TIMEOUT
+        )
+        app.queue.start()
 
     async def db_callback(
         row_generators: List[Tuple[str, Generator[Dict[str, 'Table'], None, None]]],
@@ -16,22 +39,74 @@ async def create_task_queue(app, loop):
         update_graph: Optional[bool] = True,
         *args,
         **kwargs
-    ) -> str:
+    ) -> Optional[str]:
+        '''
+        Queues a DB_INSERT job and returns its task uuid, or None if the
+        worker pool is busy and the job was turned away.
+
+        With the redis queue backend the rows are staged in Redis in chunks
+        and referenced from a serializable job descriptor that any worker
+        process can run.
+        '''
+
+        if isinstance(app.queue, RedisJobQueue):
+            # Same as the in-memory pool: no room, no task logged
+            if await app.queue.full():
+                app.queue.rejected += 1
+                return None
+
+            # A worker in another process may finish the task before the
+            # task log would flush, and its UPDATE needs the row to exist
+            mediator = DBMediator(app.database, user_uuid, TaskTypes['DB_INSERT'])
+            init_db_mediator = await mediator._async_init(durable=True)
+            if init_db_mediator is None:
+                return None
+
+            descriptor = make_descriptor(
+                'db_insert',
+                init_db_mediator.task_uuid,
+                user_uuid,
+                TaskTypes['DB_INSERT'],
+                await stage_db_insert_payload(
+                    app.redis,
+                    init_db_mediator.task_uuid,
+                    row_generators,
+                    chunk_size=app.config.QUEUE_STAGING_CHUNK_SIZE,
+                    ttl=app.config.QUEUE_STAGING_TTL,
+                    max_concurrency=app.config.INGEST_CONCURRENCY
+                )
+            )
+            # Published before the job is visible to workers, so it can't
+            # overwrite the running state
+            await init_db_mediator._publish_status(QUEUED)
+            await app.queue.enqueue(descriptor)
+
+            return init_db_mediator.task_uuid
+
+        # Turn the job away before it is logged if there's no room for it
+        if app.queue.full():
+            app.queue.rejected += 1
+            return None
 
         mediator = DBMediator(app.database, user_uuid, TaskTypes['DB_INSERT'])
         init_db_mediator = await mediator._async_init()
-        mediated_db_task = partial(init_db_mediator.handleDbInserts, row_generators)
+        mediated_db_task = partial(
+            init_db_mediator.handleDbInserts,
+            row_generators,
+            max_concurrency=app.config.INGEST_CONCURRENCY
+        )
+        await init_db_mediator._publish_status(QUEUED)
 
-        # Add the job to the queue
-        await app.queue.put(mediated_db_task)
+        # Add the job to the queue. Keying on the user keeps each user's
+        # jobs in order without holding up anyone else's
+        if not app.queue.submit(mediated_db_task, TaskTypes['DB_INSERT'], key=user_uuid):
+            init_db_mediator.errors.append('Worker pool busy')
+            await init_db_mediator._finalize_task()
+            return None
 
         return init_db_mediator.task_uuid
 
-    # Workers to handle updating the DB
-    for i in range(4):
-        app.add_task(
-            db_worker(
-                f"DB-Worker-{i}",
-                app.queue
-            )
-        )
+    app.db_callback = db_callback
+
+async def stop_task_queue(app, loop):
+    await app.queue.close()
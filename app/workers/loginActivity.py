@@ -0,0 +1,260 @@
+import asyncio
+import time
+import uuid
+
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.helpers.userCache import user_cache
+
+from . import users, tasks, TaskTypes
+from .taskLog import bulk_update_query, chunks
+
+# Moves the live window's hashes to the claimed keys in ARGV order and logs
+# the claim, all or nothing. RENAME inside MULTI can fail for one key and
+# still run for the others, so each key is checked here first
+_CLAIM = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+for i = 1, 3 do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call('RENAME', KEYS[i], KEYS[i + 3])
+    end
+end
+redis.call('ZADD', KEYS[7], ARGV[2], ARGV[1])
+return 1
+'''
+
+# Folds a claimed window back into the live one, adding counts and keeping
+# the earliest first and latest last seen times, then drops the claim
+_MERGE = '''
+local counts = redis.call('HGETALL', KEYS[4])
+for i = 1, #counts, 2 do
+    redis.call('HINCRBY', KEYS[1], counts[i], counts[i + 1])
+end
+local firsts = redis.call('HGETALL', KEYS[5])
+for i = 1, #firsts, 2 do
+    local current = redis.call('HGET', KEYS[2], firsts[i])
+    if not current or tonumber(firsts[i + 1]) < tonumber(current) then
+        redis.call('HSET', KEYS[2], firsts[i], firsts[i + 1])
+    end
+end
+local lasts = redis.call('HGETALL', KEYS[6])
+for i = 1, #lasts, 2 do
+    local current = redis.call('HGET', KEYS[3], lasts[i])
+    if not current or tonumber(lasts[i + 1]) > tonumber(current) then
+        redis.call('HSET', KEYS[3], lasts[i], lasts[i + 1])
+    end
+end
+redis.call('DEL', KEYS[4], KEYS[5], KEYS[6])
+redis.call('ZREM', KEYS[7], ARGV[1])
+return #counts / 2
+'''
+
+
+class LoginActivity:
+    '''
+    Records logins as Redis counters and last-seen timestamps instead of one
+    tasks row per login, and periodically aggregates them into Postgres.
+
+    Each login is one MULTI round-trip to Redis that bumps the user's
+    count for the current window and in a running total, and sets their
+    first and last seen times. Every `flush_interval` seconds the flusher
+    claims the window by renaming its hashes. It then writes one
+    AUTHENTICATE tasks row per active user, spanning their first to last
+    login, and bulk-updates users.last_fetch, in one transaction. The
+    claimed hashes are only deleted once that commits, and the updated users
+    are then dropped from the user cache. If the transaction fails the hashes
+    are merged back into the live window for the next flush. Claims are logged
+    in a sorted set, so a window claimed by a process that died mid-flush
+    is merged back once it is `claim_lease` seconds old. The running totals
+    stay in Redis.
+
+    Attributes:
+    -----------
+        redis: Redis
+            Ref to the app's aioredis pool, set by init_app
+        database: Postgres
+            Ref to a Postgres connection, set by init_app
+        flush_interval: float
+            Seconds between flushes
+        claim_lease: float
+            Seconds after which an unfinished claim is taken to be abandoned
+
+    Methods:
+    --------
+        init_app(self, app) -> None:
+            Binds Redis and Postgres, reads the flush interval and claim
+            lease from Config and starts the flusher
+        record(self, user_uuid: str) -> None:
+            Records a login for a user
+        flush(self) -> int:
+            Aggregates the current window into Postgres, returning the
+            number of users written
+        close(self) -> None:
+            Stops the flusher after a final flush, logging rather than
+            raising its errors
+    '''
+
+    prefix = 'hermes:logins'
+    batch_size = 500
+
+    def __init__(self, flush_interval: float = 60.0, claim_lease: float = 600.0) -> None:
+        self.redis = None
+        self.database = None
+        self.flush_interval = flush_interval
+        self.claim_lease = claim_lease
+        self._flusher = None
+
+        self.count_key = f'{self.prefix}:count'
+        self.total_key = f'{self.prefix}:total'
+        self.first_key = f'{self.prefix}:first'
+        self.last_key = f'{self.prefix}:last'
+        self.claims_key = f'{self.prefix}:claims'
+
+    @property
+    def running(self) -> bool:
+        return self._flusher is not None and not self._flusher.done()
+
+    def init_app(self, app) -> None:
+        self.redis = app.redis
+        self.database = app.database
+        self.flush_interval = app.config.LOGIN_FLUSH_INTERVAL
+        self.claim_lease = app.config.LOGIN_CLAIM_LEASE
+        self._flusher = asyncio.ensure_future(self._run())
+
+    async def record(self, user_uuid: str) -> None:
+        now = time.time()
+
+        # MULTI keeps the four writes in one window even if a flush claims
+        # the window at the same moment, and still costs one round-trip
+        tr = self.redis.multi_exec()
+        tr.hincrby(self.count_key, user_uuid, 1)
+        tr.hincrby(self.total_key, user_uuid, 1)
+        tr.hsetnx(self.first_key, user_uuid, now)
+        tr.hset(self.last_key, user_uuid, now)
+        await tr.execute()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f'error flushing login activity: {e}')
+
+    def _window_keys(self, claim: str) -> List[str]:
+        live = [self.count_key, self.first_key, self.last_key]
+        return live + [f'{key}:{claim}' for key in live] + [self.claims_key]
+
+    async def _claim_window(self) -> Tuple[Optional[str], Dict[bytes, bytes], Dict[bytes, bytes], Dict[bytes, bytes]]:
+        '''
+        Atomically moves the window's hashes to keys unique to this flush, so
+        logins recorded meanwhile land in a fresh window and flushers in other
+        processes can't claim the same data
+        '''
+        claim = f'flush:{uuid.uuid4()}'
+        keys = self._window_keys(claim)
+
+        if not await self.redis.eval(_CLAIM, keys=keys, args=[claim, time.time()]):
+            return None, {}, {}, {}
+
+        pipe = self.redis.pipeline()
+        reads = [pipe.hgetall(key) for key in keys[3:6]]
+        await pipe.execute()
+
+        counts, firsts, lasts = [await read for read in reads]
+        return claim, counts, firsts, lasts
+
+    async def _release(self, claim: str) -> None:
+        keys = self._window_keys(claim)
+        tr = self.redis.multi_exec()
+        tr.delete(*keys[3:6])
+        tr.zrem(self.claims_key, claim)
+        await tr.execute()
+
+    async def _merge_back(self, claim: str) -> int:
+        return await self.redis.eval(_MERGE, keys=self._window_keys(claim), args=[claim])
+
+    async def _recover_abandoned(self) -> None:
+        abandoned = await self.redis.zrangebyscore(
+            self.claims_key, max=time.time() - self.claim_lease
+        )
+        for claim in abandoned:
+            claim = claim.decode('utf-8')
+            merged = await self._merge_back(claim)
+            print(f'merged {merged} logins from abandoned claim {claim} back into the window')
+
+    async def flush(self) -> int:
+        await self._recover_abandoned()
+
+        claim, counts, firsts, lasts = await self._claim_window()
+        if not counts:
+            if claim is not None:
+                await self._release(claim)
+            return 0
+
+        rows = []
+        seen: List[Tuple[str, Dict[str, datetime]]] = []
+
+        for user_id in counts:
+            first = datetime.fromtimestamp(float(firsts.get(user_id, lasts[user_id])))
+            last = datetime.fromtimestamp(float(lasts[user_id]))
+            owner = user_id.decode('utf-8')
+
+            rows.append({
+                'id': str(uuid.uuid4()),
+                'owner': owner,
+                'task_type': TaskTypes['AUTHENTICATE'].name,
+                'time_start': first,
+                'time_finished': last,
+                'error': '',
+                'success': True,
+            })
+            seen.append((owner, {'last_fetch': last}))
+
+        emails = []
+        try:
+            # One transaction, so a failure leaves nothing behind to be
+            # written twice once the window is merged back
+            async with self.database.transaction():
+                for chunk in chunks(rows, self.batch_size):
+                    await self.database.execute(tasks.insert().values(chunk))
+
+                for chunk in chunks(seen, self.batch_size):
+                    query, values = bulk_update_query(users, ['last_fetch'], chunk, returning=['email'])
+                    updated = await self.database.fetch_all(query=query, values=values)
+                    emails.extend(row['email'] for row in updated)
+        except Exception:
+            await self._merge_back(claim)
+            raise
+
+        await self._release(claim)
+        # Cached users keyed by email still hold the old last_fetch
+        await user_cache.invalidate(*emails)
+
+        return len(rows)
+
+    async def close(self) -> None:
+        if self._flusher is None:
+            return
+
+        self._flusher.cancel()
+        try:
+            await self._flusher
+        except asyncio.CancelledError:
+            pass
+
+        self._flusher = None
+
+        # Shutdown carries on to close the database either way, and the
+        # window is merged back for the next process to flush
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f'error flushing login activity on close: {e}')
+
+
+login_activity = LoginActivity()
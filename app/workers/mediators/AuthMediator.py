@@ -1,18 +1,21 @@
-import jwt
-import os
 import uuid
 
 from datetime import datetime
 
-from typing import Dict, Union, List
+from typing import Dict, Union, List, Tuple
 
 from app.db import TaskTypes
+from app.db.statements import select_user_by_email, insert_new_user, update_credentials
+from app.helpers.tokens import token_cache
+from app.helpers.userCache import user_cache
+from app.helpers.singleflight import SingleFlight
 from . import BaseMediator
 from . import users
 
 from sqlalchemy.sql import select, insert
 
-import google.oauth2.credentials
+# Coalesces concurrent lookups / creations of the same email
+user_flight = SingleFlight()
 
 
 class AuthMediator(BaseMediator):
@@ -28,8 +31,11 @@ class AuthMediator(BaseMediator):
     --------
         handleJWT(self, access_token: str) -> AuthMediator:
             Takes a JWT access token and attempts to retrieve the user from
-            Postgres. If the user isn't there, create a new user. Either way,
-            store the resulting user as an instance attribute and return self.
+            the user cache, falling back to Postgres. If the user isn't there,
+            create a new user. Either way, store the resulting user as an
+            instance attribute and return self.
+        createNewUser(self, jwt_user: Dict[str, Union[str, int]]) -> Tuple[Dict, bool]:
+            Upserts a new user, returning the row and whether it was created.
 
     '''
 
@@ -57,77 +63,91 @@ class AuthMediator(BaseMediator):
                  'scopes': self.hermes_user['scopes']}
 
 
+        # The google auth stack loads on first use, not at startup
+        import google.oauth2.credentials
+
         return google.oauth2.credentials.Credentials(**creds)
 
 
     async def handleJWT(self, access_token: str) -> 'AuthMediator':
-        ''' Wraps the logic of finding or creating a User'''
+        '''
+        Wraps the logic of finding or creating a User. Concurrent logins for
+        the same email within this process share one lookup / creation.
+        '''
 
-        jwt_user = jwt.decode(access_token, os.getenv('JWT_SECRET', None))
-        query = 'SELECT * FROM users WHERE users.email = :email'
-        pg_user = await self.database.fetch_one(
-            query=query,
-            values={'email': jwt_user.get('email')}
-        )
+        jwt_user = await token_cache.decode(access_token)
 
-        if not pg_user:
-            await self.createNewUser(jwt_user)
+        try:
+            (pg_user, created), shared = await user_flight.do(
+                jwt_user.get('email'),
+                lambda: self._findOrCreateUser(jwt_user)
+            )
+        except Exception as e:
+            self._update_errors(e)
+            return self
 
-        else:
-            # Otherwise, set the user id as an instance attribute
-            # and track the login time for that user
-            self.user_uuid = str(pg_user['id'])
-            await self._track_login()
+        # Set the user id as an instance attribute and track the login
+        # time for that user. Only the login that created the user is
+        # tracked as NEW_USER
+        self.user_uuid = str(pg_user['id'])
+        if created and not shared:
+            self.task_type = TaskTypes['NEW_USER']
 
-            self.hermes_user = pg_user
+        self.hermes_user = pg_user
+        await self._track_login()
 
         return self
 
-    async def createNewUser(self, jwt_user: Dict[str, Union[str, int]]) -> None:
-        # If no user is found, create a new User uuid and change the task_type
-        # to NEW USER and initialize a wrapper to track the task of
-        # creating a new user
-        user_uuid = uuid.uuid4()
-        self.user_uuid = str(user_uuid)
-        self.task_type = TaskTypes['NEW_USER']
+    async def _findOrCreateUser(self, jwt_user: Dict[str, Union[str, int]]) -> Tuple[Dict[str, any], bool]:
+        pg_user = await user_cache.get_or_load(
+            jwt_user.get('email'),
+            lambda: select_user_by_email.fetch_one(self.database, email=jwt_user.get('email'))
+        )
 
-        try:
-            insert_stmt = '''
-            INSERT INTO users
-            VALUES(:id, :email, :name, :permission, :verified, :phone, :last_fetch)
-            '''
-            new_user = {"id": self.user_uuid, 'email': jwt_user['email'],
-                        'name': jwt_user['name'], 'permission': 'BASE',
-                        'verified': jwt_user['verified'], 'phone': jwt_user['phone'],
-                        'last_fetch': datetime.now()}
-
-            await self.database.execute(
-                query=insert_stmt,
-                values=new_user
-            )
+        if pg_user:
+            return pg_user, False
 
-            self.hermes_user = new_user
-            await self._track_login()
+        return await self.createNewUser(jwt_user)
 
-        except Exception as e:
-            self._update_errors(e)
+    async def createNewUser(self, jwt_user: Dict[str, Union[str, int]]) -> Tuple[Dict[str, any], bool]:
+        '''
+        Creates a new User with an upsert, returning the user row and whether
+        this call created it. If another process created the same email first,
+        its row is returned instead of failing on the unique constraint.
+        '''
+        new_user = {"id": str(uuid.uuid4()), 'email': jwt_user['email'],
+                    'name': jwt_user['name'], 'permission': 'BASE',
+                    'verified': jwt_user['verified'], 'phone': jwt_user['phone'],
+                    'last_fetch': datetime.now()}
+
+        created = await insert_new_user.fetch_one(self.database, **new_user)
+        await user_cache.invalidate(jwt_user['email'])
 
-        return
+        if created:
+            return dict(created), True
+
+        # Lost the race to another process, so use the row it created
+        existing = await select_user_by_email.fetch_one(self.database, email=jwt_user['email'])
+        if existing is None:
+            # The conflicting row was gone again by the time it was read
+            raise LookupError(f'user {jwt_user["email"]} was neither created nor found')
+
+        return dict(existing), False
 
     async def updateCredentials(self, creds: Dict[str, Union[str, List[str]]]) -> 'AuthMediator':
         try:
-            update_user = self.table_refs['users'].update(). \
-                where(self.table_refs['users'].c.id == self.user_uuid). \
-                values(
-                    token=creds['token'],
-                    refresh_token=creds['refresh_token'],
-                    token_uri=creds['token_uri'],
-                    client_id=creds['client_id'],
-                    client_secret=creds['client_secret'],
-                    scopes=creds['scopes']
+            updated = await update_credentials.fetch_one(
+                self.database,
+                user_id=self.user_uuid,
+                token=creds['token'],
+                refresh_token=creds['refresh_token'],
+                token_uri=creds['token_uri'],
+                client_id=creds['client_id'],
+                client_secret=creds['client_secret'],
+                scopes=creds['scopes']
             )
-
-            await self.database.execute(update_user)
+            if updated:
+                await user_cache.invalidate(updated['email'])
 
         except Exception as e:
             self._update_errors(e)
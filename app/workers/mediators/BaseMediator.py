@@ -1,4 +1,5 @@
 import asyncio
+import random
 from datetime import datetime
 from enum import Enum
 
@@ -10,9 +11,14 @@ from itertools import groupby
 
 from sqlalchemy.sql import select, insert, update, join
 
-from . import users, message_objs, comm_nodes, entities, \
-    tasks, interactions, interaction_groups, graph_nodes, \
-    TaskTypes, form_data, subscriptions
+from . import users, tasks, TaskTypes
+
+from app.db.statements import finalize_task, select_task_status
+
+from ..taskLog import task_log
+from ..taskEvents import task_notifier
+from ..loginActivity import login_activity
+from ..taskStatus import task_status
 
 class BaseMediator:
     '''
@@ -41,8 +47,10 @@ class BaseMediator:
         @property
         successful(self) -> bool:
             property that returns True if there are no errors and False if there are
-        _async_init(self) -> None:
-            Creates a new task id and logs the unfinished task in Postgres
+        _async_init(self, durable: bool) -> None:
+            Creates a new task id and logs the unfinished task in Postgres,
+            through the write-behind task log when it is running unless
+            durable is set
         _gen_uuid() -> str:
             Creates a new uuid and returns its string representation
         _update_errors(self, error: Exception) -> None:
@@ -50,11 +58,18 @@ class BaseMediator:
             the instance's error container
         _tracked_login(self) -> None:
             Method to track tasks that don't begin with access to a user uuid.
+        _publish_status(self, state: str) -> None:
+            Records a lifecycle transition on the Redis task status board
+        _publish_rows(self, table_name: str, rows: int) -> None:
+            Adds rows written to a table, and the current error count, to the
+            task's live status
         _finalize_task(self) -> None:
             Logs the finish time, success state, and errors from the task then updates
-            the task status in Postgres
-        _wait_for_task(target_task: str, max_retries: int, func: Callable[[any], Awaitable[any]])
-            Polls the db for a task to finish before executing the passed function
+            the task status in Postgres and Redis and notifies anyone waiting on the task
+        _wait_for_task(target_task: str, func: Callable[[any], Awaitable[any]], max_retries: int)
+            Waits for a task to finish before executing the passed function. Awaits
+            the task's completion notification, and falls back to polling the db
+            with jittered backoff when notifications aren't available
     '''
     __slots__ = ['errors', 'database', 'user_uuid',
                  'task_uuid', 'task_type', 'table_refs']
@@ -89,12 +104,15 @@ class BaseMediator:
         Takes a raw exception and appends the str representation of
         the Exception message to the instance's error container
         '''
-        self.errors.append(str(error.message))
+        self.errors.append(str(getattr(error, 'message', error)))
 
-    async def _async_init(self) -> 'Mediator':
+    async def _async_init(self, durable: bool = False) -> 'Mediator':
         '''
         Asynchronously stores the initial task details in Postgres.
         Returns a Mediator copy with all attributes.
+
+        durable writes the row right away rather than through the task log
+        buffer, for tasks another process may finish before it flushes.
         '''
 
         new_task = {
@@ -107,6 +125,10 @@ class BaseMediator:
             'success': bool(False),
         }
 
+        if task_log.running and not durable:
+            task_log.insert(new_task)
+            return self
+
         insert_stmt = insert(self.table_refs['tasks'], values=new_task)
 
         try:
@@ -117,27 +139,75 @@ class BaseMediator:
 
         return self
 
-    async def _finalize_task(self) -> None:
+    async def _publish_status(self, state: str) -> None:
+        # Live status is best effort and never fails the task
+        if not task_status.running:
+            return
+
         try:
-            update_tasks = self.table_refs['tasks'].update(). \
-                where(self.table_refs['tasks'].c.id == self.task_uuid). \
-                values(
-                    time_finished=datetime.now(),
-                    error=str(', '.join(self.errors)),
-                    success=len(self.errors) == 0)
+            await task_status.set_state(
+                self.task_uuid,
+                state,
+                owner=self.user_uuid,
+                task_type=self.task_type.name
+            )
+        except Exception as e:
+            print(f'error publishing status of task {self.task_uuid}: {e}')
 
-            await self.database.execute(update_tasks)
+    async def _publish_rows(self, table_name: str, rows: int) -> None:
+        if not task_status.running:
+            return
 
+        try:
+            await task_status.add_rows(self.task_uuid, table_name, rows, len(self.errors))
         except Exception as e:
-            print(f'error updating task: {self.task_uuid} error: {e}')
-            self._update_errors(e)
-            return
+            print(f'error publishing progress of task {self.task_uuid}: {e}')
+
+    async def _finalize_task(self) -> None:
+        finished = {
+            'time_finished': datetime.now(),
+            'error': str(', '.join(self.errors)),
+            'success': len(self.errors) == 0,
+        }
+
+        if task_log.running:
+            task_log.update(self.task_uuid, finished)
+        else:
+            try:
+                await finalize_task.execute(self.database, task_id=self.task_uuid, **finished)
+
+            except Exception as e:
+                print(f'error updating task: {self.task_uuid} error: {e}')
+                self._update_errors(e)
+
+        if task_status.running:
+            try:
+                await task_status.finish(
+                    self.task_uuid,
+                    self.successful,
+                    ', '.join(self.errors),
+                    owner=self.user_uuid,
+                    task_type=self.task_type.name
+                )
+            except Exception as e:
+                print(f'error publishing status of task {self.task_uuid}: {e}')
+
+        await task_notifier.publish(self.task_uuid, self.successful)
 
         return
 
     async def _track_login(self) -> None:
         ''' Helper method to track actions that begin without a uuid or Owner'''
 
+        # Plain logins are aggregated in Redis and flushed to Postgres in bulk
+        if login_activity.running and self.task_type == TaskTypes['AUTHENTICATE'] \
+                and self.successful:
+            try:
+                await login_activity.record(self.user_uuid)
+                return
+            except Exception as e:
+                print(f'error recording login, logging it directly: {e}')
+
         tracked_login = {
             'id': self.task_uuid,
             'owner': self.user_uuid,
@@ -148,6 +218,10 @@ class BaseMediator:
             'success': len(self.errors) == 0,
         }
 
+        if task_log.running:
+            task_log.insert(tracked_login)
+            return
+
         stmt = insert(self.table_refs['tasks'], values=tracked_login)
 
         try:
@@ -158,41 +232,84 @@ class BaseMediator:
 
         return
 
+    async def _fetch_task_status(self, target_task: str) -> Optional[bool]:
+        '''
+        Returns the success state of a finished task, or None if the
+        task hasn't finished (or hasn't been written) yet
+        '''
+        # A finished task may still be sitting in the write-behind buffer
+        buffered = task_log.peek(target_task)
+        if buffered and buffered.get('time_finished') is not None:
+            return bool(buffered['success'])
+
+        task_data = await select_task_status.fetch_one(self.database, task_id=target_task)
+
+        if not task_data or task_data['time_finished'] is None:
+            return None
+
+        return bool(task_data['success'])
+
+    async def _poll_task(self,
+                         target_task: str,
+                         max_retries: int,
+                         base_delay: float = 0.05,
+                         max_delay: float = 2.0
+                         ) -> Optional[bool]:
+        ''' Fallback for _wait_for_task: polls with full-jitter exponential backoff '''
+
+        for attempt in range(max_retries + 1):
+            status = await self._fetch_task_status(target_task)
+            if status is not None:
+                return status
+
+            await asyncio.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+        self.errors.append(f'Max retries exceeded: {max_retries + 1} made')
+        return None
+
     async def _wait_for_task(self,
                              target_task: str,
                              func: Callable[[any], Awaitable[any]],
                              max_retries: Optional[int] = 10,
                              *args,
+                             timeout: float = 30.0,
                              **kwargs
-                             ) -> None:
+                             ) -> any:
 
         async def errorCallback(*args, **kwargs) -> None:
-            print('something went wrong')
+            print(f'task {target_task} failed, skipping {func}')
 
         # If success is True on the task, start doing work
-        # Otherwise, keep sleeping until the task works
+        # Otherwise, report the failed dependency
         actionSwitch = {
             True: func,
             False: errorCallback
         }
 
-        attempts = 0
-        tasks = self.table_refs['tasks']
+        status = None
 
-        while True:
-            if attempts > max_retries:
-                self.errors.append(f'Max retries exceeded: {attempts} made')
-                break
+        try:
+            if task_notifier.running:
+                # Subscribe before checking the db so a completion that lands
+                # between the two can't be missed
+                waiter = task_notifier.subscribe(target_task)
+                try:
+                    status = await self._fetch_task_status(target_task)
+                    if status is None:
+                        status = await asyncio.wait_for(waiter, timeout)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    task_notifier.discard(target_task, waiter)
+
+            if status is None:
+                status = await self._poll_task(target_task, max_retries)
 
-            try:
-                query = '''SELECT * FROM tasks WHERE tasks.id = :task_id '''
-                task_data = await self.database.fetch_one(
-                    query=query,
-                    values={'task_id': target_task}
-                )
+        except Exception as e:
+            self._update_errors(e)
+            return None
 
-            except Exception as e:
-                self._update_errors(e)
-                break
+        if status is None:
+            return None
 
-        return
+        return await actionSwitch[status](*args, **kwargs)
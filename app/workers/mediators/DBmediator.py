@@ -1,23 +1,49 @@
+import asyncio
+import contextvars
 import datetime
+import time
 
-from typing import Generator, List, Tuple, Dict
+from enum import Enum
+
+from itertools import islice
+from typing import Generator, List, Tuple, Dict, Iterator, Optional
 from sqlalchemy.sql import select
 from sqlalchemy.dialects.postgresql import insert
 
 from app.db import TaskTypes
+from app.db.statements import statements
 
 from . import BaseMediator
+from ..taskStatus import RUNNING
 
+_MAX_BIND_PARAMS = 32767
 
 
 class DBMediator(BaseMediator):
     '''
     Mediator to track and chain graph related tasks
 
+    Attributes:
+    -----------
+        ingest_stats: Dict[str, Dict[str, float]]
+            Per-table row counts, chunk counts and throughput for bulk copies,
+            summed over every copy of the table in the task
+        conflict_reports: Dict[str, List[Dict[str, int]]]
+            Per-table, per-batch inserted and skipped counts from handleConflicts
+
     Methods:
     --------
         loadGraphClusters(self, startDate: datetime, endDate: datetime)
             returns a generator that yields groups of entities clustered by msg_id
+        handleConflicts(self, table_name: str, input_gen: Generator, conflict_target: List[str])
+            Inserts rows in multi-row batches, skipping rows that conflict
+        copyRows(self, table_name: str, input_gen: Generator, chunk_size: int)
+            Streams rows from a generator into Postgres with binary COPY,
+            one bounded chunk at a time
+        loadTable(self, table_name: str, input_gen: Generator, bulk: bool, chunk_size: int)
+            Loads a single row generator into its table
+        handleDbInserts(self, input_generators: List[Tuple[str, Generator]], log_task: bool)
+            Loads several tables in foreign key order, concurrently where possible
 
     '''
 
@@ -28,81 +54,274 @@ class DBMediator(BaseMediator):
                  ) -> None:
 
         super().__init__(database, user_uuid, TaskType)
+        self.ingest_stats = {}
+        self.conflict_reports = {}
 
     async def handleConflicts(self,
                               table_name: str,
-                              input_gen: Tuple[str, Generator[Dict[str, any], None, None]]
+                              input_gen: Generator[Dict[str, any], None, None],
+                              conflict_target: Optional[List[str]] = None,
+                              batch_size: int = 500
                               ) -> None:
         '''
-        Function to sequentially add rows to Postgres and pass on any rows raise a conflict
+        Function to add rows to Postgres in multi-row batches and pass on any rows
+        that raise a conflict. Each batch is a single INSERT ... ON CONFLICT DO NOTHING
+        statement, one per set of columns when rows in a batch differ. A failed
+        batch is recorded in the mediator's errors and the stream moves on to
+        the next batch.
 
         Params:
         ----------
             table_name:str
                 string name of the table to target
-            input_gen: Tuple[str, Generator[Dict[str, any], None, None]]
+            input_gen: Generator[Dict[str, any], None, None]
                 Generator that yields rows of data for a specific table
+            conflict_target: Optional[List[str]]
+                Columns of the unique index to check for conflicts. Skips rows that
+                conflict with any constraint when omitted
+            batch_size: int
+                Max number of rows per statement
         '''
 
-        while True:
-            try:
-                row = next(input_gen)
+        table = self.table_refs[table_name]
+        reports = self.conflict_reports.setdefault(table_name, [])
+        returning = list(table.primary_key.columns)
 
-                stmt = insert(
-                    self.table_refs[table_name]
-                ).values(**row).on_conflict_do_nothing(
-                    index_elements=['email']
-                )
+        for index, batch in enumerate(_chunked(input_gen, batch_size)):
+            # A multi-row VALUES list needs the same columns on every row, so
+            # rows are split by column set first. Postgres also caps a
+            # statement at 32767 bind params, so wide rows split further
+            for columns, rows in _group_by_columns(batch).items():
+                per_stmt = max(1, _MAX_BIND_PARAMS // max(1, len(columns)))
+
+                for sub_batch in (rows[i:i + per_stmt] for i in range(0, len(rows), per_stmt)):
+                    stmt = insert(table).values(sub_batch).on_conflict_do_nothing(
+                        index_elements=conflict_target
+                    ).returning(*returning)
 
-                await self.database.execute(stmt)
-            except StopIteration:
-                break
+                    report = {'batch': index, 'rows': len(sub_batch), 'inserted': 0, 'skipped': 0}
 
-            except Exception as e:
-                print(f'Error saving {table_name} to DB: {e}')
-                self._update_errors(e)
-                break
+                    try:
+                        inserted = await self.database.fetch_all(stmt)
+                        report['inserted'] = len(inserted)
+                        report['skipped'] = len(sub_batch) - len(inserted)
 
-            print(f'successfully saved {table_name} to DB')
+                    except Exception as e:
+                        print(f'Error saving {table_name} batch {index} to DB: {e}')
+                        self.errors.append(f'{table_name} batch {index} ({len(sub_batch)} rows): {e}')
+                        report['error'] = str(e)
+
+                    reports.append(report)
+                    await self._publish_rows(table_name, report['inserted'])
+
+        print('saved {} to DB: {} inserted, {} skipped'.format(
+            table_name,
+            sum(r['inserted'] for r in reports),
+            sum(r['skipped'] for r in reports)))
 
         return
 
 
+    async def copyRows(self,
+                       table_name: str,
+                       input_gen: Generator[Dict[str, any], None, None],
+                       chunk_size: int = 5000
+                       ) -> None:
+        '''
+        Streams rows into Postgres through asyncpg's binary COPY. Only one
+        chunk of the generator is held in memory at a time. A chunk that fails
+        to copy is recorded in the mediator's errors and the stream moves on
+        to the next chunk. Stats add to any earlier copies of the table,
+        eg the other chunks of a staged payload.
+
+        Params:
+        ----------
+            table_name: str
+                string name of the table to target
+            input_gen: Generator[Dict[str, any], None, None]
+                Generator that yields rows of data for a specific table
+            chunk_size: int
+                Max number of rows sent per COPY
+        '''
+
+        table = self.table_refs[table_name]
+        stats = self.ingest_stats.setdefault(
+            table_name,
+            {'rows': 0, 'chunks': 0, 'failed_chunks': 0, 'seconds': 0.0}
+        )
+        columns = None
+        t0 = time.perf_counter()
+
+        # Acquiring the connection can fail too, eg when the pool is
+        # exhausted, and that has to end up in errors like a failed chunk
+        try:
+            async with self.database.connection() as connection:
+                raw_connection = connection.raw_connection
+
+                for index, chunk in enumerate(_chunked(input_gen, chunk_size)):
+                    # Column order is fixed by the first row, in table order
+                    if columns is None:
+                        columns = [col.name for col in table.columns if col.name in chunk[0]]
+
+                    records = [
+                        tuple(_copy_value(row.get(col)) for col in columns)
+                        for row in chunk
+                    ]
+
+                    try:
+                        await raw_connection.copy_records_to_table(
+                            table.name,
+                            records=records,
+                            columns=columns
+                        )
+                        stats['rows'] += len(records)
+                        stats['chunks'] += 1
+                        copied = len(records)
+
+                    except Exception as e:
+                        print(f'Error copying chunk {index} of {table_name} to DB: {e}')
+                        self.errors.append(f'{table_name} chunk {index} ({len(records)} rows): {e}')
+                        stats['failed_chunks'] += 1
+                        copied = 0
+
+                    await self._publish_rows(table_name, copied)
+
+        except Exception as e:
+            print(f'Error copying {table_name} to DB: {e}')
+            self._update_errors(e)
+
+        stats['seconds'] += time.perf_counter() - t0
+        stats['rows_per_second'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+
+        print('copied {} rows to {} in {:.3f}s ({:.0f} rows/s)'.format(
+            stats['rows'], table_name, stats['seconds'], stats['rows_per_second']))
+
+        return
+
+    async def loadTable(self,
+                        table_name: str,
+                        input_gen: Generator[Dict[str, any], None, None],
+                        bulk: bool = False,
+                        chunk_size: int = 5000
+                        ) -> None:
+        '''
+        Loads a single row generator, or an async iterator of row chunks,
+        into its table, picking the insert strategy for that table
+        '''
+
+        if table_name == 'graph_nodes':
+            await self.handleConflicts(table_name, input_gen, conflict_target=['email'])
+            return
+
+        # Rows staged elsewhere, eg by the redis job queue, arrive as an
+        # async stream of chunks and are loaded one chunk at a time
+        if hasattr(input_gen, '__aiter__'):
+            async for chunk in input_gen:
+                await self.loadTable(table_name, iter(chunk), bulk, chunk_size)
+            return
+
+        if bulk:
+            await self.copyRows(table_name, input_gen, chunk_size)
+            return
+
+        # Rows are counted per chunk as they're inserted rather than by
+        # materialising the whole generator up front
+        saved = 0
+
+        try:
+            for chunk in _chunked(input_gen, chunk_size):
+                await self.database.execute_many(
+                    query=self.table_refs[table_name].insert(),
+                    values=chunk
+                )
+                saved += len(chunk)
+                await self._publish_rows(table_name, len(chunk))
+
+            print(f'successfully saved {saved} rows of {table_name} to DB')
+
+        except Exception as e:
+            print(f'Error saving {table_name} to DB after {saved} rows: {e}')
+            self._update_errors(e)
+            await self._publish_rows(table_name, 0)
+
+        return
+
     async def handleDbInserts(self,
                               input_generators: List[Tuple[str, Generator[Dict[str, any], None, None]]],
                               log_task: bool = True,
                               *args,
+                              bulk: bool = False,
+                              chunk_size: int = 5000,
+                              max_concurrency: int = 4,
+                              single_transaction: bool = False,
                               **kwargs
                               ) -> None:
         '''
-        Function that allows for sequential Postgres Table inserts using Generators
+        Function that allows for Postgres Table inserts using Generators. Tables are
+        loaded in foreign key dependency order, eg users before tasks, and tables
+        that don't depend on each other are loaded concurrently on separate pool
+        connections.
 
         Params:
         --------
         input_generators: List[Tuple[str, Generator[Dict[str, any]]]]
             Takes a list of tuples where the first element is a Table str name and
             The second element is a row Generator to feed Postgres insert data
+        bulk: bool
+            Stream each generator through binary COPY instead of executemany
+        chunk_size: int
+            Max number of rows per COPY when bulk is set
+        max_concurrency: int
+            Max number of tables loaded at the same time
+        single_transaction: bool
+            Run the whole job in one transaction. A transaction is bound to a
+            single connection, so tables are loaded one after another
 
         '''
 
-        for gen in input_generators:
-            if gen[0] == 'graph_nodes':
-                await self.handleConflicts(gen[0], gen[1])
+        await self._publish_status(RUNNING)
 
-            try:
-                await self.database.execute_many(
-                    query=self.table_refs[gen[0]].insert(),
-                    values=gen[1]
-                )
-                print(f'successfully saved {gen[0]} to DB')
+        # Whatever goes wrong, the task is finalized so it never stays queued
+        try:
+            levels = _dependency_levels(input_generators, self.table_refs)
+
+            if single_transaction:
+                try:
+                    async with self.database.transaction():
+                        for level in levels:
+                            for table_name, input_gen in level:
+                                await self.loadTable(table_name, input_gen, bulk, chunk_size)
+                except Exception as e:
+                    print(f'Error running insert transaction: {e}')
+                    self._update_errors(e)
+
+            else:
+                semaphore = asyncio.Semaphore(max_concurrency)
+
+                async def bounded_load(table_name, input_gen):
+                    async with semaphore:
+                        await self.loadTable(table_name, input_gen, bulk, chunk_size)
+
+                for level in levels:
+                    # `databases` keys connections on a context variable, which new
+                    # tasks inherit. Starting each load in an empty context gives it
+                    # its own connection from the pool
+                    loads = [
+                        contextvars.Context().run(asyncio.ensure_future, bounded_load(*entry))
+                        for entry in level
+                    ]
+                    for result in await asyncio.gather(*loads, return_exceptions=True):
+                        if isinstance(result, Exception):
+                            print(f'Error loading table: {result}')
+                            self._update_errors(result)
 
-            except Exception as e:
-                print(f'Error saving {gen[0]} to DB: {e}')
-                self._update_errors(e)
-                continue
+        except Exception as e:
+            print(f'Error loading tables: {e}')
+            self._update_errors(e)
 
-        if log_task:
-            await self._finalize_task()
+        finally:
+            if log_task:
+                await self._finalize_task()
 
         return
 
@@ -113,12 +332,10 @@ class DBMediator(BaseMediator):
                         **kwargs
                         ) -> None:
 
-        stmt = insert(
-            self.table_refs[table_name]
-        ).values(**row)
+        stmt = statements.insert(self.table_refs[table_name], row.keys())
 
         try:
-            await self.database.execute(stmt)
+            await stmt.execute(self.database, **row)
         except Exception as e:
             print(f'Error saving {table_name} to DB: {e}')
             self._update_errors(e)
@@ -126,3 +343,63 @@ class DBMediator(BaseMediator):
         print(f'successfully saved {table_name} to DB')
 
         return
+
+
+def _chunked(input_gen: Iterator[any], size: int) -> Generator[List[any], None, None]:
+    ''' Yields lists of at most size items without materializing the generator '''
+    input_gen = iter(input_gen)
+    while True:
+        chunk = list(islice(input_gen, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _group_by_columns(rows: List[Dict[str, any]]) -> Dict[Tuple[str, ...], List[Dict[str, any]]]:
+    ''' Splits rows by the set of columns they hold, keeping their order '''
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    return groups
+
+
+def _copy_value(value: any) -> any:
+    # COPY sends Enum columns as their labels
+    if isinstance(value, Enum):
+        return value.name
+    return value
+
+
+def _dependency_levels(input_generators: List[Tuple[str, Generator[Dict[str, any], None, None]]],
+                       table_refs: Dict[str, 'Table']
+                       ) -> List[List[Tuple[str, Generator[Dict[str, any], None, None]]]]:
+    '''
+    Groups (table_name, generator) entries into levels using the tables'
+    foreign keys. Every table in a level only references tables in earlier
+    levels, so the entries within a level can be loaded concurrently.
+    '''
+    names = {entry[0] for entry in input_generators}
+    depends_on = {
+        name: {
+            fk.column.table.name for fk in table_refs[name].foreign_keys
+            if fk.column.table.name in names and fk.column.table.name != name
+        }
+        for name in names
+    }
+
+    levels = []
+    loaded = set()
+    remaining = list(input_generators)
+
+    while remaining:
+        ready = [entry for entry in remaining if depends_on[entry[0]] <= loaded]
+
+        # A foreign key cycle can't be ordered, so load what's left together
+        if not ready:
+            ready = remaining
+
+        levels.append(ready)
+        loaded |= {entry[0] for entry in ready}
+        remaining = [entry for entry in remaining if entry not in ready]
+
+    return levels
@@ -0,0 +1,5 @@
+from .. import users, tasks, TaskTypes
+
+from .BaseMediator import BaseMediator
+from .DBmediator import DBMediator
+from .AuthMediator import AuthMediator
@@ -0,0 +1,40 @@
+import hashlib
+
+from bisect import bisect
+from typing import List
+
+
+class HashRing:
+    '''
+    Consistent hash ring mapping keys (eg user uuids) onto a fixed set of
+    partitions. Each partition owns `replicas` points on the ring so keys
+    spread evenly, and changing the partition count only moves the keys
+    that fall between the points that were added or removed.
+
+    Hashes come from md5 rather than hash(), so every process maps a key
+    to the same partition.
+
+    Methods:
+    --------
+        get(self, key: str) -> int:
+            Returns the partition that owns the key
+    '''
+
+    def __init__(self, partitions: int, replicas: int = 64) -> None:
+        self.partitions = partitions
+
+        points = sorted(
+            (self._hash(f'{partition}:{replica}'), partition)
+            for partition in range(partitions)
+            for replica in range(replicas)
+        )
+        self._hashes: List[int] = [point for point, _ in points]
+        self._owners: List[int] = [partition for _, partition in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def get(self, key: str) -> int:
+        index = bisect(self._hashes, self._hash(str(key))) % len(self._hashes)
+        return self._owners[index]
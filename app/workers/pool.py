@@ -0,0 +1,292 @@
+import asyncio
+import itertools
+import time
+
+from collections import deque
+from typing import Callable, Awaitable, Deque, Dict, Optional, Set
+
+from . import TaskTypes
+from .partitions import HashRing
+
+# Lower numbers are served first. Interactive work sits ahead of ingest jobs
+LANE_PRIORITIES = {
+    TaskTypes.AUTHENTICATE: 0,
+    TaskTypes.NEW_USER: 0,
+    TaskTypes.DB_LOOKUP: 1,
+    TaskTypes.DB_UPDATE: 1,
+    TaskTypes.USER_NODES: 2,
+    TaskTypes.DB_INSERT: 2,
+    TaskTypes.HERMES: 3,
+}
+
+
+class Job:
+    __slots__ = ['priority', 'seq', 'func', 'task_type', 'partition', 'enqueued_at']
+
+    def __init__(self,
+                 priority: int,
+                 seq: int,
+                 func: Callable[[], Awaitable[any]],
+                 task_type: TaskTypes,
+                 partition: Optional[int] = None
+                 ) -> None:
+
+        self.priority = priority
+        self.seq = seq
+        self.func = func
+        self.task_type = task_type
+        self.partition = partition
+        self.enqueued_at = time.perf_counter()
+
+    def __lt__(self, other: 'Job') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class WorkerStats:
+    __slots__ = ['started_at', 'busy_time', 'jobs', 'errors', 'idle']
+
+    def __init__(self) -> None:
+        self.started_at = time.perf_counter()
+        self.busy_time = 0.0
+        self.jobs = 0
+        self.errors = 0
+        self.idle = True
+
+    @property
+    def utilization(self) -> float:
+        alive = time.perf_counter() - self.started_at
+        return self.busy_time / alive if alive else 0.0
+
+
+class WorkerPool:
+    '''
+    Elastic pool of async workers fed from a bounded priority queue.
+
+    The pool keeps at least `min_workers` running, spawns another worker
+    whenever a job is submitted while more jobs are waiting than there are
+    idle workers (up to
+    `max_workers`), and retires workers that sit idle for `idle_timeout`
+    seconds. Jobs are ordered by the priority lane of their TaskType and
+    then by submission order. When the queue is full, submit returns False
+    instead of waiting for room. Closing the pool turns new jobs away and
+    gives the ones already accepted `drain_timeout` seconds to finish.
+
+    Jobs submitted with a key (eg a user uuid) are hashed onto one of
+    `partitions` partitions. A partition has at most one job in the shared
+    queue or running at a time; later jobs for it wait in the partition's
+    own FIFO and are run by the worker that finishes the job ahead of
+    them. Jobs for one key therefore run strictly in submission order,
+    while different partitions run in parallel.
+
+    Attributes:
+    -----------
+        name: str
+            Prefix for worker names
+        min_workers: int
+            Number of workers that are never retired
+        max_workers: int
+            Upper bound on the number of workers
+        maxsize: int
+            Max number of jobs waiting in the queue
+        idle_timeout: float
+            Seconds a worker above min_workers waits for a job before retiring
+        drain_timeout: float
+            Seconds close waits for accepted jobs before cancelling workers
+        ring: HashRing
+            Maps job keys onto partitions
+        rejected: int
+            Number of jobs turned away because the queue was full
+
+    Methods:
+    --------
+        start(self) -> None:
+            Creates the queue and spawns the minimum number of workers
+        submit(self, func: Callable[[], Awaitable], task_type: TaskTypes, key: str) -> bool:
+            Queues a job, returning False if the pool is busy. Jobs that share
+            a key run one at a time in submission order
+        metrics(self) -> Dict[str, any]:
+            Returns queue depth, per-worker utilization and queue-wait stats
+        close(self) -> None:
+            Stops taking jobs, waits for accepted ones to finish, then
+            cancels all workers
+    '''
+
+    def __init__(self,
+                 name: str = 'Worker',
+                 min_workers: int = 1,
+                 max_workers: int = 8,
+                 maxsize: int = 10,
+                 idle_timeout: float = 30.0,
+                 partitions: int = 16,
+                 drain_timeout: float = 30.0
+                 ) -> None:
+
+        self.name = name
+        self.min_workers = min_workers
+        self.max_workers = max(min_workers, max_workers)
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.drain_timeout = drain_timeout
+        self.rejected = 0
+        self.closing = False
+        self.ring = HashRing(partitions)
+
+        self._queue = None
+        # Partitions with a job in the shared queue or running, and the
+        # jobs lined up behind it
+        self._claimed: Set[int] = set()
+        self._backlogs: Dict[int, Deque[Job]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._stats: Dict[str, WorkerStats] = {}
+        self._seq = itertools.count()
+        self._worker_ids = itertools.count()
+        self._waits: Dict[str, Dict[str, float]] = {}
+
+    @property
+    def depth(self) -> int:
+        queued = self._queue.qsize() if self._queue else 0
+        return queued + sum(len(backlog) for backlog in self._backlogs.values())
+
+    def full(self) -> bool:
+        return self._queue is not None and self.depth >= self.maxsize
+
+    def start(self) -> None:
+        self._queue = asyncio.PriorityQueue(maxsize=self.maxsize)
+
+        for _ in range(self.min_workers):
+            self._spawn()
+
+    def _spawn(self) -> None:
+        name = f'{self.name}-{next(self._worker_ids)}'
+        self._stats[name] = WorkerStats()
+        self._workers[name] = asyncio.ensure_future(self._work(name))
+
+    def submit(self,
+               func: Callable[[], Awaitable[any]],
+               task_type: TaskTypes = TaskTypes.DB_INSERT,
+               key: Optional[str] = None
+               ) -> bool:
+
+        if self.closing or self.full():
+            self.rejected += 1
+            return False
+
+        partition = self.ring.get(key) if key is not None else None
+        job = Job(LANE_PRIORITIES.get(task_type, 3), next(self._seq), func, task_type, partition)
+
+        if partition is not None and partition in self._claimed:
+            self._backlogs.setdefault(partition, deque()).append(job)
+            return True
+
+        if partition is not None:
+            self._claimed.add(partition)
+
+        self._queue.put_nowait(job)
+
+        # Scale up when more jobs are waiting than there are idle workers
+        idle = sum(stats.idle for stats in self._stats.values())
+        if self._queue.qsize() > idle and len(self._workers) < self.max_workers:
+            self._spawn()
+
+        return True
+
+    async def _work(self, name: str) -> None:
+        stats = self._stats[name]
+
+        try:
+            while True:
+                try:
+                    job = await asyncio.wait_for(self._queue.get(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    if len(self._workers) > self.min_workers:
+                        break
+                    continue
+
+                stats.idle = False
+
+                try:
+                    await self._run(name, stats, job)
+
+                    # Drain the jobs that lined up behind this one on its partition
+                    while job.partition is not None:
+                        backlog = self._backlogs.get(job.partition)
+                        if not backlog:
+                            self._backlogs.pop(job.partition, None)
+                            self._claimed.discard(job.partition)
+                            break
+
+                        await self._run(name, stats, backlog.popleft())
+
+                finally:
+                    stats.idle = True
+                    self._queue.task_done()
+        finally:
+            self._workers.pop(name, None)
+            self._stats.pop(name, None)
+
+    async def _run(self, name: str, stats: WorkerStats, job: Job) -> None:
+        t0 = time.perf_counter()
+        self._record_wait(job, t0 - job.enqueued_at)
+
+        try:
+            await job.func()
+        except Exception as e:
+            print(f'{name} failed running {job.task_type.name} job: {e}')
+            stats.errors += 1
+        finally:
+            stats.busy_time += time.perf_counter() - t0
+            stats.jobs += 1
+
+    def _record_wait(self, job: Job, waited: float) -> None:
+        lane = self._waits.setdefault(
+            job.task_type.name,
+            {'jobs': 0, 'total': 0.0, 'max': 0.0}
+        )
+        lane['jobs'] += 1
+        lane['total'] += waited
+        lane['max'] = max(lane['max'], waited)
+
+    def metrics(self) -> Dict[str, any]:
+        return {
+            'workers': len(self._workers),
+            'depth': self.depth,
+            'partitions_busy': len(self._claimed),
+            'rejected': self.rejected,
+            'utilization': {
+                name: {
+                    'utilization': stats.utilization,
+                    'jobs': stats.jobs,
+                    'errors': stats.errors,
+                    'busy': not stats.idle,
+                }
+                for name, stats in self._stats.items()
+            },
+            'queue_wait': {
+                lane: {
+                    'jobs': waits['jobs'],
+                    'avg': waits['total'] / waits['jobs'],
+                    'max': waits['max'],
+                }
+                for lane, waits in self._waits.items()
+            },
+        }
+
+    async def close(self) -> None:
+        self.closing = True
+
+        if self._queue is not None:
+            # A queue left with no workers, eg min_workers=0, would never drain
+            if self._queue.qsize() and not self._workers:
+                self._spawn()
+
+            # task_done is only called once a partition's backlog has run too
+            try:
+                await asyncio.wait_for(self._queue.join(), self.drain_timeout)
+            except asyncio.TimeoutError:
+                print(f'{self.name} pool cancelling {self.depth} jobs still queued after {self.drain_timeout}s')
+
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+
+        await asyncio.gather(*workers, return_exceptions=True)
@@ -0,0 +1,258 @@
+import asyncio
+import os
+import socket
+
+from typing import Dict, List, Optional, Set
+
+from aioredis import ReplyError
+
+from app.helpers.codec import dumps_tagged, loads_tagged
+
+from .jobs import job_handlers
+
+# Acknowledges a job and takes it off the backlog count, but only once even
+# if two consumers ended up running it
+_ACK = '''
+if redis.call('XACK', KEYS[1], ARGV[1], ARGV[2]) == 1 then
+    redis.call('DECR', KEYS[2])
+end
+'''
+
+
+class RedisJobQueue:
+    '''
+    Durable job queue backed by a Redis stream and consumer group, shared by
+    every Sanic worker process and host pointed at the same Redis.
+
+    Jobs are serializable descriptors (see jobs.make_descriptor). A job stays
+    pending in the group until its handler finishes and it is acknowledged.
+    Jobs left pending longer than `visibility_timeout`, eg because their
+    worker died, are claimed by another consumer and handed to its workers
+    like any new job. Jobs delivered more than `max_deliveries` times are
+    moved to a dead-letter stream.
+
+    A shared counter tracks jobs enqueued but not yet acknowledged. Once it
+    reaches `max_backlog` the queue reports itself full and callers turn new
+    jobs away, as they do when the in-memory pool is full.
+
+    Attributes:
+    -----------
+        stream: str
+            Redis stream holding the jobs
+        group: str
+            Consumer group shared by every worker
+        consumer: str
+            Name of this process within the group
+        consumers: int
+            Number of jobs this process runs concurrently
+        visibility_timeout: float
+            Seconds a job may stay unacknowledged before it is reclaimed
+        max_deliveries: int
+            Deliveries after which a job is dead-lettered
+        max_backlog: int
+            Unacknowledged jobs, across every process, past which the queue is full
+        rejected: int
+            Jobs this process turned away because the queue was full
+
+    Methods:
+    --------
+        start(self, app) -> None:
+            Creates the consumer group and starts consuming
+        full(self) -> bool:
+            True when the shared backlog has reached max_backlog
+        enqueue(self, descriptor: Dict[str, any]) -> str:
+            Appends a job to the stream and returns its message id
+        close(self) -> None:
+            Stops consuming. Unacknowledged jobs are left for other consumers
+    '''
+
+    def __init__(self,
+                 stream: str = 'hermes:jobs',
+                 group: str = 'hermes-workers',
+                 consumers: int = 2,
+                 visibility_timeout: float = 60.0,
+                 max_deliveries: int = 5,
+                 max_backlog: int = 1000,
+                 max_len: int = 100000,
+                 block: float = 1.0
+                 ) -> None:
+
+        self.stream = stream
+        self.dead_letters = f'{stream}:dead'
+        self.backlog_key = f'{stream}:backlog'
+        self.group = group
+        self.consumer = f'{socket.gethostname()}-{os.getpid()}'
+        self.consumers = consumers
+        self.visibility_timeout = visibility_timeout
+        self.max_deliveries = max_deliveries
+        self.max_backlog = max_backlog
+        self.max_len = max_len
+        self.block = block
+        self.rejected = 0
+
+        self.app = None
+        self.redis = None
+        self._tasks: List[asyncio.Task] = []
+        # Ids of abandoned jobs waiting for a consumer to claim them
+        self._reclaimed: Optional[asyncio.Queue] = None
+        self._reclaiming: Set[bytes] = set()
+
+    @property
+    def _visibility_ms(self) -> int:
+        return int(self.visibility_timeout * 1000)
+
+    async def start(self, app) -> None:
+        self.app = app
+        self.redis = app.redis
+
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, latest_id='0', mkstream=True)
+        except ReplyError as e:
+            # Another worker already created the group
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+        self._reclaimed = asyncio.Queue(maxsize=self.consumers)
+        self._tasks = [
+            asyncio.ensure_future(self._consume())
+            for _ in range(self.consumers)
+        ]
+        self._tasks.append(asyncio.ensure_future(self._reclaim()))
+
+    async def full(self) -> bool:
+        backlog = await self.redis.get(self.backlog_key)
+        return int(backlog or 0) >= self.max_backlog
+
+    async def enqueue(self, descriptor: Dict[str, any]) -> str:
+        transaction = self.redis.multi_exec()
+        message_id = transaction.xadd(
+            self.stream,
+            {'job': dumps_tagged(descriptor)},
+            max_len=self.max_len,
+            exact_len=False
+        )
+        transaction.incr(self.backlog_key)
+        await transaction.execute()
+
+        return await message_id
+
+    async def _ack(self, message_id: bytes) -> None:
+        await self.redis.eval(
+            _ACK,
+            keys=[self.stream, self.backlog_key],
+            args=[self.group, message_id]
+        )
+
+    async def _consume(self) -> None:
+        while True:
+            try:
+                if not self._reclaimed.empty():
+                    messages = await self._claim(self._reclaimed.get_nowait())
+                else:
+                    messages = [
+                        (message_id, fields)
+                        for _, message_id, fields in await self.redis.xread_group(
+                            self.group,
+                            self.consumer,
+                            [self.stream],
+                            timeout=int(self.block * 1000),
+                            count=1,
+                            latest_ids=['>']
+                        )
+                    ]
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f'error reading from {self.stream}: {e}')
+                await asyncio.sleep(self.block)
+                continue
+
+            for message_id, fields in messages:
+                await self._run(message_id, fields)
+
+    async def _claim(self, message_id: bytes) -> List[any]:
+        '''
+        Takes over an abandoned job right before running it. Returns nothing
+        if another consumer got to it first
+        '''
+        self._reclaiming.discard(message_id)
+        return await self.redis.xclaim(
+            self.stream, self.group, self.consumer,
+            self._visibility_ms, message_id
+        )
+
+    async def _run(self, message_id: bytes, fields: Dict[bytes, bytes]) -> None:
+        heartbeat = asyncio.ensure_future(self._heartbeat(message_id))
+
+        try:
+            descriptor = loads_tagged(fields[b'job'])
+            handler = job_handlers[descriptor['job']]
+            await handler(self.app, descriptor)
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception as e:
+            # Leave the job pending so it is retried after the visibility timeout
+            print(f'job {message_id} failed: {e}')
+            return
+
+        finally:
+            heartbeat.cancel()
+
+        await self._ack(message_id)
+
+    async def _heartbeat(self, message_id: bytes) -> None:
+        '''
+        Re-claims a running job for this consumer, which resets its idle time,
+        so long jobs aren't mistaken for abandoned ones. JUSTID keeps the
+        claim from counting as another delivery
+        '''
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 2)
+            await self.redis.execute(
+                b'XCLAIM', self.stream, self.group, self.consumer, 0, message_id, b'JUSTID'
+            )
+
+    async def _reclaim(self) -> None:
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 2)
+
+            try:
+                pending = await self.redis.xpending(
+                    self.stream, self.group, '-', '+', 100
+                )
+            except Exception as e:
+                print(f'error reading pending jobs on {self.stream}: {e}')
+                continue
+
+            for message_id, _, idle, deliveries in pending:
+                if idle < self._visibility_ms or message_id in self._reclaiming:
+                    continue
+
+                if deliveries >= self.max_deliveries:
+                    await self._dead_letter(message_id)
+                    continue
+
+                # Consumers claim the job when they're free to run it, so it
+                # can't go idle again while it waits here
+                if self._reclaimed.full():
+                    break
+
+                self._reclaiming.add(message_id)
+                self._reclaimed.put_nowait(message_id)
+
+    async def _dead_letter(self, message_id: bytes) -> None:
+        messages = await self.redis.xrange(self.stream, message_id, message_id)
+        for _, fields in messages:
+            await self.redis.xadd(self.dead_letters, fields)
+
+        await self._ack(message_id)
+        print(f'moved job {message_id} to {self.dead_letters}')
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
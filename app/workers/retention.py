@@ -0,0 +1,246 @@
+import asyncio
+import contextvars
+import re
+
+from datetime import date
+from typing import Dict, List
+
+from . import tasks, task_rollups
+
+_PARTITION_NAME = re.compile(r'^tasks_(\d{4})_(\d{2})$')
+
+# Sums a set of tasks rows into task_rollups, adding to any day already
+# rolled up. {source} is the partition, or a CTE of deleted rows
+_ROLLUP = '''
+INSERT INTO {rollups} (day, task_type, total, succeeded, failed, total_seconds)
+SELECT time_start::date,
+       task_type,
+       count(*),
+       count(*) FILTER (WHERE success),
+       count(*) FILTER (WHERE time_finished IS NOT NULL AND NOT success),
+       COALESCE(sum(EXTRACT(EPOCH FROM time_finished - time_start)), 0)
+FROM {source}
+WHERE task_type IS NOT NULL
+GROUP BY 1, 2
+ON CONFLICT (day, task_type) DO UPDATE SET
+    total = {rollups}.total + excluded.total,
+    succeeded = {rollups}.succeeded + excluded.succeeded,
+    failed = {rollups}.failed + excluded.failed,
+    total_seconds = {rollups}.total_seconds + excluded.total_seconds
+'''
+
+
+def add_months(day: date, months: int) -> date:
+    ''' First day of the month `months` after day's month '''
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f'{tasks.name}_{month.year:04d}_{month.month:02d}'
+
+
+class TaskRetention:
+    '''
+    Keeps the monthly partitions of tasks in shape: creates the partitions
+    for the coming months ahead of time, and retires partitions older than
+    `retention_months` after summing them into task_rollups.
+
+    Retiring a partition rolls it up, detaches it and drops it in one
+    transaction, so its rows are either summarized and gone or untouched.
+    Rows in the default partition that are past retention are rolled up
+    and deleted the same way. A Postgres advisory lock lets only one worker
+    process do this at a time.
+
+    Attributes:
+    -----------
+        database: Postgres
+            Ref to a Postgres connection, set by init_app
+        retention_months: int
+            Whole months of raw tasks kept, on top of the current one
+        months_ahead: int
+            Monthly partitions kept created past the current month
+        interval: float
+            Seconds between runs
+
+    Methods:
+    --------
+        init_app(self, app) -> None:
+            Binds Postgres and starts running periodically
+        run(self, today: date) -> Dict[str, List[str]]:
+            Creates upcoming partitions and retires expired ones, returning
+            the partitions created and dropped
+        close(self) -> None:
+            Stops the periodic runs
+    '''
+
+    # Arbitrary key for pg_try_advisory_lock, shared by every process
+    lock_key = 7310412
+
+    def __init__(self,
+                 retention_months: int = 12,
+                 months_ahead: int = 2,
+                 interval: float = 3600.0
+                 ) -> None:
+
+        self.database = None
+        self.retention_months = retention_months
+        self.months_ahead = months_ahead
+        self.interval = interval
+        self._runner = None
+
+    @property
+    def running(self) -> bool:
+        return self._runner is not None and not self._runner.done()
+
+    def init_app(self, app) -> None:
+        self.database = app.database
+        self.retention_months = app.config.TASK_RETENTION_MONTHS
+        self.months_ahead = app.config.TASK_PARTITIONS_AHEAD
+        self.interval = app.config.TASK_RETENTION_INTERVAL
+        # Run in an empty context so the runner gets its own pool connection
+        # rather than sharing whichever one the caller's context holds
+        self._runner = contextvars.Context().run(asyncio.ensure_future, self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                report = await self.run()
+                if report['created'] or report['dropped']:
+                    print(f'tasks partitions created: {report["created"]} dropped: {report["dropped"]}')
+            except Exception as e:
+                print(f'error maintaining tasks partitions: {e}')
+
+            await asyncio.sleep(self.interval)
+
+    async def run(self, today: date = None) -> Dict[str, List[str]]:
+        today = today or date.today()
+        report = {'created': [], 'dropped': []}
+
+        # The lock is held by the connection, so everything runs on one
+        async with self.database.connection():
+            locked = await self.database.fetch_val(
+                'SELECT pg_try_advisory_lock(:key)', {'key': self.lock_key}
+            )
+            if not locked:
+                return report
+
+            try:
+                report['created'] = await self._create_partitions(today)
+                report['dropped'] = await self._retire_partitions(today)
+            finally:
+                await self.database.execute(
+                    'SELECT pg_advisory_unlock(:key)', {'key': self.lock_key}
+                )
+
+        return report
+
+    async def _partitions(self) -> List[str]:
+        rows = await self.database.fetch_all(
+            '''
+            SELECT c.relname AS name FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = CAST(:parent AS regclass)
+            ''',
+            {'parent': tasks.name}
+        )
+        return [row['name'] for row in rows]
+
+    async def _create_partitions(self, today: date) -> List[str]:
+        existing = set(await self._partitions())
+        created = []
+
+        this_month = today.replace(day=1)
+        for offset in range(self.months_ahead + 1):
+            month = add_months(this_month, offset)
+            name = partition_name(month)
+            if name in existing:
+                continue
+
+            await self._create_partition(month)
+            created.append(name)
+
+        return created
+
+    async def _create_partition(self, month: date) -> None:
+        name = partition_name(month)
+        start, end = month.isoformat(), add_months(month, 1).isoformat()
+        default = f'{tasks.name}_default'
+
+        async with self.database.transaction():
+            # Postgres refuses a new partition while the default partition
+            # holds rows in its range, so those rows are moved into it
+            stray = await self.database.fetch_val(
+                f'''
+                SELECT EXISTS (SELECT 1 FROM {default}
+                WHERE time_start >= '{start}' AND time_start < '{end}')
+                '''
+            )
+
+            if stray:
+                await self.database.execute(f'ALTER TABLE {tasks.name} DETACH PARTITION {default}')
+
+            await self.database.execute(
+                f"CREATE TABLE {name} PARTITION OF {tasks.name} "
+                f"FOR VALUES FROM ('{start}') TO ('{end}')"
+            )
+
+            if stray:
+                await self.database.execute(f'''
+                WITH moved AS (
+                    DELETE FROM {default}
+                    WHERE time_start >= '{start}' AND time_start < '{end}'
+                    RETURNING *
+                )
+                INSERT INTO {name} SELECT * FROM moved
+                ''')
+                await self.database.execute(f'ALTER TABLE {tasks.name} ATTACH PARTITION {default} DEFAULT')
+
+    async def _retire_partitions(self, today: date) -> List[str]:
+        cutoff = add_months(today.replace(day=1), -self.retention_months)
+        dropped = []
+
+        for name in sorted(await self._partitions()):
+            match = _PARTITION_NAME.match(name)
+            if not match:
+                continue
+
+            month = date(int(match.group(1)), int(match.group(2)), 1)
+            if add_months(month, 1) > cutoff:
+                continue
+
+            async with self.database.transaction():
+                await self.database.execute(_ROLLUP.format(rollups=task_rollups.name, source=name))
+                await self.database.execute(f'ALTER TABLE {tasks.name} DETACH PARTITION {name}')
+                await self.database.execute(f'DROP TABLE {name}')
+
+            dropped.append(name)
+
+        # Old rows that landed in the default partition
+        default = f'{tasks.name}_default'
+        await self.database.execute(
+            f'''
+            WITH expired AS (
+                DELETE FROM {default} WHERE time_start < '{cutoff.isoformat()}'
+                RETURNING *
+            )
+            {_ROLLUP.format(rollups=task_rollups.name, source='expired')}
+            '''
+        )
+
+        return dropped
+
+    async def close(self) -> None:
+        if self._runner is None:
+            return
+
+        self._runner.cancel()
+        try:
+            await self._runner
+        except asyncio.CancelledError:
+            pass
+
+        self._runner = None
+
+
+retention = TaskRetention()
@@ -0,0 +1,115 @@
+import asyncio
+
+from typing import Dict, Optional, Set
+
+
+class TaskNotifier:
+    '''
+    Broadcasts task completion so that waiters can await a future instead
+    of polling Postgres. Completions are resolved locally right away and
+    published on a Redis channel so waiters in other worker processes
+    resolve too.
+
+    Attributes:
+    -----------
+        redis: Redis
+            Ref to the app's aioredis pool, set by init_app
+        channel: str
+            Redis pub/sub channel completions are published on
+
+    Methods:
+    --------
+        init_app(self, app) -> None:
+            Binds the notifier to the app's Redis pool and starts listening
+        subscribe(self, task_id: str) -> Future:
+            Returns a future that resolves to the task's success state
+        discard(self, task_id: str, waiter: Future) -> None:
+            Drops a waiter that is no longer interested
+        publish(self, task_id: str, success: bool) -> None:
+            Resolves local waiters and broadcasts the completion
+        close(self) -> None:
+            Stops listening and cancels outstanding waiters
+    '''
+
+    channel = 'hermes:tasks:finished'
+
+    def __init__(self) -> None:
+        self.redis = None
+        self._waiters: Dict[str, Set[asyncio.Future]] = {}
+        self._listener = None
+
+    @property
+    def running(self) -> bool:
+        return self._listener is not None and not self._listener.done()
+
+    def init_app(self, app) -> None:
+        self.redis = app.redis
+        self._listener = asyncio.ensure_future(self._listen())
+
+    def subscribe(self, task_id: str) -> asyncio.Future:
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.setdefault(str(task_id), set()).add(waiter)
+        return waiter
+
+    def discard(self, task_id: str, waiter: asyncio.Future) -> None:
+        waiters = self._waiters.get(str(task_id))
+        if not waiters:
+            return
+
+        waiters.discard(waiter)
+        if not waiters:
+            del self._waiters[str(task_id)]
+
+    def _resolve(self, task_id: str, success: bool) -> None:
+        for waiter in self._waiters.pop(str(task_id), ()):
+            if not waiter.done():
+                waiter.set_result(success)
+
+    async def publish(self, task_id: str, success: bool) -> None:
+        self._resolve(task_id, success)
+
+        if self.redis is None:
+            return
+
+        try:
+            await self.redis.publish_json(
+                self.channel,
+                {'id': str(task_id), 'success': success}
+            )
+        except Exception as e:
+            print(f'error publishing completion of task {task_id}: {e}')
+
+    async def _listen(self) -> None:
+        channel, = await self.redis.subscribe(self.channel)
+
+        while await channel.wait_message():
+            try:
+                message = await channel.get_json()
+                self._resolve(message['id'], message['success'])
+            except Exception as e:
+                print(f'bad task completion message: {e}')
+
+    async def close(self) -> None:
+        if self._listener is None:
+            return
+
+        self._listener.cancel()
+        try:
+            await self._listener
+        except asyncio.CancelledError:
+            pass
+
+        self._listener = None
+
+        try:
+            await self.redis.unsubscribe(self.channel)
+        except Exception as e:
+            print(f'error unsubscribing from {self.channel}: {e}')
+
+        for waiters in self._waiters.values():
+            for waiter in waiters:
+                waiter.cancel()
+        self._waiters = {}
+
+
+task_notifier = TaskNotifier()
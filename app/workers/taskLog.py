@@ -0,0 +1,243 @@
+import asyncio
+
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.dialects import postgresql
+
+from . import tasks
+
+
+class TaskLogWriter:
+    '''
+    Write-behind sink for task lifecycle events. Mediators hand their task
+    rows and task updates to the writer instead of executing them, and the
+    writer flushes them to Postgres as multi-row statements whenever the
+    buffer reaches `batch_size` or every `flush_interval` seconds.
+
+    Attributes:
+    -----------
+        database: Postgres
+            Ref to a Postgres connection, set by init_app
+        batch_size: int
+            Number of buffered events that triggers an early flush
+        flush_interval: float
+            Max number of seconds an event sits in the buffer
+        flushed: int
+            Count of events written to Postgres
+        failed: int
+            Count of events that could not be written
+
+    Methods:
+    --------
+        init_app(self, app) -> None:
+            Binds the writer to the app's database and starts the flusher
+        insert(self, row: Dict[str, any]) -> None:
+            Buffers a new task row
+        update(self, task_id: str, values: Dict[str, any]) -> None:
+            Buffers an update to a task row, merging it into the pending
+            insert when the row hasn't been written yet
+        peek(self, task_id: str) -> Optional[Dict[str, any]]:
+            Returns the buffered or in-flight, not yet committed state of a
+            task
+        flush(self) -> None:
+            Writes everything in the buffer to Postgres
+        close(self) -> None:
+            Stops the flusher and drains the buffer
+    '''
+
+    def __init__(self,
+                 batch_size: int = 500,
+                 flush_interval: float = 0.5
+                 ) -> None:
+
+        self.database = None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flushed = 0
+        self.failed = 0
+
+        self._inserts = OrderedDict()
+        self._updates = OrderedDict()
+        # Rows and updates taken by the flush that is writing them now
+        self._in_flight = {}
+        self._flusher = None
+        self._wakeup = None
+        self._lock = None
+
+    @property
+    def running(self) -> bool:
+        return self._flusher is not None and not self._flusher.done()
+
+    @property
+    def pending(self) -> int:
+        return len(self._inserts) + len(self._updates)
+
+    def init_app(self, app) -> None:
+        self.database = app.database
+        self.batch_size = app.config.TASK_LOG_BATCH_SIZE
+        self.flush_interval = app.config.TASK_LOG_FLUSH_INTERVAL
+
+        # asyncio primitives bind to the running loop, so they are created
+        # here rather than at import time
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._flusher = asyncio.ensure_future(self._run())
+
+    def insert(self, row: Dict[str, any]) -> None:
+        self._inserts[str(row['id'])] = dict(row)
+        self._maybe_flush()
+
+    def update(self, task_id: str, values: Dict[str, any]) -> None:
+        task_id = str(task_id)
+
+        # The row hasn't left the buffer yet, so fold the update into it
+        # and save Postgres a statement
+        if task_id in self._inserts:
+            self._inserts[task_id].update(values)
+            return
+
+        self._updates.setdefault(task_id, {}).update(values)
+        self._maybe_flush()
+
+    def peek(self, task_id: str) -> Optional[Dict[str, any]]:
+        task_id = str(task_id)
+        if task_id in self._inserts:
+            return self._inserts[task_id]
+
+        # While a flush is writing, its batch is in neither the buffer nor
+        # Postgres, so it's read here with any newer update laid on top
+        in_flight = self._in_flight.get(task_id)
+        update = self._updates.get(task_id)
+        if in_flight is None:
+            return update
+
+        return {**in_flight, **(update or {})}
+
+    def _maybe_flush(self) -> None:
+        if self.pending >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            inserts = list(self._inserts.values())
+            updates = list(self._updates.items())
+            self._inserts = OrderedDict()
+            self._updates = OrderedDict()
+
+            self._in_flight = {str(row['id']): row for row in inserts}
+            self._in_flight.update(updates)
+
+            try:
+                # Inserts go first so updates for rows flushed in an earlier
+                # batch never race the row they target
+                for chunk in chunks(inserts, self.batch_size):
+                    await self._write(self._insert_many, chunk)
+
+                grouped = OrderedDict()
+                for task_id, values in updates:
+                    grouped.setdefault(tuple(sorted(values)), []).append((task_id, values))
+
+                for group in grouped.values():
+                    for chunk in chunks(group, self.batch_size):
+                        await self._write(self._update_many, chunk)
+            finally:
+                self._in_flight = {}
+
+    async def _write(self, writer, chunk: List[any]) -> None:
+        try:
+            await writer(chunk)
+            self.flushed += len(chunk)
+            return
+        except Exception as e:
+            print(f'error flushing {len(chunk)} task events: {e}')
+
+        # Retry row by row so one bad event doesn't drop the whole batch
+        for item in chunk:
+            try:
+                await writer([item])
+                self.flushed += 1
+            except Exception as e:
+                print(f'dropping task event {item}: {e}')
+                self.failed += 1
+
+    async def _insert_many(self, rows: List[Dict[str, any]]) -> None:
+        await self.database.execute(tasks.insert().values(rows))
+
+    async def _update_many(self, chunk: List[Tuple[str, Dict[str, any]]]) -> None:
+        columns = sorted(chunk[0][1])
+        query, values = bulk_update_query(tasks, columns, chunk)
+        await self.database.execute(query=query, values=values)
+
+    async def close(self) -> None:
+        if self._flusher is None:
+            return
+
+        self._flusher.cancel()
+        try:
+            await self._flusher
+        except asyncio.CancelledError:
+            pass
+
+        self._flusher = None
+        await self.flush()
+
+
+def chunks(items: List[any], size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def bulk_update_query(table: 'Table',
+                      columns: List[str],
+                      chunk: List[Tuple[str, Dict[str, any]]],
+                      returning: List[str] = ()
+                      ) -> Tuple[str, Dict[str, any]]:
+    '''
+    Builds an UPDATE ... FROM (VALUES ...) statement that applies every
+    update in the chunk with a single round-trip. Each value is cast to its
+    column type since Postgres can't infer types inside a VALUES list.
+    Columns in `returning` are returned for every updated row.
+    '''
+    dialect = postgresql.dialect()
+    names = ['id'] + columns
+    casts = [table.c[name].type.compile(dialect=dialect) for name in names]
+
+    rows = []
+    values = {}
+    for i, (row_id, update) in enumerate(chunk):
+        params = []
+        for j, name in enumerate(names):
+            key = f'{name}_{i}'
+            value = row_id if name == 'id' else update[name]
+            values[key] = getattr(value, 'name', value)
+            params.append(f'CAST(:{key} AS {casts[j]})')
+        rows.append('({})'.format(', '.join(params)))
+
+    query = '''
+    UPDATE {table} SET {assignments}
+    FROM (VALUES {rows}) AS v({names})
+    WHERE {table}.id = v.id
+    '''.format(
+        table=table.name,
+        assignments=', '.join(f'{name} = v.{name}' for name in columns),
+        rows=', '.join(rows),
+        names=', '.join(names),
+    )
+    if returning:
+        query += 'RETURNING {}\n'.format(', '.join(f'{table.name}.{name}' for name in returning))
+
+    return query, values
+
+
+task_log = TaskLogWriter()
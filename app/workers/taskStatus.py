@@ -0,0 +1,210 @@
+import time
+
+from typing import Dict, Optional
+
+from app.db.statements import select_task_summary
+
+from .taskLog import task_log
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+UNKNOWN = 'unknown'
+
+
+class TaskStatusBoard:
+    '''
+    Live task state kept in Redis so clients can poll progress without
+    touching Postgres.
+
+    Each task is a hash holding its owner, type, lifecycle state (queued,
+    running, then finished or failed), rows written in total and per table,
+    the number of errors so far, and the error string once it's done.
+    Hashes expire `ttl` seconds after their last update. Readers that miss
+    Redis and go to Postgres backfill the board with what they find, and
+    unknown ids are remembered for `miss_ttl` seconds, so repeated polls for
+    the same task don't reach the database again.
+
+    Attributes:
+    -----------
+        redis: Redis
+            Ref to the app's aioredis pool, set by init_app
+        ttl: int
+            Seconds a task's hash outlives its last update
+        miss_ttl: int
+            Seconds an unknown task id is remembered as unknown
+
+    Methods:
+    --------
+        init_app(self, app) -> None:
+            Binds the board to the app's Redis pool
+        set_state(self, task_id: str, state: str, **fields) -> None:
+            Records a lifecycle transition along with any extra fields
+        add_rows(self, task_id: str, table_name: str, rows: int, errors: int) -> None:
+            Adds to the task's written row counts and sets its error count
+        finish(self, task_id: str, success: bool, error: str, owner: str, task_type: str) -> None:
+            Marks the task finished or failed, recording its owner and type
+            for tasks that were never published as queued
+        get(self, task_id: str) -> Optional[Dict[str, any]]:
+            Returns the task's state, or None if the board doesn't know it
+        fetch(self, database: Postgres, task_id: str) -> Optional[Dict[str, any]]:
+            Reads the board, falling back to the task log buffer and then
+            Postgres, and backfills the board with what it finds. A hash
+            without an owner counts as a miss
+    '''
+
+    prefix = 'hermes:task'
+
+    def __init__(self, ttl: int = 86400, miss_ttl: int = 5) -> None:
+        self.redis = None
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+
+    @property
+    def running(self) -> bool:
+        return self.redis is not None
+
+    def init_app(self, app) -> None:
+        self.redis = app.redis
+        self.ttl = app.config.TASK_STATUS_TTL
+        self.miss_ttl = app.config.TASK_STATUS_MISS_TTL
+
+    def _key(self, task_id: str) -> str:
+        return f'{self.prefix}:{task_id}'
+
+    async def set_state(self, task_id: str, state: str, **fields) -> None:
+        key = self._key(task_id)
+        fields = {name: value for name, value in fields.items() if value is not None}
+
+        pipe = self.redis.pipeline()
+        pipe.hmset_dict(key, {**fields, 'state': state, 'updated': time.time()})
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    async def add_rows(self, task_id: str, table_name: str, rows: int, errors: int = 0) -> None:
+        key = self._key(task_id)
+
+        pipe = self.redis.pipeline()
+        pipe.hincrby(key, 'rows', rows)
+        pipe.hincrby(key, f'rows:{table_name}', rows)
+        pipe.hmset_dict(key, {'errors': errors, 'updated': time.time()})
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    async def finish(self,
+                     task_id: str,
+                     success: bool,
+                     error: str = '',
+                     owner: Optional[str] = None,
+                     task_type: Optional[str] = None
+                     ) -> None:
+
+        await self.set_state(
+            task_id,
+            FINISHED if success else FAILED,
+            owner=owner,
+            task_type=task_type,
+            success=int(success),
+            error=error
+        )
+
+    async def get(self, task_id: str) -> Optional[Dict[str, any]]:
+        raw = await self.redis.hgetall(self._key(task_id), encoding='utf-8')
+        if not raw:
+            return None
+
+        return _decode(str(task_id), raw)
+
+    async def fetch(self, database: 'Postgres', task_id: str) -> Optional[Dict[str, any]]:
+        task_id = str(task_id)
+        missing_key = self._key(task_id) + ':missing'
+
+        cached = None
+        try:
+            cached = await self.get(task_id)
+            # Without an owner the caller can't be checked against the task,
+            # so the owner comes from the task log or Postgres below
+            if cached is not None and cached['owner'] is not None:
+                return cached
+            if cached is None and await self.redis.exists(missing_key):
+                return None
+        except Exception as e:
+            print(f'error reading status of task {task_id}: {e}')
+
+        # A task whose row is still buffered hasn't reached Postgres yet.
+        # A buffered update without its insert means the row already has
+        row = task_log.peek(task_id)
+        if not row or 'owner' not in row:
+            row = await select_task_summary.fetch_one(database, task_id=task_id)
+
+        status = _from_row(task_id, row) if row else None
+
+        try:
+            if cached is not None:
+                if status is None:
+                    return None
+
+                # The board's progress and state are newer than the row's,
+                # so only the owner and type are written back
+                owner = {'owner': status['owner'], 'task_type': status['task_type']}
+                status = {**cached, **owner}
+                await self.redis.hmset_dict(self._key(task_id), owner)
+            elif status is None:
+                await self.redis.set(missing_key, 1, expire=self.miss_ttl)
+            elif status['state'] in (FINISHED, FAILED):
+                # Unfinished tasks aren't backfilled, since that could race
+                # with the mediator's own updates and overwrite a newer state
+                await self.set_state(
+                    task_id,
+                    status['state'],
+                    owner=status['owner'],
+                    task_type=status['task_type'],
+                    success=int(status['success']),
+                    error=status['error']
+                )
+        except Exception as e:
+            print(f'error backfilling status of task {task_id}: {e}')
+
+        return status
+
+
+def _from_row(task_id: str, row: Dict[str, any]) -> Dict[str, any]:
+    finished = row['time_finished'] is not None
+    task_type = row['task_type']
+
+    return {
+        'id': task_id,
+        'state': (FINISHED if row['success'] else FAILED) if finished else RUNNING,
+        'owner': str(row['owner']),
+        'task_type': getattr(task_type, 'name', task_type),
+        'rows': 0,
+        'tables': {},
+        'errors': 0,
+        'updated': None,
+        'success': bool(row['success']) if finished else None,
+        'error': row['error'] or None,
+    }
+
+
+def _decode(task_id: str, raw: Dict[str, str]) -> Dict[str, any]:
+    status = {
+        'id': task_id,
+        'state': raw.get('state', UNKNOWN),
+        'owner': raw.get('owner'),
+        'task_type': raw.get('task_type'),
+        'rows': int(raw.get('rows', 0)),
+        'tables': {
+            name[len('rows:'):]: int(value)
+            for name, value in raw.items() if name.startswith('rows:')
+        },
+        'errors': int(raw.get('errors', 0)),
+        'updated': float(raw['updated']) if 'updated' in raw else None,
+        'success': bool(int(raw['success'])) if 'success' in raw else None,
+        'error': raw.get('error'),
+    }
+
+    return status
+
+
+task_status = TaskStatusBoard()
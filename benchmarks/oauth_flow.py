@@ -0,0 +1,65 @@
+'''
+Per-request latency of get_flow: building a Flow by re-reading and parsing
+the client secrets file every time, versus building it from the config
+cached by the flow factory. Uses a throwaway secrets file and makes no
+network calls.
+
+Usage:
+------
+    python -m benchmarks.oauth_flow [iterations]
+'''
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+from google_auth_oauthlib.flow import Flow
+
+from app.helpers.utility import get_flow
+
+CLIENT_SECRETS = {
+    'web': {
+        'client_id': 'bench.apps.googleusercontent.com',
+        'client_secret': 'bench-secret',
+        'auth_uri': 'https://accounts.google.com/o/oauth2/auth',
+        'token_uri': 'https://oauth2.googleapis.com/token',
+        'redirect_uris': ['http://localhost:5000/oauth2callback'],
+    }
+}
+REDIRECT_URI = 'http://localhost:5000/oauth2callback'
+VERIFIER = 'v' * 40
+
+
+def main(iterations: int) -> None:
+    os.environ.setdefault('SCOPES', 'https://www.googleapis.com/auth/gmail.readonly')
+
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as secrets:
+        json.dump(CLIENT_SECRETS, secrets)
+
+    def from_file():
+        flow = Flow.from_client_secrets_file(
+            secrets.name,
+            scopes=os.environ.get('SCOPES').split(','),
+            state=None,
+        )
+        flow.redirect_uri = REDIRECT_URI
+        flow.code_verifier = VERIFIER
+
+    def cached():
+        get_flow(REDIRECT_URI, secrets.name, VERIFIER)
+
+    try:
+        # Warm the cache so the one-off read isn't counted per call
+        cached()
+        before = timeit.timeit(from_file, number=iterations) / iterations * 1e6
+        after = timeit.timeit(cached, number=iterations) / iterations * 1e6
+    finally:
+        os.unlink(secrets.name)
+
+    print(f'{"get_flow":<20}{"from file (us)":>16}{"cached (us)":>13}{"speedup":>10}')
+    print(f'{"":<20}{before:>16.1f}{after:>13.1f}{before / after:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,98 @@
+'''
+Where offloading to the CPU pool starts to pay off. For request bodies of
+growing size, and for a JWT, it compares running the call inline with a
+round-trip through a one-process pool.
+
+A pool call is never faster end to end, since the result has to be pickled
+back. What offloading buys is that the worker process stays free to serve
+other requests meanwhile. So the pool is compared on the CPU time it still
+costs the calling process, pickling the arguments and unpickling the
+result, against the time the call holds the event loop inline. The
+smallest body at which the pool costs less is the crossover
+CPU_OFFLOAD_THRESHOLD is set from.
+
+Usage:
+------
+    python -m benchmarks.offload [iterations]
+'''
+import json
+import statistics
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional, Tuple
+
+import jwt
+
+SIZES = [1024, 4096, 16384, 65536, 262144, 1048576, 4194304]
+SECRET = 'bench-secret-' + 'x' * 32
+
+
+def body_of_size(size: int) -> bytes:
+    ''' A JSON body of roughly size bytes, shaped like an ingest request '''
+    row = {'email': 'someone@example.com', 'subject': 'x' * 40, 'count': 12345}
+    per_row = len(json.dumps(row)) + 2
+    return json.dumps({'rows': [row] * max(1, size // per_row)}).encode('utf-8')
+
+
+def median_time(call: Callable[[], any], iterations: int, clock: Callable[[], float]) -> float:
+    samples = []
+    for _ in range(iterations):
+        t0 = clock()
+        call()
+        samples.append(clock() - t0)
+    return statistics.median(samples)
+
+
+def compare(pool: ProcessPoolExecutor,
+            func: Callable,
+            args: Tuple,
+            iterations: int
+            ) -> Tuple[float, float, float]:
+    '''
+    Median seconds inline, end to end through the pool, and of this
+    process's CPU time per pool call
+    '''
+    def offload():
+        pool.submit(func, *args).result()
+
+    inline = median_time(lambda: func(*args), iterations, time.perf_counter)
+    latency = median_time(offload, iterations, time.perf_counter)
+    cost = median_time(offload, iterations, time.process_time)
+    return inline, latency, cost
+
+
+def main(iterations: int) -> None:
+    token = jwt.encode({'email': 'someone@example.com', 'exp': time.time() + 3600}, SECRET)
+    if isinstance(token, bytes):
+        token = token.decode('utf-8')
+
+    crossover: Optional[int] = None
+
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        # Start the worker process before timing anything
+        pool.submit(len, b'').result()
+
+        print(f'{"call":<20}{"bytes":>10}{"inline (us)":>14}{"pool latency (us)":>20}{"pool cost (us)":>17}')
+        row = '{:<20}{:>10}{:>14.1f}{:>20.1f}{:>17.1f}'
+
+        for size in SIZES:
+            body = body_of_size(size)
+            inline, latency, cost = compare(pool, json.loads, (body,), iterations)
+            print(row.format('json.loads', len(body), inline * 1e6, latency * 1e6, cost * 1e6))
+
+            if crossover is None and cost < inline:
+                crossover = len(body)
+
+        inline, latency, cost = compare(pool, jwt.decode, (token, SECRET, ['HS256']), iterations)
+        print(row.format('jwt.decode (HS256)', len(token), inline * 1e6, latency * 1e6, cost * 1e6))
+
+    if crossover is None:
+        print('\nthe pool never cost this process less than running inline')
+    else:
+        print(f'\nthe pool costs this process less from about {crossover} bytes')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
@@ -0,0 +1,77 @@
+'''
+Per-call overhead of building mediator statements on every call versus
+binding parameters against the compiled statement registry. Neither side
+touches Postgres; this measures only the Python work done before a query
+is sent.
+
+Usage:
+------
+    python -m benchmarks.statements [iterations]
+'''
+import sys
+import timeit
+import uuid
+
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert
+
+from app.db import tasks, users
+from app.db.statements import statements, finalize_task, update_credentials
+
+# The dialect `databases` compiles with on every call
+dialect = postgresql.dialect(paramstyle='pyformat')
+
+task_id = str(uuid.uuid4())
+creds = {'token': 'token', 'refresh_token': 'refresh', 'token_uri': 'uri',
+         'client_id': 'id', 'client_secret': 'secret', 'scopes': ['a', 'b']}
+row = {'id': task_id, 'owner': task_id, 'task_type': 'DB_INSERT',
+       'time_start': datetime.now(), 'success': False}
+
+
+def rebuild_finalize():
+    stmt = tasks.update().where(tasks.c.id == task_id).values(
+        time_finished=datetime.now(), error='', success=True)
+    stmt.compile(dialect=dialect)
+
+
+def registry_finalize():
+    finalize_task.args(task_id=task_id, time_finished=datetime.now(), error='', success=True)
+
+
+def rebuild_credentials():
+    stmt = users.update().where(users.c.id == task_id).values(**creds).returning(users.c.email)
+    stmt.compile(dialect=dialect)
+
+
+def registry_credentials():
+    update_credentials.args(user_id=task_id, **creds)
+
+
+def rebuild_insert():
+    insert(tasks).values(**row).compile(dialect=dialect)
+
+
+def registry_insert():
+    statements.insert(tasks, row.keys()).args(**row)
+
+
+def main(iterations: int) -> None:
+    cases = [
+        ('_finalize_task', rebuild_finalize, registry_finalize),
+        ('updateCredentials', rebuild_credentials, registry_credentials),
+        ('insertRow', rebuild_insert, registry_insert),
+    ]
+
+    print(f'{"statement":<20}{"rebuilt (us)":>14}{"registry (us)":>15}{"speedup":>10}')
+    for name, rebuilt, registry in cases:
+        # Warm the registry so compile-once cost isn't counted per call
+        registry()
+        before = timeit.timeit(rebuilt, number=iterations) / iterations * 1e6
+        after = timeit.timeit(registry, number=iterations) / iterations * 1e6
+        print(f'{name:<20}{before:>14.1f}{after:>15.1f}{before / after:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -21,7 +21,8 @@ from app.db import metadata
 
 
 
-config.set_main_option('sqlalchemy.url', str(Config.DATABASE_URL))
+if not config.get_main_option('sqlalchemy.url'):
+    config.set_main_option('sqlalchemy.url', str(Config.DATABASE_URL))
 target_metadata = metadata
 
 # Interpret the config file for Python logging.
@@ -67,6 +68,19 @@ def run_migrations_online():
     and associate a connection with the context.
 
     """
+    # app.db.schema hands over the connection it holds the schema lock on
+    connection = config.attributes.get("connection", None)
+
+    if connection is not None:
+        context.configure(
+            connection=connection, target_metadata=target_metadata, compare_type=True
+        )
+
+        with context.begin_transaction():
+            context.run_migrations()
+
+        return
+
     connectable = engine_from_config(
         config.get_section(config.config_ini_section),
         prefix="sqlalchemy.",
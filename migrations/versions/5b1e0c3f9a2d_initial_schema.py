@@ -0,0 +1,57 @@
+"""initial schema
+
+Revision ID: 5b1e0c3f9a2d
+Revises: 
+Create Date: 2026-10-18 09:12:44.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '5b1e0c3f9a2d'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'users',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('email', sa.String(length=100), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=True),
+        sa.Column('permission_level', sa.Enum('NONE', 'BASE', 'PAID', 'ADMIN', 'SUPER', name='permissionlevel'), nullable=False),
+        sa.Column('verified', sa.Boolean(), nullable=True),
+        sa.Column('phone_number', sa.String(length=20), nullable=True),
+        sa.Column('last_fetch', sa.DateTime(), nullable=True),
+        sa.Column('token', sa.String(), nullable=True),
+        sa.Column('refresh_token', sa.String(), nullable=True),
+        sa.Column('token_uri', sa.String(), nullable=True),
+        sa.Column('client_id', sa.String(), nullable=True),
+        sa.Column('client_secret', sa.String(), nullable=True),
+        sa.Column('scopes', postgresql.ARRAY(sa.String()), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email'),
+        sa.UniqueConstraint('id')
+    )
+    op.create_table(
+        'tasks',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('owner', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('task_type', sa.Enum('DB_INSERT', 'DB_LOOKUP', 'DB_UPDATE', 'HERMES', 'USER_NODES', 'AUTHENTICATE', 'NEW_USER', name='tasktypes'), nullable=True),
+        sa.Column('time_start', sa.DateTime(), nullable=True),
+        sa.Column('time_finished', sa.DateTime(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('success', sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(['owner'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('tasks')
+    op.drop_table('users')
+    sa.Enum(name='tasktypes').drop(op.get_bind(), checkfirst=True)
+    sa.Enum(name='permissionlevel').drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,36 @@
+"""tasks owner, time_start, id index
+
+Revision ID: 9c4d7e21b8f6
+Revises: 5b1e0c3f9a2d
+Create Date: 2026-10-18 09:30:02.771940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4d7e21b8f6'
+down_revision = '5b1e0c3f9a2d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Built concurrently so existing task tables stay writable
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_tasks_owner_time_start_id',
+            'tasks',
+            ['owner', 'time_start', 'id'],
+            postgresql_concurrently=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_tasks_owner_time_start_id',
+            table_name='tasks',
+            postgresql_concurrently=True
+        )
@@ -0,0 +1,119 @@
+"""partition tasks by month, add task_rollups
+
+Revision ID: e3a8f5d06c41
+Revises: 9c4d7e21b8f6
+Create Date: 2026-10-18 11:04:37.502118
+
+"""
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a8f5d06c41'
+down_revision = '9c4d7e21b8f6'
+branch_labels = None
+depends_on = None
+
+# Monthly partitions created past the current month. The retention job
+# keeps this window topped up from then on
+MONTHS_AHEAD = 2
+
+task_types = postgresql.ENUM(name='tasktypes', create_type=False)
+
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def _create_month_partition(start):
+    end = _add_months(start, 1)
+    op.execute(
+        f"CREATE TABLE tasks_{start.year:04d}_{start.month:02d} PARTITION OF tasks "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    )
+
+
+def upgrade():
+    # Index and constraint names are global, so the old table's are moved
+    # out of the way before the partitioned table takes them
+    op.rename_table('tasks', 'tasks_unpartitioned')
+    op.execute('ALTER TABLE tasks_unpartitioned RENAME CONSTRAINT tasks_pkey TO tasks_unpartitioned_pkey')
+    op.execute('ALTER INDEX ix_tasks_owner_time_start_id RENAME TO ix_tasks_unpartitioned_owner_time_start_id')
+
+    op.create_table(
+        'tasks',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('owner', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('task_type', task_types, nullable=True),
+        sa.Column('time_start', sa.DateTime(), nullable=False),
+        sa.Column('time_finished', sa.DateTime(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('success', sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(['owner'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id', 'time_start'),
+        postgresql_partition_by='RANGE (time_start)'
+    )
+    op.create_index('ix_tasks_owner_time_start_id', 'tasks', ['owner', 'time_start', 'id'])
+    op.create_index('ix_tasks_task_type', 'tasks', ['task_type'])
+    op.execute('CREATE TABLE tasks_default PARTITION OF tasks DEFAULT')
+
+    first = op.get_bind().execute(
+        sa.text('SELECT min(COALESCE(time_start, time_finished)) FROM tasks_unpartitioned')
+    ).scalar()
+
+    month = (first or datetime.now()).date().replace(day=1)
+    last = _add_months(date.today().replace(day=1), MONTHS_AHEAD)
+    while month <= last:
+        _create_month_partition(month)
+        month = _add_months(month, 1)
+
+    op.execute('''
+    INSERT INTO tasks (id, owner, task_type, time_start, time_finished, error, success)
+    SELECT id, owner, task_type, COALESCE(time_start, time_finished, now()),
+           time_finished, error, success
+    FROM tasks_unpartitioned
+    ''')
+    op.drop_table('tasks_unpartitioned')
+
+    op.create_table(
+        'task_rollups',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('task_type', task_types, nullable=False),
+        sa.Column('total', sa.BigInteger(), nullable=False),
+        sa.Column('succeeded', sa.BigInteger(), nullable=False),
+        sa.Column('failed', sa.BigInteger(), nullable=False),
+        sa.Column('total_seconds', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'task_type')
+    )
+
+
+def downgrade():
+    op.drop_table('task_rollups')
+
+    op.rename_table('tasks', 'tasks_partitioned')
+    op.execute('ALTER TABLE tasks_partitioned RENAME CONSTRAINT tasks_pkey TO tasks_partitioned_pkey')
+    op.execute('ALTER INDEX ix_tasks_owner_time_start_id RENAME TO ix_tasks_partitioned_owner_time_start_id')
+    op.execute('ALTER INDEX ix_tasks_task_type RENAME TO ix_tasks_partitioned_task_type')
+
+    op.create_table(
+        'tasks',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('owner', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('task_type', task_types, nullable=True),
+        sa.Column('time_start', sa.DateTime(), nullable=True),
+        sa.Column('time_finished', sa.DateTime(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('success', sa.Boolean(), nullable=True),
+        sa.ForeignKeyConstraint(['owner'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('INSERT INTO tasks SELECT * FROM tasks_partitioned')
+    op.create_index('ix_tasks_owner_time_start_id', 'tasks', ['owner', 'time_start', 'id'])
+
+    # Dropping the parent drops every partition with it
+    op.drop_table('tasks_partitioned')
@@ -0,0 +1,17 @@
+import pytest
+
+# Runs `async def` tests and fixtures on the `loop` fixture, and provides
+# aiohttp_server for stand-in HTTP endpoints
+pytest_plugins = 'aiohttp.pytest_plugin'
+
+
+@pytest.fixture
+async def redis(loop):
+    ''' An in-memory Redis speaking the aioredis 1.x API '''
+    import fakeredis.aioredis
+
+    pool = await fakeredis.aioredis.create_redis_pool()
+    yield pool
+
+    pool.close()
+    await pool.wait_closed()
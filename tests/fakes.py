@@ -0,0 +1,49 @@
+from typing import Callable, Dict, List, Optional, Union
+
+Answer = Union[None, Dict[str, any], List[Dict[str, any]], Callable[..., any]]
+
+
+class FakeDatabase:
+    '''
+    Stands in for the `databases` pool behind compiled statements. Queries
+    are answered from `answers`, keyed by a fragment of their SQL. An answer
+    is a row, a list of rows, or a callable taking the query's args
+    '''
+
+    def __init__(self, answers: Optional[Dict[str, Answer]] = None) -> None:
+        self.answers = answers or {}
+        self.queries: List[str] = []
+
+    def connection(self) -> 'FakeConnection':
+        return FakeConnection(self)
+
+    def answer(self, sql: str, args: tuple) -> Answer:
+        self.queries.append(sql)
+        for fragment, answer in self.answers.items():
+            if fragment in sql:
+                return answer(*args) if callable(answer) else answer
+        return None
+
+
+class FakeConnection:
+    def __init__(self, database: FakeDatabase) -> None:
+        self.database = database
+        self.raw_connection = self
+
+    async def __aenter__(self) -> 'FakeConnection':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+    async def fetchrow(self, sql: str, *args) -> Optional[Dict[str, any]]:
+        answer = self.database.answer(sql, args)
+        return answer[0] if isinstance(answer, list) else answer
+
+    async def fetch(self, sql: str, *args) -> List[Dict[str, any]]:
+        answer = self.database.answer(sql, args)
+        return answer if isinstance(answer, list) else [answer] if answer else []
+
+    async def execute(self, sql: str, *args) -> str:
+        self.database.answer(sql, args)
+        return 'OK'
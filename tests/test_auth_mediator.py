@@ -0,0 +1,52 @@
+import json
+import time
+
+from types import SimpleNamespace
+
+import jwt
+import pytest
+
+from app.db import TaskTypes
+from app.helpers.tokens import token_cache
+from app.helpers.userCache import user_cache
+from app.routes.base import create_user
+from app.workers.mediators import AuthMediator
+
+from fakes import FakeDatabase
+
+SECRET = 'test-secret-' + 'x' * 32
+
+
+@pytest.fixture
+def token():
+    token_cache.secret = SECRET
+    claims = {'email': 'someone@example.com', 'name': 'Someone', 'verified': True,
+              'phone': None, 'exp': time.time() + 60}
+    yield jwt.encode(claims, SECRET).decode('utf-8')
+    token_cache.secret = None
+    token_cache.clear()
+    user_cache.local.clear()
+
+
+async def test_lost_race_with_no_row_is_an_error_not_a_crash(loop, token):
+    # The upsert conflicts, and the conflicting row is gone again by the
+    # time it's selected
+    database = FakeDatabase({'INSERT INTO users': None, 'FROM users': None})
+
+    auth_obj = await AuthMediator(database, '', TaskTypes['AUTHENTICATE']).handleJWT(token)
+
+    assert not auth_obj.successful
+    assert 'neither created nor found' in auth_obj.errors[0]
+    assert auth_obj.hermes_user == {}
+
+
+async def test_create_user_fails_when_the_mediator_does(loop, token):
+    request = SimpleNamespace(
+        app=SimpleNamespace(database=FakeDatabase()),
+        body=json.dumps({'token': token}).encode()
+    )
+
+    response = await create_user(request)
+
+    assert response.status == 500
+    assert b'neither created nor found' in response.body
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+from types import SimpleNamespace
+
+import jwt
+import pytest
+
+from app.helpers.authorized import TokenAuth, withOauth, _background
+from app.helpers.tokens import token_cache
+
+SECRET = 'test-secret-' + 'x' * 32
+
+
+def make_request(body: bytes = b'', headers: dict = None, sample_rate: float = 0.0):
+    app = SimpleNamespace(
+        database=None,
+        config=SimpleNamespace(LOGIN_TRACK_SAMPLE_RATE=sample_rate)
+    )
+    return SimpleNamespace(app=app, body=body, headers=headers or {})
+
+
+@withOauth(fast=True)
+async def handler(request, auth_obj):
+    return auth_obj
+
+
+@pytest.fixture
+def token():
+    token_cache.secret = SECRET
+    token_cache.clear()
+    token = jwt.encode({'email': 'someone@example.com', 'exp': time.time() + 60}, SECRET)
+    yield token.decode('utf-8') if isinstance(token, bytes) else token
+    token_cache.secret = None
+    token_cache.clear()
+
+
+@pytest.mark.parametrize('body', [b'{not json', b'["token"]', b'"token"', b'\xff'])
+async def test_fast_path_rejects_bad_bodies(loop, body):
+    response = await handler(make_request(body))
+    assert response.status == 400
+
+
+async def test_fast_path_reads_the_bearer_token(loop, token):
+    auth_obj = await handler(make_request(headers={'Authorization': f'Bearer {token}'}))
+    assert auth_obj.claims['email'] == 'someone@example.com'
+
+
+async def test_background_login_tracking_is_held_and_logged(loop, token, monkeypatch, capsys):
+    async def failing_track_login(self):
+        raise RuntimeError('redis is down')
+
+    monkeypatch.setattr(TokenAuth, 'track_login', failing_track_login)
+
+    await handler(make_request(f'{{"token": "{token}"}}'.encode(), sample_rate=1.0))
+    assert len(_background) == 1
+
+    await asyncio.gather(*_background, return_exceptions=True)
+    await asyncio.sleep(0)
+
+    assert not _background
+    assert 'redis is down' in capsys.readouterr().out
@@ -0,0 +1,86 @@
+import enum
+import json
+
+from datetime import datetime
+from uuid import UUID
+
+import pytest
+
+from sqlalchemy import Column, DateTime, Enum, LargeBinary, MetaData, String, Table
+from sqlalchemy.dialects.postgresql import UUID as UUIDType, ARRAY
+
+from app.helpers import codec
+from app.helpers.codec import RowEncoder, dumps_tagged, encoder_for, json_response, loads_tagged
+
+
+class Color(enum.Enum):
+    RED = 1
+    BLUE = 2
+
+
+things = Table(
+    'things', MetaData(),
+    Column('id', UUIDType, primary_key=True),
+    Column('created', DateTime),
+    Column('color', Enum(Color)),
+    Column('blob', LargeBinary),
+    Column('tags', ARRAY(String)),
+    Column('name', String),
+)
+
+ROW = {
+    'id': UUID('6f1c2b0e-4d4a-4c55-9a43-1d2f3e4a5b6c'),
+    'created': datetime(2020, 3, 4, 5, 6, 7),
+    'color': Color.BLUE,
+    'blob': b'\x00\xffraw',
+    'tags': ('a', 'b'),
+    'name': 'Zoë',
+}
+
+ENCODED = {
+    'id': '6f1c2b0e-4d4a-4c55-9a43-1d2f3e4a5b6c',
+    'created': '03/04/2020, 05:06:07',
+    'color': 'BLUE',
+    'blob': 'AP9yYXc=',
+    'tags': ['a', 'b'],
+    'name': 'Zoë',
+}
+
+
+@pytest.mark.parametrize('backend', sorted(codec.BACKENDS))
+def test_encoded_rows_round_trip_on_every_backend(backend):
+    body = codec.BACKENDS[backend](RowEncoder(things).encode(ROW))
+
+    assert isinstance(body, bytes)
+    assert json.loads(body) == ENCODED
+
+
+def test_missing_and_null_columns():
+    encoded = RowEncoder(things).encode({'id': ROW['id'], 'created': None})
+
+    assert encoded == {'id': ENCODED['id'], 'created': None}
+
+
+def test_encoders_are_built_once_per_table():
+    assert encoder_for(things) is encoder_for(things)
+
+
+def test_fastest_installed_backend_is_used():
+    assert codec.dumps is codec.BACKENDS[codec.BACKEND]
+    assert codec.BACKEND == next(b for b in ('orjson', 'ujson', 'json') if b in codec.BACKENDS)
+
+
+def test_json_response_nests_rows_as_objects():
+    response = json_response({'status': 'Success', 'user': RowEncoder(things).encode(ROW)}, 201)
+
+    assert response.status == 201
+    assert response.content_type == 'application/json'
+    assert json.loads(response.body)['user'] == ENCODED
+
+
+def test_tagged_round_trip_restores_types():
+    restored = loads_tagged(dumps_tagged([ROW]).encode('utf-8'))[0]
+
+    assert restored == {**ROW, 'color': 'BLUE', 'tags': ['a', 'b']}
+    assert isinstance(restored['id'], UUID)
+    assert isinstance(restored['blob'], bytes)
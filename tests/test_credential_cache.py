@@ -0,0 +1,74 @@
+from app.helpers.credentialCache import CredentialCache
+
+from fakes import FakeDatabase
+
+SID = 'session-1'
+USER_ID = '0b7e1a52-9d0c-4f3e-8a61-2c3d4e5f6a7b'
+
+
+def creds(token: str, refresh_token: str = 'refresh-1') -> dict:
+    return {
+        'token': token,
+        'refresh_token': refresh_token,
+        'token_uri': 'https://oauth2.googleapis.com/token',
+        'client_id': 'test.apps.googleusercontent.com',
+        'client_secret': 'test-secret',
+        'scopes': ['https://www.googleapis.com/auth/gmail.readonly'],
+    }
+
+
+def cache(stored: dict) -> CredentialCache:
+    cache = CredentialCache()
+    cache.database = FakeDatabase({'FROM users WHERE users.id': stored})
+    return cache
+
+
+async def test_hits_skip_the_database(loop):
+    credentials = cache(creds('access-1'))
+
+    first = await credentials.get(SID, creds('access-1'), USER_ID)
+    second = await credentials.get(SID, creds('access-1'), USER_ID)
+
+    assert first is second
+    assert len(credentials.database.queries) == 1
+    assert (credentials.hits, credentials.misses) == (1, 1)
+
+
+async def test_changed_session_creds_rebuild(loop):
+    credentials = cache(creds('access-1'))
+    await credentials.get(SID, creds('access-1'), USER_ID)
+
+    rebuilt = await credentials.get(SID, creds('access-2', 'refresh-2'), USER_ID)
+
+    assert rebuilt.token == 'access-2'
+    assert credentials.misses == 2
+
+
+async def test_refreshed_token_of_the_same_grant_is_used(loop):
+    # The refresher wrote a new access token after the session was created
+    credentials = cache(creds('refreshed'))
+
+    built = await credentials.get(SID, creds('from-login'), USER_ID)
+    assert built.token == 'refreshed'
+
+    # Cached against the session once it holds the refreshed token
+    assert await credentials.get(SID, creds('refreshed'), USER_ID) is built
+
+
+async def test_another_users_stored_creds_are_never_used(loop):
+    # The session points its user id at someone else, eg via /authorize
+    credentials = cache(creds('victim-access', 'victim-refresh'))
+
+    built = await credentials.get(SID, creds('own-access', 'own-refresh'), USER_ID)
+
+    assert built.token == 'own-access'
+    assert built.refresh_token == 'own-refresh'
+
+
+async def test_session_without_user_id_skips_the_database(loop):
+    credentials = cache(creds('refreshed'))
+
+    built = await credentials.get(SID, creds('from-login'))
+
+    assert built.token == 'from-login'
+    assert credentials.database.queries == []
@@ -0,0 +1,162 @@
+import time
+
+import pytest
+
+from app.helpers.tokenExchange import TokenExchangeError
+from app.workers import credentialRefresh
+from app.workers.credentialRefresh import CredentialRefresher
+
+from fakes import FakeDatabase
+
+STORED = {
+    'token': 'access-1',
+    'refresh_token': 'refresh-1',
+    'token_uri': 'https://oauth2.googleapis.com/token',
+    'client_id': 'test.apps.googleusercontent.com',
+    'client_secret': 'test-secret',
+    'scopes': ['https://www.googleapis.com/auth/gmail.readonly'],
+}
+
+
+class FakeMediator:
+    ''' Stands in for AuthMediator, keeping the credentials it was handed '''
+    saved = {}
+
+    def __init__(self, database, user_id, task_type) -> None:
+        self.user_id = user_id
+        self.successful = True
+
+    async def _async_init(self) -> 'FakeMediator':
+        return self
+
+    async def updateCredentials(self, creds: dict) -> 'FakeMediator':
+        FakeMediator.saved[self.user_id] = creds
+        return self
+
+
+@pytest.fixture
+def refresher(redis, monkeypatch):
+    FakeMediator.saved = {}
+    monkeypatch.setattr(credentialRefresh, 'AuthMediator', FakeMediator)
+
+    refresher = CredentialRefresher(lead=300, batch_size=10, lease=120)
+    refresher.redis = redis
+    refresher.database = FakeDatabase({'FROM users WHERE users.id': STORED})
+    return refresher
+
+
+def token_endpoint(monkeypatch, reply) -> list:
+    ''' Answers refreshes with reply(creds), returning the creds it was sent '''
+    sent = []
+
+    async def refresh(creds):
+        sent.append(creds)
+        return reply(creds)
+
+    monkeypatch.setattr(credentialRefresh.token_exchange, 'refresh', refresh)
+    return sent
+
+
+def refused(error):
+    def reply(creds):
+        raise TokenExchangeError(f'token endpoint returned 400: {error}', error)
+    return reply
+
+
+async def score(refresher, user_id):
+    return await refresher.redis.zscore(refresher.key, user_id)
+
+
+async def test_only_users_due_within_lead_are_claimed(refresher):
+    now = time.time()
+    await refresher.track('due', now + 60)
+    await refresher.track('later', now + 3600)
+
+    assert await refresher._claim() == ['due']
+    # The claim holds the user for a lease, so it isn't claimed again
+    assert await score(refresher, 'due') > now + 60
+    assert await refresher._claim() == []
+
+
+async def test_already_expired_token_is_refreshed_and_rescheduled(refresher, monkeypatch):
+    expires_at = time.time() + 3600
+    sent = token_endpoint(monkeypatch, lambda creds: {'access_token': 'access-2', 'expires_at': expires_at})
+    await refresher.track('user-1', time.time() - 600)
+
+    assert await refresher.refresh_due() == 1
+
+    assert sent[0]['refresh_token'] == 'refresh-1'
+    saved = FakeMediator.saved['user-1']
+    assert saved['token'] == 'access-2'
+    # Not rotated, so the stored refresh token is kept
+    assert saved['refresh_token'] == 'refresh-1'
+    assert await score(refresher, 'user-1') == pytest.approx(expires_at)
+
+
+async def test_success_without_expiry_stops_tracking(refresher, monkeypatch):
+    token_endpoint(monkeypatch, lambda creds: {'access_token': 'access-2'})
+    await refresher.track('user-1', time.time())
+
+    await refresher.refresh_due()
+
+    assert FakeMediator.saved['user-1']['token'] == 'access-2'
+    assert await score(refresher, 'user-1') is None
+
+
+async def test_revoked_refresh_token_stops_tracking(refresher, monkeypatch):
+    token_endpoint(monkeypatch, refused('invalid_grant'))
+    await refresher.track('user-1', time.time())
+
+    assert await refresher.refresh_due() == 1
+
+    assert FakeMediator.saved == {}
+    assert await score(refresher, 'user-1') is None
+
+
+async def test_other_failures_are_retried_after_the_lease(refresher, monkeypatch):
+    token_endpoint(monkeypatch, refused('temporarily_unavailable'))
+    claimed_at = time.time()
+    await refresher.track('user-1', claimed_at)
+
+    await refresher.refresh_due()
+
+    assert FakeMediator.saved == {}
+    assert await score(refresher, 'user-1') >= claimed_at + refresher.lease
+    assert await refresher._claim() == []
+
+
+async def test_user_without_refresh_token_stops_tracking(refresher, monkeypatch):
+    sent = token_endpoint(monkeypatch, lambda creds: {'access_token': 'access-2'})
+    refresher.database.answers['FROM users WHERE users.id'] = {**STORED, 'refresh_token': None}
+    await refresher.track('user-1', time.time())
+
+    await refresher.refresh_due()
+
+    assert sent == []
+    assert await score(refresher, 'user-1') is None
+
+
+def stored_users(ids: list):
+    ''' Answers the backfill's keyset pages from a sorted list of user ids '''
+    def page(after, limit):
+        return [{'id': user_id} for user_id in ids if user_id > after][:limit]
+    return page
+
+
+async def test_backfill_schedules_unscheduled_users_once(refresher):
+    ids = [f'0000000{i}-0000-0000-0000-000000000000' for i in range(5)]
+    refresher.backfill_page = 2
+    refresher.database.answers['refresh_token IS NOT NULL'] = stored_users(ids)
+
+    # Scheduled at login, so its expiry is kept
+    expires_at = time.time() + 3600
+    await refresher.track(ids[0], expires_at)
+
+    assert await refresher.backfill() == 4
+    assert await score(refresher, ids[0]) == pytest.approx(expires_at)
+    assert await score(refresher, ids[4]) <= time.time()
+
+    # Another process starting up finds the marker and skips the scan
+    queries = len(refresher.database.queries)
+    assert await refresher.backfill() == 0
+    assert len(refresher.database.queries) == queries
@@ -0,0 +1,198 @@
+import asyncio
+
+from sqlalchemy import Column, ForeignKey, Integer, MetaData, String, Table
+from sqlalchemy.dialects import postgresql
+
+from app.db import TaskTypes
+from app.workers.mediators import DBMediator
+from app.workers.mediators import DBmediator
+
+metadata = MetaData()
+
+contacts = Table(
+    'contacts', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('email', String, unique=True),
+    Column('name', String),
+    Column('phone', String),
+)
+
+
+class InsertDatabase:
+    '''
+    Answers multi-row INSERT ... RETURNING statements, treating rows whose
+    email is in `existing` as conflicts that return nothing
+    '''
+
+    def __init__(self, existing=()) -> None:
+        self.existing = set(existing)
+        self.statements = []
+
+    async def fetch_all(self, stmt) -> list:
+        compiled = stmt.compile(dialect=postgresql.dialect())
+        self.statements.append(compiled)
+        rows = stmt.parameters
+        return [{'id': row['id']} for row in rows if row.get('email') not in self.existing]
+
+
+class CopyDatabase:
+    ''' Accepts binary COPYs, keeping the records sent per table '''
+
+    def __init__(self) -> None:
+        self.copied = {}
+        self.raw_connection = self
+
+    def connection(self) -> 'CopyDatabase':
+        return self
+
+    async def __aenter__(self) -> 'CopyDatabase':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+    async def copy_records_to_table(self, table_name, records, columns) -> None:
+        self.copied.setdefault(table_name, []).extend(records)
+
+
+def mediator(database) -> DBMediator:
+    return DBMediator(database, 'owner-1', TaskTypes['DB_INSERT'])
+
+
+def task_rows(count: int) -> list:
+    return [{'id': f'task-{i}', 'owner': 'owner-1', 'error': ''} for i in range(count)]
+
+
+async def staged(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def test_staged_chunks_add_up_in_ingest_stats(loop):
+    database = CopyDatabase()
+    loader = mediator(database)
+
+    await loader.loadTable('tasks', staged(task_rows(3), task_rows(2)), bulk=True, chunk_size=2)
+
+    stats = loader.ingest_stats['tasks']
+    assert len(database.copied['tasks']) == 5
+    assert stats['rows'] == 5
+    assert stats['chunks'] == 3
+    assert stats['failed_chunks'] == 0
+    assert stats['seconds'] > 0
+
+
+def contact(i: int, **extra) -> dict:
+    return {'id': i, 'email': f'user{i}@example.com', **extra}
+
+
+def conflict_loader(database) -> DBMediator:
+    loader = mediator(database)
+    loader.table_refs['contacts'] = contacts
+    return loader
+
+
+async def test_mixed_column_sets_get_one_statement_each(loop):
+    database = InsertDatabase()
+    loader = conflict_loader(database)
+    rows = [contact(1), contact(2, name='Two'), contact(3), contact(4, name='Four')]
+
+    await loader.handleConflicts('contacts', iter(rows), conflict_target=['email'])
+
+    assert len(database.statements) == 2
+    sql = [str(compiled) for compiled in database.statements]
+    assert 'name' not in sql[0].split('VALUES')[0]
+    assert 'name' in sql[1].split('VALUES')[0]
+    assert all('ON CONFLICT (email) DO NOTHING RETURNING contacts.id' in s for s in sql)
+    assert [r['rows'] for r in loader.conflict_reports['contacts']] == [2, 2]
+
+
+async def test_batches_split_at_the_bind_parameter_cap(loop, monkeypatch):
+    # Two columns a row, so at most three rows fit in a statement
+    monkeypatch.setattr(DBmediator, '_MAX_BIND_PARAMS', 6)
+    database = InsertDatabase()
+    loader = conflict_loader(database)
+
+    await loader.handleConflicts('contacts', iter([contact(i) for i in range(7)]))
+
+    assert [len(compiled.params) for compiled in database.statements] == [6, 6, 2]
+    assert [r['rows'] for r in loader.conflict_reports['contacts']] == [3, 3, 1]
+
+
+async def test_conflict_reports_count_returned_keys(loop):
+    database = InsertDatabase(existing={'user2@example.com', 'user5@example.com'})
+    loader = conflict_loader(database)
+
+    await loader.handleConflicts('contacts', iter([contact(i) for i in range(6)]), batch_size=3)
+
+    assert loader.conflict_reports['contacts'] == [
+        {'batch': 0, 'rows': 3, 'inserted': 2, 'skipped': 1},
+        {'batch': 1, 'rows': 3, 'inserted': 2, 'skipped': 1},
+    ]
+    assert loader.errors == []
+
+
+def table(name: str, *references: str) -> Table:
+    return Table(
+        name, metadata,
+        Column('id', Integer, primary_key=True),
+        *[Column(f'{ref}_id', Integer, ForeignKey(f'{ref}.id')) for ref in references]
+    )
+
+
+# a <- b, a <- c, (b, c) <- d, plus e referencing itself and the x <-> y cycle
+graph = {
+    'a': table('a'),
+    'b': table('b', 'a'),
+    'c': table('c', 'a'),
+    'd': table('d', 'b', 'c'),
+    'e': table('e', 'e'),
+    'x': table('x', 'y'),
+    'y': table('y', 'x'),
+}
+
+
+def level_names(*names: str) -> list:
+    levels = DBmediator._dependency_levels([(name, iter(())) for name in names], graph)
+    return [sorted(name for name, _ in level) for level in levels]
+
+
+def test_chain_loads_one_table_per_level():
+    assert level_names('d', 'b', 'a') == [['a'], ['b'], ['d']]
+
+
+def test_diamond_loads_its_sides_together():
+    assert level_names('d', 'c', 'b', 'a') == [['a'], ['b', 'c'], ['d']]
+
+
+def test_self_reference_does_not_block_its_table():
+    assert level_names('e', 'a') == [['a', 'e']]
+
+
+def test_references_outside_the_job_are_ignored():
+    assert level_names('d') == [['d']]
+
+
+def test_cycle_is_loaded_together_after_the_rest():
+    assert level_names('x', 'y', 'a') == [['a'], ['x', 'y']]
+
+
+async def test_loads_within_a_level_are_bounded(loop):
+    loader = mediator(None)
+    loader.table_refs.update(graph)
+    running, peak = 0, 0
+
+    async def load(table_name, input_gen, bulk, chunk_size):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    loader.loadTable = load
+    entries = [(name, iter(())) for name in ('a', 'b', 'c', 'e', 'x', 'y')]
+
+    await loader.handleDbInserts(entries, log_task=False, max_concurrency=2)
+
+    assert peak == 2
+    assert loader.errors == []
@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+from app.helpers.userCache import user_cache
+from app.workers.loginActivity import LoginActivity
+
+
+class FakeTransaction:
+    async def __aenter__(self) -> 'FakeTransaction':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+
+class RecordingDatabase:
+    '''
+    Counts statements, failing every one while `fail` is set. Updated users
+    are returned with an email made from their id
+    '''
+
+    def __init__(self) -> None:
+        self.fail = False
+        self.executed = 0
+
+    def transaction(self) -> FakeTransaction:
+        return FakeTransaction()
+
+    async def execute(self, *args, **kwargs) -> None:
+        if self.fail:
+            raise ConnectionError('database went away')
+        self.executed += 1
+
+    async def fetch_all(self, query: str, values: dict) -> list:
+        await self.execute(query, values)
+        return [
+            {'email': f'{value}@example.com'}
+            for key, value in values.items() if key.startswith('id_')
+        ]
+
+
+def activity(redis) -> LoginActivity:
+    activity = LoginActivity()
+    activity.redis = redis
+    activity.database = RecordingDatabase()
+    return activity
+
+
+async def leftover_keys(redis) -> list:
+    keys = await redis.keys(f'{LoginActivity.prefix}:*')
+    return sorted(key.decode('utf-8') for key in keys if not key.endswith(b':total'))
+
+
+async def test_flush_writes_and_releases_the_window(redis):
+    logins = activity(redis)
+    await logins.record('user-1')
+    await logins.record('user-2')
+
+    assert await logins.flush() == 2
+    # One tasks insert and one users update
+    assert logins.database.executed == 2
+    assert await leftover_keys(redis) == []
+    assert await logins.flush() == 0
+
+
+async def test_failed_flush_merges_the_window_back(redis):
+    logins = activity(redis)
+    await logins.record('user-1')
+    first = float(await redis.hget(logins.first_key, 'user-1'))
+
+    logins.database.fail = True
+    try:
+        await logins.flush()
+    except ConnectionError:
+        pass
+    else:
+        raise AssertionError('flush should re-raise the write error')
+
+    # Logins recorded meanwhile are added to the merged-back window
+    await logins.record('user-1')
+    assert await leftover_keys(redis) == [logins.count_key, logins.first_key, logins.last_key]
+    assert await redis.hget(logins.count_key, 'user-1') == b'2'
+    assert float(await redis.hget(logins.first_key, 'user-1')) == first
+
+    logins.database.fail = False
+    assert await logins.flush() == 1
+    assert await leftover_keys(redis) == []
+
+
+async def test_abandoned_claim_is_merged_back(redis):
+    logins = activity(redis)
+    await logins.record('user-1')
+
+    # A flusher that claimed the window and died before writing it
+    claim, counts, _, _ = await logins._claim_window()
+    assert counts == {b'user-1': b'1'}
+    await redis.zadd(logins.claims_key, time.time() - logins.claim_lease - 1, claim)
+
+    assert await logins.flush() == 1
+    assert await leftover_keys(redis) == []
+
+
+async def test_close_logs_flush_errors(redis):
+    logins = activity(redis)
+    await logins.record('user-1')
+    logins.database.fail = True
+    logins.flush_interval = 3600
+    logins._flusher = asyncio.ensure_future(logins._run())
+
+    await logins.close()
+
+    assert not logins.running
+    assert await redis.hget(logins.count_key, 'user-1') == b'1'
+
+
+async def test_flush_invalidates_cached_users(redis, monkeypatch):
+    monkeypatch.setattr(user_cache, 'redis', redis)
+    await user_cache.set('user-1@example.com', {'id': 'user-1', 'last_fetch': None})
+    await user_cache.set('user-2@example.com', {'id': 'user-2', 'last_fetch': None})
+
+    logins = activity(redis)
+    await logins.record('user-1')
+    assert await logins.flush() == 1
+
+    assert 'user-1@example.com' not in user_cache.local
+    assert not await redis.exists(user_cache._key('user-1@example.com'))
+    # Users without logins in the window keep their entry
+    assert await user_cache.get('user-2@example.com') is not None
+    user_cache.local.clear()
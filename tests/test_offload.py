@@ -0,0 +1,28 @@
+from concurrent.futures import ProcessPoolExecutor
+from json import loads
+
+from app.helpers.offload import Offloader
+
+
+async def test_small_payloads_run_inline_and_are_measured(loop):
+    offloader = Offloader(threshold=1024)
+    offloader.executor = ProcessPoolExecutor(max_workers=1)
+
+    try:
+        assert await offloader.run(loads, '{"token": "t"}', size=14) == {'token': 't'}
+        assert await offloader.run(loads, '[1]', size=2048) == [1]
+    finally:
+        offloader.close()
+
+    stats = offloader.stats['json.loads']
+    assert stats['inline']['calls'] == 1
+    assert stats['inline']['wait_total'] == 0.0
+    assert stats['offloaded']['calls'] == 1
+    assert stats['offloaded']['run_total'] >= 0.0
+
+
+async def test_calls_without_a_pool_are_still_measured(loop):
+    offloader = Offloader()
+
+    assert await offloader.run(loads, '{}', size=10 ** 9) == {}
+    assert offloader.stats['json.loads']['inline']['calls'] == 1
@@ -0,0 +1,55 @@
+import asyncio
+
+from collections import Counter
+
+from app.workers.partitions import HashRing
+from app.workers.pool import WorkerPool
+
+KEYS = [f'user-{i}' for i in range(2000)]
+
+
+def test_keys_map_to_the_same_partition_every_time():
+    first, second = HashRing(16), HashRing(16)
+
+    assert [first.get(key) for key in KEYS] == [second.get(key) for key in KEYS]
+    assert all(0 <= first.get(key) < 16 for key in KEYS)
+
+
+def test_keys_spread_over_every_partition():
+    ring = HashRing(16)
+    counts = Counter(ring.get(key) for key in KEYS)
+
+    assert len(counts) == 16
+    # Within a factor of two of an even share
+    assert max(counts.values()) < 2 * len(KEYS) / 16
+
+
+def test_adding_a_partition_moves_few_keys():
+    before, after = HashRing(16), HashRing(17)
+    moved = [key for key in KEYS if before.get(key) != after.get(key)]
+
+    # Only keys claimed by the new partition move
+    assert all(after.get(key) == 16 for key in moved)
+    assert len(moved) < len(KEYS) / 8
+
+
+async def test_jobs_for_one_key_run_in_order(loop):
+    pool = WorkerPool(min_workers=4, max_workers=4, maxsize=100, partitions=4)
+    pool.start()
+    done = {'user-1': [], 'user-2': []}
+
+    def job(key: str, seq: int):
+        async def run():
+            # Later jobs finish sooner, so only the partition keeps them in order
+            await asyncio.sleep(0.005 * (5 - seq))
+            done[key].append(seq)
+        return run
+
+    for seq in range(5):
+        for key in done:
+            assert pool.submit(job(key, seq), key=key)
+
+    await pool.close()
+
+    assert done == {'user-1': [0, 1, 2, 3, 4], 'user-2': [0, 1, 2, 3, 4]}
+    assert pool.metrics()['partitions_busy'] == 0
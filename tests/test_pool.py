@@ -0,0 +1,114 @@
+import asyncio
+
+from app.db import TaskTypes
+from app.workers.pool import WorkerPool
+
+
+def recorder(done: list, name: str, delay: float = 0):
+    async def job():
+        await asyncio.sleep(delay)
+        done.append(name)
+    return job
+
+
+async def test_close_drains_accepted_jobs(loop):
+    pool = WorkerPool(min_workers=1, max_workers=1, maxsize=10)
+    pool.start()
+    done = []
+
+    for name in ('a', 'b', 'c'):
+        assert pool.submit(recorder(done, name, 0.01), key='user-1')
+
+    await pool.close()
+
+    assert done == ['a', 'b', 'c']
+    assert not pool.submit(recorder(done, 'late'))
+
+
+async def test_close_cancels_after_drain_timeout(loop):
+    pool = WorkerPool(min_workers=1, max_workers=1, maxsize=10, drain_timeout=0.05)
+    pool.start()
+    done = []
+
+    pool.submit(recorder(done, 'slow', 10))
+    await pool.close()
+
+    assert done == []
+    assert pool.metrics()['workers'] == 0
+
+
+def blocker(release: asyncio.Event):
+    async def job():
+        await release.wait()
+    return job
+
+
+async def test_scales_up_with_waiting_jobs_up_to_max(loop):
+    pool = WorkerPool(min_workers=1, max_workers=3, maxsize=10)
+    pool.start()
+    release = asyncio.Event()
+
+    for _ in range(5):
+        assert pool.submit(blocker(release))
+
+    assert pool.metrics()['workers'] == 3
+
+    release.set()
+    await pool.close()
+
+
+async def test_idle_workers_retire_down_to_min(loop):
+    pool = WorkerPool(min_workers=1, max_workers=3, maxsize=10, idle_timeout=0.05)
+    pool.start()
+    done = []
+
+    for name in ('a', 'b', 'c'):
+        pool.submit(recorder(done, name, 0.01))
+    assert pool.metrics()['workers'] == 3
+
+    await asyncio.sleep(0.3)
+
+    assert sorted(done) == ['a', 'b', 'c']
+    assert pool.metrics()['workers'] == 1
+    await pool.close()
+
+
+async def test_interactive_lanes_run_before_ingest(loop):
+    pool = WorkerPool(min_workers=1, max_workers=1, maxsize=10)
+    pool.start()
+    release = asyncio.Event()
+    done = []
+
+    # Occupies the only worker while the rest queue up
+    pool.submit(blocker(release))
+    await asyncio.sleep(0.01)
+
+    pool.submit(recorder(done, 'insert-1'), TaskTypes.DB_INSERT)
+    pool.submit(recorder(done, 'hermes'), TaskTypes.HERMES)
+    pool.submit(recorder(done, 'lookup'), TaskTypes.DB_LOOKUP)
+    pool.submit(recorder(done, 'auth'), TaskTypes.AUTHENTICATE)
+    pool.submit(recorder(done, 'insert-2'), TaskTypes.DB_INSERT)
+
+    release.set()
+    await pool.close()
+
+    assert done == ['auth', 'lookup', 'insert-1', 'insert-2', 'hermes']
+    assert set(pool.metrics()['queue_wait']) == {'DB_INSERT', 'HERMES', 'DB_LOOKUP', 'AUTHENTICATE'}
+
+
+async def test_submit_turns_jobs_away_when_full(loop):
+    pool = WorkerPool(min_workers=1, max_workers=1, maxsize=2)
+    pool.start()
+    release = asyncio.Event()
+
+    pool.submit(blocker(release))
+    await asyncio.sleep(0.01)
+
+    assert pool.submit(blocker(release))
+    assert pool.submit(blocker(release))
+    assert not pool.submit(blocker(release))
+    assert pool.rejected == 1
+    assert pool.metrics()['depth'] == 2
+
+    release.set()
+    await pool.close()
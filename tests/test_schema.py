@@ -0,0 +1,56 @@
+import os
+
+import pytest
+import sqlalchemy
+
+from app.db.schema import prepare_schema
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ALEMBIC_INI = os.path.join(ROOT, 'alembic.ini')
+
+# The latest revision in migrations/versions
+HEAD = 'e3a8f5d06c41'
+
+
+@pytest.fixture
+def database_url(tmp_path):
+    return f'sqlite:///{tmp_path / "schema.db"}'
+
+
+def stamp(database_url: str, revision: str) -> None:
+    engine = sqlalchemy.create_engine(database_url)
+    with engine.connect() as connection:
+        connection.execute('CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL)')
+        connection.execute('INSERT INTO alembic_version VALUES (?)', revision)
+    engine.dispose()
+
+
+def test_check_finds_the_migrations_in_the_tree(database_url):
+    with pytest.raises(RuntimeError) as e:
+        prepare_schema('check', database_url, ALEMBIC_INI)
+
+    assert HEAD in str(e.value)
+
+
+def test_check_passes_at_head(database_url):
+    stamp(database_url, HEAD)
+    prepare_schema('check', database_url, ALEMBIC_INI)
+
+
+def test_check_refuses_an_older_revision(database_url):
+    # The tasks(owner, time_start) index
+    stamp(database_url, '9c4d7e21b8f6')
+
+    with pytest.raises(RuntimeError):
+        prepare_schema('check', database_url, ALEMBIC_INI)
+
+
+def test_check_refuses_an_empty_script_location(database_url, tmp_path):
+    (tmp_path / 'versions').mkdir()
+    ini = tmp_path / 'alembic.ini'
+    ini.write_text(f'[alembic]\nscript_location = {tmp_path}\n')
+
+    with pytest.raises(RuntimeError) as e:
+        prepare_schema('check', database_url, str(ini))
+
+    assert 'no revisions' in str(e.value)
@@ -0,0 +1,83 @@
+import re
+
+import pytest
+
+from sqlalchemy.dialects import postgresql
+
+from app.db import TaskTypes, users, tasks
+from app.db.statements import statements
+
+_positional = re.compile(r'\$(\d+)')
+_named = re.compile(r'%\((\w+)\)s')
+
+
+def sentinel(name: str) -> str:
+    return f"'<{name}>'"
+
+
+@pytest.mark.parametrize('name', sorted(statements._statements))
+def test_placeholders_follow_argument_order(name):
+    statement = statements[name]
+    statement.args()
+
+    # The same clause compiled with named params, which can't be mis-ordered
+    named = str(statement._build().compile(
+        dialect=postgresql.dialect(),
+        column_keys=statement._column_keys
+    ))
+
+    positions = [int(n) for n in _positional.findall(statement.sql)]
+    assert sorted(set(positions)) == list(range(1, len(statement._names) + 1))
+    assert not re.search(r'(?<!:):\w', statement.sql.replace('::', ''))
+
+    by_position = _positional.sub(lambda m: sentinel(statement._names[int(m.group(1)) - 1]), statement.sql)
+    by_name = _named.sub(lambda m: sentinel(m.group(1)), named)
+    assert by_position == by_name
+
+
+@pytest.mark.parametrize('name', sorted(statements._statements))
+def test_arguments_bind_by_name(name):
+    statement = statements[name]
+    statement.args()
+    plain = [
+        param for param, processor in zip(statement._names, statement._processors)
+        if processor is None
+    ]
+
+    args = statement.args(**{param: f'<{param}>' for param in plain})
+
+    for param, value in zip(statement._names, args):
+        assert value == (f'<{param}>' if param in plain else None)
+
+
+def test_update_credentials_sql():
+    assert statements['update_credentials'].sql == (
+        'UPDATE users SET token=$1, refresh_token=$2, token_uri=$3, client_id=$4, '
+        'client_secret=$5, scopes=$6::VARCHAR[] WHERE users.id = $7 RETURNING users.email'
+    )
+
+
+def test_finalize_task_binds_in_sql_order():
+    statement = statements['finalize_task']
+    assert statement.sql == 'UPDATE tasks SET time_finished=$1, error=$2, success=$3 WHERE tasks.id = $4'
+
+    args = statement.args(task_id='task-1', success=True, error='boom', time_finished='now')
+    assert args == ['now', 'boom', True, 'task-1']
+
+
+def test_insert_new_user_matches_the_users_column_order():
+    # Its VALUES list has no column names, so it relies on table order
+    names = statements['insert_new_user']._names
+    columns = [column.name for column in users.columns][:len(names)]
+    assert columns == ['id', 'email', 'name', 'permission_level', 'verified',
+                       'phone_number', 'last_fetch']
+    assert all(column.startswith(name) for name, column in zip(names, columns))
+
+
+def test_enums_bind_as_their_names():
+    statement = statements.insert(tasks, ['id', 'task_type'])
+    args = statement.args(id='task-1', task_type=TaskTypes['DB_INSERT'])
+
+    assert statement.sql == 'INSERT INTO tasks (id, task_type) VALUES ($1, $2)'
+    assert args == ['task-1', 'DB_INSERT']
+    assert statements.insert(tasks, ['task_type', 'id']) is statement
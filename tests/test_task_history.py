@@ -0,0 +1,140 @@
+import base64
+import json
+import time
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from uuid import UUID, uuid4
+
+import jwt
+import pytest
+
+from sqlalchemy.dialects import postgresql
+
+from app.helpers.authorized import TokenAuth
+from app.helpers.tokens import token_cache
+from app.routes.base import _decode_cursor, _encode_cursor, _task_page_query, task_history
+
+SECRET = 'test-secret-' + 'x' * 32
+OWNER = '0b7e1a52-9d0c-4f3e-8a61-2c3d4e5f6a7b'
+
+
+def task_row(minutes_ago: int) -> dict:
+    return {
+        'id': uuid4(),
+        'owner': UUID(OWNER),
+        'task_type': 'DB_INSERT',
+        'time_start': datetime(2020, 1, 1, 12) - timedelta(minutes=minutes_ago),
+        'time_finished': None,
+        'error': '',
+        'success': False,
+    }
+
+
+class PageDatabase:
+    ''' Serves every query with the same rows, keeping the queries '''
+
+    def __init__(self, rows: list) -> None:
+        self.rows = rows
+        self.queries = []
+
+    async def iterate(self, query):
+        self.queries.append(query)
+        for row in self.rows:
+            yield row
+
+
+class Body:
+    def __init__(self) -> None:
+        self.chunks = []
+
+    async def write(self, data: bytes) -> None:
+        self.chunks.append(data)
+
+
+@pytest.fixture
+def bearer(monkeypatch):
+    async def load_user(self):
+        return {'id': UUID(OWNER)}
+
+    monkeypatch.setattr(TokenAuth, '_load_user', load_user)
+    token_cache.secret = SECRET
+    token = jwt.encode({'email': 'someone@example.com', 'exp': time.time() + 60}, SECRET)
+    yield {'Authorization': f'Bearer {token.decode("utf-8") if isinstance(token, bytes) else token}'}
+    token_cache.secret = None
+    token_cache.clear()
+
+
+async def history(bearer, rows, **args):
+    database = PageDatabase(rows)
+    request = SimpleNamespace(
+        app=SimpleNamespace(database=database, config=SimpleNamespace(LOGIN_TRACK_SAMPLE_RATE=0)),
+        body=b'',
+        headers=bearer,
+        args={name: str(value) for name, value in args.items()}
+    )
+
+    response = await task_history(request)
+    if response.status != 200:
+        return response, None
+
+    body = Body()
+    await response.streaming_fn(body)
+    return response, b''.join(body.chunks)
+
+
+def test_cursor_round_trips():
+    row = task_row(5)
+
+    assert _decode_cursor(_encode_cursor(row)) == (row['time_start'], row['id'])
+
+
+@pytest.mark.parametrize('cursor', [
+    '!!!',
+    base64.urlsafe_b64encode(b'\xff\xfe').decode('ascii'),
+    base64.urlsafe_b64encode(b'no separator').decode('ascii'),
+    base64.urlsafe_b64encode(b'2020-01-01T00:00:00|not-a-uuid').decode('ascii'),
+    base64.urlsafe_b64encode(b'yesterday|6f1c2b0e-4d4a-4c55-9a43-1d2f3e4a5b6c').decode('ascii'),
+    'é',
+])
+async def test_malformed_cursor_is_a_400(loop, bearer, cursor):
+    response, _ = await history(bearer, [], after=cursor)
+
+    assert response.status == 400
+    assert json.loads(response.body)['status'] == 'Error'
+
+
+def test_page_query_seeks_past_the_cursor():
+    after = (datetime(2020, 1, 1), UUID(OWNER))
+    sql = str(_task_page_query(OWNER, after, 10).compile(dialect=postgresql.dialect()))
+
+    assert '(tasks.time_start, tasks.id) < (' in sql
+    assert 'ORDER BY tasks.time_start DESC, tasks.id DESC' in sql
+    assert 'LIMIT' in sql
+    assert 'OFFSET' not in sql
+
+
+async def test_full_page_links_to_the_next_one(loop, bearer):
+    rows = [task_row(minutes) for minutes in range(3)]
+    response, body = await history(bearer, rows, limit=3, format='json')
+
+    page = json.loads(body)
+    assert response.content_type == 'application/json'
+    assert [task['id'] for task in page['tasks']] == [str(row['id']) for row in rows]
+    assert _decode_cursor(page['next']) == (rows[-1]['time_start'], rows[-1]['id'])
+
+
+async def test_short_page_is_the_last(loop, bearer):
+    rows = [task_row(minutes) for minutes in range(2)]
+    _, body = await history(bearer, rows, limit=3)
+
+    lines = [json.loads(line) for line in body.splitlines()]
+    assert len(lines) == 3
+    assert lines[-1] == {'next': None}
+
+
+async def test_limit_is_clamped(loop, bearer):
+    _, body = await history(bearer, [task_row(0)], limit=0)
+
+    # A limit of 0 is raised to 1, so the single row fills the page
+    assert json.loads(body.splitlines()[-1])['next'] is not None
@@ -0,0 +1,78 @@
+import asyncio
+
+from datetime import datetime
+
+from app.db import TaskTypes
+from app.workers.mediators import DBMediator
+from app.workers.taskLog import TaskLogWriter, task_log
+
+
+class BlockingDatabase:
+    ''' Holds every statement until `release` is set '''
+
+    def __init__(self) -> None:
+        self.release = asyncio.Event()
+        self.executed = 0
+
+    async def execute(self, *args, **kwargs) -> None:
+        await self.release.wait()
+        self.executed += 1
+
+
+def task_row(task_id: str) -> dict:
+    return {
+        'id': task_id,
+        'owner': 'owner-1',
+        'task_type': 'DB_INSERT',
+        'time_start': datetime.now(),
+        'time_finished': None,
+        'error': '',
+        'success': False,
+    }
+
+
+async def test_peek_sees_batch_being_flushed(loop):
+    writer = TaskLogWriter()
+    writer.database = BlockingDatabase()
+    writer._lock = asyncio.Lock()
+
+    writer.insert(task_row('task-1'))
+    writer.update('task-1', {'time_finished': datetime.now(), 'success': True})
+
+    flush = asyncio.ensure_future(writer.flush())
+    await asyncio.sleep(0)
+
+    # The buffer was swapped out but the row isn't committed yet
+    assert writer.pending == 0
+    assert writer.peek('task-1')['success'] is True
+
+    # An update that lands mid-flush is laid over the in-flight row
+    writer.update('task-1', {'error': 'late'})
+    assert writer.peek('task-1')['owner'] == 'owner-1'
+    assert writer.peek('task-1')['error'] == 'late'
+
+    writer.database.release.set()
+    await flush
+
+    assert writer.database.executed == 1
+    assert writer.peek('task-1') == {'error': 'late'}
+
+
+async def test_durable_task_row_skips_the_buffer(loop, monkeypatch):
+    class Database:
+        executed = 0
+
+        async def execute(self, *args, **kwargs) -> None:
+            self.executed += 1
+
+    # Stands in for a running flusher
+    monkeypatch.setattr(task_log, '_flusher', asyncio.Future())
+    database = Database()
+
+    buffered = await DBMediator(database, 'owner-1', TaskTypes['DB_INSERT'])._async_init()
+    durable = await DBMediator(database, 'owner-1', TaskTypes['DB_INSERT'])._async_init(durable=True)
+
+    assert database.executed == 1
+    assert task_log.peek(buffered.task_uuid)['owner'] == 'owner-1'
+    assert task_log.peek(durable.task_uuid) is None
+    task_log._inserts.clear()
@@ -0,0 +1,58 @@
+from app.workers.taskStatus import TaskStatusBoard, FINISHED
+
+from fakes import FakeDatabase
+
+TASK_ID = '6f1c2b0e-4d4a-4c55-9a43-1d2f3e4a5b6c'
+OWNER = '0b7e1a52-9d0c-4f3e-8a61-2c3d4e5f6a7b'
+
+
+def board(redis) -> TaskStatusBoard:
+    board = TaskStatusBoard()
+    board.redis = redis
+    return board
+
+
+async def test_task_finished_without_being_queued_keeps_its_owner(redis):
+    status = board(redis)
+    # Nothing in Postgres either, so the owner has to come from the board
+    database = FakeDatabase()
+
+    await status.finish(TASK_ID, True, owner=OWNER, task_type='DB_UPDATE')
+    found = await status.fetch(database, TASK_ID)
+
+    assert found['owner'] == OWNER
+    assert found['task_type'] == 'DB_UPDATE'
+    assert found['state'] == FINISHED
+    assert database.queries == []
+
+
+async def test_ownerless_hash_reads_owner_from_postgres(redis):
+    status = board(redis)
+    database = FakeDatabase({
+        'FROM tasks WHERE tasks.id': {
+            'owner': OWNER,
+            'task_type': 'DB_INSERT',
+            'time_finished': None,
+            'error': '',
+            'success': False,
+        },
+    })
+
+    # Progress published before anything recorded the owner
+    await status.add_rows(TASK_ID, 'emails', 10)
+    found = await status.fetch(database, TASK_ID)
+
+    assert found['owner'] == OWNER
+    assert found['rows'] == 10
+    assert len(database.queries) == 1
+
+    # The owner was written back, so the next poll stays in Redis
+    assert (await status.fetch(database, TASK_ID))['owner'] == OWNER
+    assert len(database.queries) == 1
+
+
+async def test_ownerless_hash_for_unknown_task_is_not_found(redis):
+    status = board(redis)
+    await status.add_rows(TASK_ID, 'emails', 10)
+
+    assert await status.fetch(FakeDatabase(), TASK_ID) is None
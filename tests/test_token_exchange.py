@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from aiohttp import web
+from google_auth_oauthlib.flow import Flow
+
+from app.helpers.tokenExchange import TokenExchange, TokenExchangeError
+
+REDIRECT_URI = 'http://localhost:5000/oauth2callback'
+CLIENT_CONFIG = {
+    'web': {
+        'client_id': 'test.apps.googleusercontent.com',
+        'client_secret': 'test-secret',
+        'auth_uri': 'https://accounts.google.com/o/oauth2/auth',
+        'token_uri': 'https://oauth2.googleapis.com/token',
+        'redirect_uris': [REDIRECT_URI],
+    }
+}
+CALLBACK = f'{REDIRECT_URI}?state=state-1&code=code-1'
+
+
+def make_flow() -> Flow:
+    flow = Flow.from_client_config(
+        CLIENT_CONFIG,
+        scopes=['https://www.googleapis.com/auth/gmail.readonly'],
+        state='state-1'
+    )
+    flow.redirect_uri = REDIRECT_URI
+    flow.code_verifier = 'v' * 43
+    return flow
+
+
+@pytest.fixture
+async def token_endpoint(aiohttp_server):
+    '''
+    A stand-in token endpoint. Each test sets `reply` to a coroutine taking
+    the posted form, and the forms received are kept in `posted`
+    '''
+    endpoint = {'posted': [], 'reply': None}
+
+    async def token(request):
+        form = dict(await request.post())
+        endpoint['posted'].append(form)
+        return await endpoint['reply'](form)
+
+    app = web.Application()
+    app.router.add_post('/token', token)
+    server = await aiohttp_server(app)
+
+    endpoint['uri'] = str(server.make_url('/token'))
+    yield endpoint
+
+
+@pytest.fixture
+async def exchange(token_endpoint):
+    exchange = TokenExchange(timeout=0.5, max_concurrency=2, token_uri=token_endpoint['uri'])
+    yield exchange
+    await exchange.close()
+
+
+async def test_exchange_stores_token_on_the_flow(token_endpoint, exchange):
+    async def granted(form):
+        return web.json_response({
+            'access_token': 'access-1',
+            'refresh_token': 'refresh-1',
+            'expires_in': 3600,
+            'token_type': 'Bearer',
+        })
+
+    token_endpoint['reply'] = granted
+    flow = make_flow()
+
+    token = await exchange.fetch_token(flow, CALLBACK, 'state-1')
+
+    assert token['access_token'] == 'access-1'
+    assert 'expires_at' in token
+    assert flow.credentials.token == 'access-1'
+    assert flow.credentials.refresh_token == 'refresh-1'
+
+    form, = token_endpoint['posted']
+    assert form['grant_type'] == 'authorization_code'
+    assert form['code'] == 'code-1'
+    assert form['code_verifier'] == 'v' * 43
+    assert form['redirect_uri'] == REDIRECT_URI
+
+
+async def test_error_response_raises_with_the_oauth_error(token_endpoint, exchange):
+    async def refused(form):
+        return web.json_response(
+            {'error': 'invalid_grant', 'error_description': 'Bad Request'},
+            status=400
+        )
+
+    token_endpoint['reply'] = refused
+
+    with pytest.raises(TokenExchangeError) as e:
+        await exchange.fetch_token(make_flow(), CALLBACK, 'state-1')
+
+    assert e.value.error == 'invalid_grant'
+    assert '400' in e.value.message
+
+
+async def test_slow_endpoint_times_out(token_endpoint, exchange):
+    async def stalled(form):
+        await asyncio.sleep(5)
+        return web.json_response({'access_token': 'too-late'})
+
+    token_endpoint['reply'] = stalled
+
+    with pytest.raises(TokenExchangeError) as e:
+        await exchange.fetch_token(make_flow(), CALLBACK, 'state-1')
+
+    assert 'timed out' in e.value.message
+
+
+async def test_state_mismatch_never_reaches_the_endpoint(token_endpoint, exchange):
+    with pytest.raises(TokenExchangeError):
+        await exchange.fetch_token(make_flow(), CALLBACK, 'other-state')
+
+    assert token_endpoint['posted'] == []
+
+
+async def test_refresh_posts_a_refresh_grant(token_endpoint, exchange):
+    async def refreshed(form):
+        return web.json_response({'access_token': 'access-2', 'expires_in': 3600})
+
+    token_endpoint['reply'] = refreshed
+
+    token = await exchange.refresh({
+        'refresh_token': 'refresh-1',
+        'token_uri': 'https://oauth2.googleapis.com/token',
+        'client_id': 'test.apps.googleusercontent.com',
+        'client_secret': 'test-secret',
+    })
+
+    assert token['access_token'] == 'access-2'
+    assert 'refresh_token' not in token
+    assert token_endpoint['posted'][0]['grant_type'] == 'refresh_token'
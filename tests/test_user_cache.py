@@ -0,0 +1,46 @@
+from app.helpers.codec import loads_tagged
+from app.helpers.userCache import UserCache
+
+ROW = {
+    'id': 'user-1',
+    'email': 'someone@example.com',
+    'name': 'Someone',
+    'permission_level': 'BASE',
+    'verified': True,
+    'phone_number': None,
+    'last_fetch': None,
+    'token': 'access-1',
+    'refresh_token': 'refresh-1',
+    'token_uri': 'https://oauth2.googleapis.com/token',
+    'client_id': 'client-1',
+    'client_secret': 'secret-1',
+    'scopes': ['gmail.readonly'],
+}
+
+
+async def load():
+    return ROW
+
+
+async def test_only_profile_columns_are_cached(redis):
+    cache = UserCache()
+    cache.redis = redis
+
+    user = await cache.get_or_load(ROW['email'], load)
+
+    assert set(user) == set(UserCache.columns)
+    shared = loads_tagged(await redis.get(cache._key(ROW['email'])))
+    assert shared == user
+    assert 'refresh_token' not in shared and 'client_secret' not in shared
+
+
+async def test_invalidate_drops_every_email_from_both_tiers(redis):
+    cache = UserCache()
+    cache.redis = redis
+    await cache.set('a@example.com', {'id': 'a'})
+    await cache.set('b@example.com', {'id': 'b'})
+
+    await cache.invalidate('a@example.com', 'b@example.com')
+
+    assert len(cache.local) == 0
+    assert await redis.keys(f'{UserCache.prefix}*') == []